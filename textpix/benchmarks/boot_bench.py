@@ -0,0 +1,138 @@
+"""
+冷启动基准：进程启动到首个请求返回的耗时和导入的模块数
+
+用法（在 textpix/ 目录下执行）:
+    python benchmarks/boot_bench.py                      # 对比 full / api 两种启动配置
+    python benchmarks/boot_bench.py --profiles api --runs 10 --top 15
+    python benchmarks/boot_bench.py --check              # 超出 boot_budget.json 中的预算时返回非 0
+
+每次在全新的子进程中以 python -X importtime 启动：
+    boot           导入 textpix.wsgi（django.setup、加载 app 和中间件）
+    first_request  第一个 GET /api/health（加载 URL 配置和视图）
+子进程的 stderr 即 importtime 输出，用于统计模块数和累计耗时最多的模块
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUDGET_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'boot_budget.json')
+
+# 子进程：计时导入 WSGI 应用，再直接调用一次（不经过 django.test，避免额外导入）
+CHILD = r'''
+import io, json, sys, time
+HEAVY = %r
+started = time.perf_counter()
+before = len(sys.modules)
+from textpix.wsgi import application
+booted = time.perf_counter()
+environ = {
+    'REQUEST_METHOD': 'GET', 'PATH_INFO': '/api/health', 'QUERY_STRING': '',
+    'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'HTTP_HOST': 'localhost',
+    'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr, 'wsgi.url_scheme': 'http',
+}
+status = []
+body = b''.join(application(environ, lambda s, h, exc_info=None: status.append(s)))
+finished = time.perf_counter()
+print(json.dumps({
+    'status': status[0],
+    'boot_ms': (booted - started) * 1000,
+    'first_request_ms': (finished - booted) * 1000,
+    'modules': len(sys.modules) - before,
+    'heavy': sorted(m for m in HEAVY if m in sys.modules),
+}))
+'''
+
+# 冷启动阶段不应加载的模块（在首次调用上游 / 渲染图片 / 剖析请求时才导入）
+HEAVY = ('httpx', 'PIL', 'urllib3', 'whitenoise', 'cProfile', 'pstats')
+
+
+def run_once(profile):
+    env = dict(os.environ, APP_PROFILE=profile, DJANGO_SETTINGS_MODULE='textpix.settings',
+               LOG_LEVEL='WARNING', AI_WARMUP_ON_STARTUP='False')
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', CHILD % (HEAVY,)],
+        cwd=PROJECT_DIR, env=env, capture_output=True, text=True, check=False
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"子进程失败 ({profile}):\n{proc.stderr[-2000:]}")
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result['imports'] = parse_importtime(proc.stderr)
+    return result
+
+
+def parse_importtime(stderr):
+    """解析 -X importtime 输出，返回 [(模块, 自身 us, 累计 us)]"""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        imports.append((name.strip(), int(self_us), int(cumulative_us)))
+    return imports
+
+
+def summarize(profile, results, top):
+    boot = statistics.median(r['boot_ms'] for r in results)
+    first = statistics.median(r['first_request_ms'] for r in results)
+    modules = results[0]['modules']
+    print(f"[{profile}] 启动 {boot:.1f} ms，首个请求 {first:.1f} ms，合计 {boot + first:.1f} ms，"
+          f"新导入模块 {modules} 个（{results[0]['status']}，中位数，{len(results)} 次）")
+    if results[0]['heavy']:
+        print(f"  已加载的重量级模块: {', '.join(results[0]['heavy'])}")
+
+    if top:
+        # 不列出标准库模块，便于看出项目和第三方包的开销
+        imports = sorted(
+            (item for item in results[0]['imports'] if item[0].split('.')[0] not in sys.stdlib_module_names),
+            key=lambda item: item[2], reverse=True
+        )
+        print(f"  {'模块':<48}{'累计 ms':>10}{'自身 ms':>10}")
+        for name, self_us, cumulative_us in imports[:top]:
+            print(f"  {name:<48}{cumulative_us / 1000:>10.1f}{self_us / 1000:>10.1f}")
+    return {'boot_ms': boot, 'first_request_ms': first, 'total_ms': boot + first, 'modules': modules,
+            'heavy': results[0]['heavy']}
+
+
+def check_budget(measured):
+    with open(BUDGET_FILE, encoding='utf-8') as f:
+        budget = json.load(f)
+
+    failures = []
+    for profile, values in measured.items():
+        for key, limit in budget.get(profile, {}).items():
+            if key == 'forbid':
+                loaded = sorted(set(limit) & set(values['heavy']))
+                if loaded:
+                    failures.append(f"{profile} 启动时加载了 {', '.join(loaded)}")
+            elif key in values and values[key] > limit:
+                failures.append(f"{profile}.{key} = {values[key]:.1f} > 预算 {limit}")
+    for failure in failures:
+        print(f"超出预算: {failure}")
+    if not failures:
+        print("全部在预算内")
+    return not failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--profiles', default='full,api', help='要测量的启动配置（APP_PROFILE），逗号分隔')
+    parser.add_argument('--runs', type=int, default=5, help='每种配置启动的次数（取中位数）')
+    parser.add_argument('--top', type=int, default=10, help='列出累计导入耗时最多的模块数（0 表示不列出）')
+    parser.add_argument('--check', action='store_true', help=f'与 {os.path.basename(BUDGET_FILE)} 对比，超出时返回 1')
+    args = parser.parse_args()
+
+    measured = {}
+    for profile in [p.strip() for p in args.profiles.split(',') if p.strip()]:
+        results = [run_once(profile) for _ in range(max(1, args.runs))]
+        measured[profile] = summarize(profile, results, args.top)
+
+    if args.check and not check_budget(measured):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,387 @@
+"""
+流式生成压测：对比不同部署方式（同步 worker / 线程 worker / ASGI）下的并发流能力
+
+用法（在 textpix/ 目录下执行）:
+    python benchmarks/loadtest.py --clients 50 --configs gunicorn-sync,gunicorn-gthread
+    python benchmarks/loadtest.py --clients 100 --config "custom=gunicorn -w 4 textpix.wsgi:application"
+
+流程:
+    1. 在本进程内启动模拟上游（兼容 OpenAI 流式接口），按设定的首 token 延迟和
+       token 间隔逐个推送 token
+    2. 依次以每种配置启动 Django 服务，指向模拟上游
+    3. N 个并发客户端请求 /api/generate-stream，统计：
+       - 同时处于接收中的流数量（持续并发 / 峰值并发）
+       - 首字节时间 TTFB（第一个 data: 行，通常是 accepted 事件）的 p50 / p99
+       - 首个内容时间（第一个带 content 的事件，含排队和等待上游首 token）的 p50 / p99
+       - 错误率（非 200、错误事件、没有收到 [DONE]）
+       - 每个流的内存开销（服务进程树 RSS 增量 / 峰值并发流数）
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shlex
+import shutil
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+from aiohttp import web
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 预置的部署方式（{port} 会被替换为实际端口）
+SERVING_CONFIGS = {
+    # 与 Dockerfile 相同：2 个同步 worker
+    'gunicorn-sync': 'gunicorn --bind 127.0.0.1:{port} --workers 2 --timeout 120 textpix.wsgi:application',
+    'gunicorn-gthread': 'gunicorn --bind 127.0.0.1:{port} --workers 2 --worker-class gthread --threads 32 --timeout 120 textpix.wsgi:application',
+    'uvicorn-asgi': 'uvicorn --host 127.0.0.1 --port {port} --workers 2 textpix.asgi:application',
+}
+
+# 模拟上游返回的文章内容
+SAMPLE_ARTICLE = json.dumps({
+    "title": "压测文章",
+    "intro": "这是一段用于压测的引导语，模拟真实模型输出的长度和节奏。",
+    "sections": [
+        {"title": f"版块{i + 1}", "items": [f"要点{j + 1}：模拟模型生成的一段要点内容" for j in range(4)]}
+        for i in range(4)
+    ],
+    "footer": "感谢阅读。"
+}, ensure_ascii=False)
+
+
+def tokenize(text, size=3):
+    """把文本切成近似 token 的小片段"""
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+# ==================== 模拟上游 ====================
+
+class FakeUpstream:
+    """兼容 OpenAI chat/completions 流式接口的模拟上游"""
+
+    def __init__(self, first_token_delay, token_interval, jitter):
+        self.first_token_delay = first_token_delay
+        self.token_interval = token_interval
+        self.jitter = jitter
+        self.port = free_port()
+        self.active_streams = 0
+        self._loop = None
+        self._runner = None
+
+    async def chat_completions(self, request):
+        await request.read()
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+        self.active_streams += 1
+        try:
+            await asyncio.sleep(self.first_token_delay)
+            for token in tokenize(SAMPLE_ARTICLE):
+                chunk = {"choices": [{"index": 0, "delta": {"content": token}}]}
+                await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+                await asyncio.sleep(max(0.0, self.token_interval + random.uniform(-self.jitter, self.jitter)))
+            await response.write(b"data: [DONE]\n\n")
+        except (ConnectionResetError, asyncio.CancelledError):
+            pass
+        finally:
+            self.active_streams -= 1
+        return response
+
+    async def models(self, request):
+        return web.json_response({"data": [{"id": "fake-model"}]})
+
+    def start(self):
+        ready = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            app = web.Application()
+            app.router.add_post('/v1/chat/completions', self.chat_completions)
+            app.router.add_get('/v1/models', self.models)
+            self._runner = web.AppRunner(app, access_log=None)
+            self._loop.run_until_complete(self._runner.setup())
+            self._loop.run_until_complete(web.TCPSite(self._runner, '127.0.0.1', self.port).start())
+            ready.set()
+            self._loop.run_forever()
+
+        threading.Thread(target=run, daemon=True).start()
+        ready.wait()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}/v1"
+
+
+# ==================== 被测服务 ====================
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def process_tree_rss(pid):
+    """读取进程及其所有子进程的 RSS（字节，仅 Linux）"""
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f'/proc/{current}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+                        break
+            for task in os.listdir(f'/proc/{current}/task'):
+                with open(f'/proc/{current}/task/{task}/children') as f:
+                    pending.extend(int(child) for child in f.read().split())
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+    return total
+
+
+class Server:
+    """以子进程方式启动被测服务"""
+
+    def __init__(self, command, upstream_url):
+        self.port = free_port()
+        self.command = command.format(port=self.port)
+        self.upstream_url = upstream_url
+        self.process = None
+        self._tmpdir = tempfile.TemporaryDirectory()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self, timeout=30):
+        env = dict(os.environ)
+        env.update({
+            'CUSTOM_AI_BASE_URL': self.upstream_url,
+            'CUSTOM_AI_API_KEY': 'loadtest-key',
+            'CUSTOM_AI_MODEL': 'fake-model',
+            'DEBUG': 'False',
+            'ALLOWED_HOSTS': '*',
+            'DATABASE_URL': f"sqlite:///{self._tmpdir.name}/loadtest.sqlite3",
+            'ARTICLE_STORE_ENABLED': 'False',
+        })
+        self.process = subprocess.Popen(
+            shlex.split(self.command), cwd=PROJECT_DIR, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True
+        )
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"服务启动失败: {self.command}")
+            try:
+                if httpx.get(f"{self.url}/api/health", timeout=1).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError(f"服务启动超时: {self.command}")
+
+    def rss(self):
+        return process_tree_rss(self.process.pid)
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            os.killpg(self.process.pid, signal.SIGTERM)
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                os.killpg(self.process.pid, signal.SIGKILL)
+        self._tmpdir.cleanup()
+
+
+# ==================== 压测客户端 ====================
+
+class Stats:
+    def __init__(self):
+        self.ttfb = []
+        self.first_content = []
+        self.durations = []
+        self.errors = 0
+        self.completed = 0
+        self.streaming = 0
+        self.samples = []
+        self.rss_samples = []
+
+
+async def run_client(client, url, stats, payload, timeout):
+    started = time.perf_counter()
+    first_byte = None
+    first_content = None
+    done = False
+    try:
+        async with client.stream('POST', f"{url}/api/generate-stream", json=payload, timeout=timeout) as response:
+            if response.status_code != 200:
+                # 未读到 [DONE]，在 finally 中计为错误
+                return
+            async for line in response.aiter_lines():
+                if not line.startswith('data: '):
+                    continue
+                if first_byte is None:
+                    first_byte = time.perf_counter()
+                    stats.ttfb.append(first_byte - started)
+                body = line[6:]
+                if body == '[DONE]':
+                    done = True
+                    break
+                if '"error"' in body:
+                    break
+                if first_content is None and '"content"' in body:
+                    first_content = time.perf_counter()
+                    stats.first_content.append(first_content - started)
+                    stats.streaming += 1
+    except httpx.HTTPError:
+        pass
+    finally:
+        if first_content is not None:
+            stats.streaming -= 1
+        if done:
+            stats.completed += 1
+            stats.durations.append(time.perf_counter() - started)
+        else:
+            stats.errors += 1
+
+
+async def sample(stats, server, stop_event, interval=0.1):
+    """周期性记录正在接收的流数量和服务进程内存"""
+    while not stop_event.is_set():
+        stats.samples.append(stats.streaming)
+        stats.rss_samples.append(server.rss())
+        await asyncio.sleep(interval)
+
+
+async def drive(server, clients, ramp, timeout):
+    stats = Stats()
+    payload = {"theme": "压测", "content": "生成一篇用于压测的文章", "templateType": "normal"}
+    limits = httpx.Limits(max_connections=clients + 10, max_keepalive_connections=clients + 10)
+    stop_event = asyncio.Event()
+
+    async with httpx.AsyncClient(limits=limits) as client:
+        sampler = asyncio.create_task(sample(stats, server, stop_event))
+        tasks = []
+        for i in range(clients):
+            tasks.append(asyncio.create_task(run_client(client, server.url, stats, payload, timeout)))
+            if ramp:
+                await asyncio.sleep(ramp / clients)
+        await asyncio.gather(*tasks)
+        stop_event.set()
+        await sampler
+    return stats
+
+
+def percentile(values, pct):
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def run_config(name, command, upstream, args):
+    executable = shlex.split(command)[0]
+    if shutil.which(executable) is None:
+        return {"config": name, "skipped": f"{executable} 未安装"}
+
+    server = Server(command, upstream.base_url)
+    try:
+        server.start()
+        # 预热一次，排除首个请求的冷启动开销
+        asyncio.run(drive(server, 1, 0, args.timeout))
+        baseline_rss = server.rss()
+        stats = asyncio.run(drive(server, args.clients, args.ramp, args.timeout))
+    finally:
+        server.stop()
+
+    peak = max(stats.samples or [0])
+    # 持续并发：采样中处于接收状态的流数量的中位数（只统计有流在跑的采样点）
+    busy = [value for value in stats.samples if value > 0]
+    sustained = statistics.median(busy) if busy else 0
+    peak_rss = max(stats.rss_samples or [baseline_rss])
+    return {
+        "config": name,
+        "clients": args.clients,
+        "sustained_streams": sustained,
+        "peak_streams": peak,
+        "ttfb_p50_ms": percentile(stats.ttfb, 50) * 1000,
+        "ttfb_p99_ms": percentile(stats.ttfb, 99) * 1000,
+        "first_content_p50_ms": percentile(stats.first_content, 50) * 1000,
+        "first_content_p99_ms": percentile(stats.first_content, 99) * 1000,
+        "duration_p50_s": percentile(stats.durations, 50),
+        "error_rate": stats.errors / args.clients,
+        "rss_baseline_mb": baseline_rss / 2 ** 20,
+        "memory_per_stream_kb": (peak_rss - baseline_rss) / max(peak, 1) / 1024,
+    }
+
+
+def print_report(results):
+    header = f"{'配置':<20}{'持续并发':>10}{'峰值并发':>10}{'TTFB p50':>12}{'TTFB p99':>12}{'首内容 p50':>12}{'首内容 p99':>12}{'错误率':>10}{'内存/流':>12}"
+    print(header)
+    print('-' * len(header))
+    for result in results:
+        if 'skipped' in result:
+            print(f"{result['config']:<20}跳过：{result['skipped']}")
+            continue
+        print(
+            f"{result['config']:<20}"
+            f"{result['sustained_streams']:>10.0f}"
+            f"{result['peak_streams']:>10}"
+            f"{result['ttfb_p50_ms']:>10.0f}ms"
+            f"{result['ttfb_p99_ms']:>10.0f}ms"
+            f"{result['first_content_p50_ms']:>10.0f}ms"
+            f"{result['first_content_p99_ms']:>10.0f}ms"
+            f"{result['error_rate']:>10.1%}"
+            f"{result['memory_per_stream_kb']:>10.0f}KB"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=20, help='并发客户端数量')
+    parser.add_argument('--ramp', type=float, default=1.0, help='所有客户端在多少秒内陆续发起（0 为同时发起）')
+    parser.add_argument('--timeout', type=float, default=120.0, help='单个请求超时（秒）')
+    parser.add_argument('--first-token-delay', type=float, default=0.8, help='模拟上游首 token 延迟（秒）')
+    parser.add_argument('--token-interval', type=float, default=0.03, help='模拟上游 token 间隔（秒）')
+    parser.add_argument('--jitter', type=float, default=0.01, help='token 间隔随机抖动（秒）')
+    parser.add_argument('--configs', default='gunicorn-sync,gunicorn-gthread,uvicorn-asgi',
+                        help=f"要对比的预置配置（可选: {', '.join(SERVING_CONFIGS)}）")
+    parser.add_argument('--config', action='append', default=[], metavar='NAME=COMMAND',
+                        help='自定义服务启动命令，{port} 会被替换为端口，可重复指定')
+    parser.add_argument('--json', metavar='PATH', help='同时把结果写入 JSON 文件')
+    args = parser.parse_args()
+
+    configs = [(name, SERVING_CONFIGS[name]) for name in args.configs.split(',') if name]
+    for item in args.config:
+        name, _, command = item.partition('=')
+        configs.append((name, command))
+
+    upstream = FakeUpstream(args.first_token_delay, args.token_interval, args.jitter)
+    upstream.start()
+    sys.path.insert(0, PROJECT_DIR)
+
+    results = []
+    for name, command in configs:
+        print(f"压测 {name}: {args.clients} 个并发流 ...", flush=True)
+        results.append(run_config(name, command, upstream, args))
+
+    print()
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
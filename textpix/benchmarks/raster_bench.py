@@ -0,0 +1,77 @@
+"""
+PNG 渲染基准测试：每核每秒渲染图片数
+
+用法（在 textpix/ 目录下执行）:
+    python benchmarks/raster_bench.py --count 200 --workers 4
+
+先在当前进程中串行渲染得到单核吞吐，再通过进程池并行渲染得到多核吞吐
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from contentgenerater.rasterizer import render_png  # noqa: E402
+
+NORMAL_DOC = {
+    "title": "如何高效地进行远程协作",
+    "intro": "远程办公已经成为常态，本文从沟通、工具和节奏三个方面总结一些实用经验。",
+    "sections": [
+        {
+            "title": f"第{i + 1}部分",
+            "items": ["明确每天的同步时间，减少无效会议", "重要决定写成文档，方便异步查阅", "用看板跟踪任务进度"]
+        }
+        for i in range(4)
+    ],
+    "footer": "希望这些经验对你有帮助。"
+}
+
+WECHAT_DOC = {
+    "title": "周末计划",
+    "chat_header": "好友群",
+    "messages": [{"type": "time", "time": "10:30"}] + [
+        {"nickname": "张三" if i % 2 == 0 else "我", "text": "周末一起去爬山吗？天气预报说是晴天。", "align": "left" if i % 2 == 0 else "right"}
+        for i in range(10)
+    ]
+}
+
+
+def render_one(template_type):
+    doc = WECHAT_DOC if template_type == 'wechat' else NORMAL_DOC
+    return len(render_png(doc, template_type))
+
+
+def bench_serial(template_type, count):
+    render_one(template_type)  # 预热字体缓存
+    started = time.perf_counter()
+    for _ in range(count):
+        render_one(template_type)
+    return count / (time.perf_counter() - started)
+
+
+def bench_pool(template_type, count, workers):
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(render_one, [template_type] * workers))  # 启动并预热所有进程
+        started = time.perf_counter()
+        list(executor.map(render_one, [template_type] * count, chunksize=4))
+        return count / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=100, help='每种模板渲染的图片数量')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='进程池大小')
+    args = parser.parse_args()
+
+    print(f"{'模板':<8}{'单核 img/s':>14}{'进程池 img/s':>16}{'每核 img/s':>14}")
+    for template_type in ('normal', 'wechat'):
+        serial = bench_serial(template_type, args.count)
+        pooled = bench_pool(template_type, args.count, args.workers)
+        print(f"{template_type:<8}{serial:>14.1f}{pooled:>16.1f}{pooled / args.workers:>14.1f}")
+
+
+if __name__ == '__main__':
+    main()
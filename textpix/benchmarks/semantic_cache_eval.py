@@ -0,0 +1,96 @@
+"""
+近似重复缓存离线评估：在人工标注的请求对上统计不同阈值下的命中精确率和召回率
+
+用法（在 textpix/ 目录下执行）:
+    python benchmarks/semantic_cache_eval.py
+    python benchmarks/semantic_cache_eval.py --thresholds 0.7,0.8,0.85,0.9 --show-errors
+    python benchmarks/semantic_cache_eval.py --data my_pairs.jsonl
+
+数据文件每行一个 JSON：
+    {"a": {"theme": ..., "content": ...}, "b": {"theme": ..., "content": ...}, "duplicate": true}
+duplicate 表示 b 可以直接复用 a 的生成结果。评估时把 a 写入缓存、用 b 查找，
+命中且标注为重复记为正确命中；精确率 = 正确命中 / 全部命中，召回率 = 正确命中 / 标注为重复的对数
+"""
+import argparse
+import json
+import os
+import sys
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'semantic_cache_pairs.jsonl')
+
+sys.path.insert(0, PROJECT_DIR)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'textpix.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from contentgenerater import config  # noqa: E402
+from contentgenerater.semantic_cache import NearDuplicateCache, request_parts, request_similarity  # noqa: E402
+
+
+def load_pairs(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def evaluate(pairs, threshold, num_perm, bands):
+    """返回 (精确率, 召回率, 命中数, 判断错误的请求对)"""
+    true_hits = hits = 0
+    errors = []
+    for pair in pairs:
+        # 每对单独一个缓存，互不干扰
+        cache = NearDuplicateCache(threshold=threshold, num_perm=num_perm, bands=bands)
+        cache.add('eval', pair['a']['theme'], pair['a']['content'], True)
+        hit = cache.lookup('eval', pair['b']['theme'], pair['b']['content']) is not None
+        hits += hit
+        true_hits += hit and pair['duplicate']
+        if hit != pair['duplicate']:
+            errors.append(pair)
+    positives = sum(1 for pair in pairs if pair['duplicate'])
+    precision = true_hits / hits if hits else 1.0
+    recall = true_hits / positives if positives else 1.0
+    return precision, recall, hits, errors
+
+
+def similarity(pair):
+    # 主题未达到阈值时为 0
+    return request_similarity(
+        request_parts(pair['a']['theme'], pair['a']['content']),
+        request_parts(pair['b']['theme'], pair['b']['content']),
+        config.SEMANTIC_CACHE_THRESHOLD,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data', default=DEFAULT_DATA, help='标注数据（JSONL）')
+    parser.add_argument('--thresholds', default='0.6,0.7,0.75,0.8,0.85,0.9,0.95', help='要评估的相似度阈值，逗号分隔')
+    parser.add_argument('--num-perm', type=int, default=64, help='MinHash 签名长度')
+    parser.add_argument('--bands', type=int, default=16, help='LSH 分桶数')
+    parser.add_argument('--show-errors', action='store_true', help='列出当前配置阈值下判断错误的请求对')
+    args = parser.parse_args()
+
+    pairs = load_pairs(args.data)
+    positives = sum(1 for pair in pairs if pair['duplicate'])
+    print(f"{len(pairs)} 对（重复 {positives}，不重复 {len(pairs) - positives}），"
+          f"num_perm={args.num_perm} bands={args.bands}，当前配置阈值 {config.SEMANTIC_CACHE_THRESHOLD}")
+    print(f"{'阈值':>8}{'命中':>8}{'精确率':>10}{'召回率':>10}")
+
+    thresholds = sorted({float(t) for t in args.thresholds.split(',') if t.strip()} | {config.SEMANTIC_CACHE_THRESHOLD})
+    for threshold in thresholds:
+        precision, recall, hits, _ = evaluate(pairs, threshold, args.num_perm, args.bands)
+        marker = ' *' if threshold == config.SEMANTIC_CACHE_THRESHOLD else ''
+        print(f"{threshold:>8.2f}{hits:>8}{precision:>10.1%}{recall:>10.1%}{marker}")
+
+    if args.show_errors:
+        _, _, _, errors = evaluate(pairs, config.SEMANTIC_CACHE_THRESHOLD, args.num_perm, args.bands)
+        for pair in errors:
+            kind = '漏判' if pair['duplicate'] else '误判'
+            print(f"  [{kind}] 相似度 {similarity(pair):.2f}: "
+                  f"{pair['a']['theme']} / {pair['a']['content']}  <->  {pair['b']['theme']} / {pair['b']['content']}")
+
+
+if __name__ == '__main__':
+    main()
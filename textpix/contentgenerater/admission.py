@@ -0,0 +1,137 @@
+"""
+生成排队
+同时进行的生成数达到 SSE_MAX_GENERATIONS 时，新请求按到达顺序等待；
+SSE 视图和 WebSocket 连接在等待期间向客户端推送排队位置，获得名额后才开始调用上游。
+名额在进程内计数：每个 worker 进程各自限制，只在一个进程同时处理多个请求
+（gthread 或 ASGI worker）时起作用
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+
+from .metrics import metrics
+
+
+class QueueTimeout(Exception):
+    """排队超过 SSE_QUEUE_TIMEOUT"""
+
+    code = 'queue_timeout'
+    retryable = True
+
+    def __init__(self, waited: float, retry_after: float = 5):
+        super().__init__(f"服务繁忙，已排队 {waited:.0f} 秒，请稍后重试")
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """一个请求在队列中的位置"""
+
+    __slots__ = ('admitted', 'entered', 'waker')
+
+    def __init__(self):
+        self.admitted = False
+        self.entered = time.monotonic()
+        self.waker = None        # 异步等待时获得名额的回调
+
+
+class GenerationQueue:
+    """
+    先进先出的生成名额（线程安全；同步视图用 wait，事件循环中的调用方用 wait_async）
+
+    用法:
+        ticket = generation_queue.enter()
+        try:
+            while not generation_queue.wait(ticket, 1.0):
+                generation_queue.position(ticket)   # 当前排第几位
+            ...
+        finally:
+            generation_queue.leave(ticket)
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting = deque()
+
+    @staticmethod
+    def _limit() -> int:
+        from . import config
+
+        return config.SSE_MAX_GENERATIONS
+
+    def _has_room(self) -> bool:
+        limit = self._limit()
+        return limit <= 0 or self._active < limit
+
+    def _admit(self, ticket: Ticket):
+        ticket.admitted = True
+        self._active += 1
+        if ticket.waker is not None:
+            ticket.waker()
+        metrics.observe('sse_queue_wait_ms', (time.monotonic() - ticket.entered) * 1000)
+
+    def _update_gauges(self):
+        metrics.set_gauge('sse_generations_active', self._active)
+        metrics.set_gauge('sse_queue_depth', len(self._waiting))
+
+    def enter(self) -> Ticket:
+        """有空闲名额且无人排队时直接获得名额，否则排到队尾"""
+        ticket = Ticket()
+        with self._cond:
+            if not self._waiting and self._has_room():
+                self._admit(ticket)
+            else:
+                self._waiting.append(ticket)
+                metrics.inc('sse_queued_total')
+            self._update_gauges()
+        return ticket
+
+    def wait(self, ticket: Ticket, timeout: float) -> bool:
+        """最多等待 timeout 秒，返回是否已获得名额"""
+        with self._cond:
+            return self._cond.wait_for(lambda: ticket.admitted, timeout)
+
+    async def wait_async(self, ticket: Ticket, timeout: float) -> bool:
+        """wait 的异步版本：不占用线程，名额由其他线程释放时唤醒事件循环"""
+        loop = asyncio.get_running_loop()
+        admitted = asyncio.Event()
+        with self._cond:
+            if ticket.admitted:
+                return True
+            ticket.waker = lambda: loop.call_soon_threadsafe(admitted.set)
+        try:
+            await asyncio.wait_for(admitted.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._cond:
+                ticket.waker = None
+        return ticket.admitted
+
+    def position(self, ticket: Ticket) -> int:
+        """排队位置（从 1 开始）；已获得名额时返回 0"""
+        with self._cond:
+            if ticket.admitted:
+                return 0
+            return self._waiting.index(ticket) + 1 if ticket in self._waiting else 0
+
+    def leave(self, ticket: Ticket):
+        """生成结束或放弃排队（客户端断开、超时）时调用"""
+        with self._cond:
+            if ticket.admitted:
+                self._active -= 1
+            elif ticket in self._waiting:
+                self._waiting.remove(ticket)
+            while self._waiting and self._has_room():
+                self._admit(self._waiting.popleft())
+            self._update_gauges()
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {'active': self._active, 'waiting': len(self._waiting), 'limit': self._limit()}
+
+
+# 全局生成队列
+generation_queue = GenerationQueue()
@@ -1,8 +1,27 @@
 """AI 内容生成服务"""
 import json
-from typing import AsyncGenerator, List
+import re
+import time
+import asyncio
+import hashlib
+import ipaddress
+import os
+import socket
+import threading
+from collections import OrderedDict
+from typing import AsyncGenerator, List, Optional
+from urllib.parse import urlsplit
 import logging
-import httpx
+
+from .event_loop import background_loop
+from .budget import InputTooLarge, StreamUsage, fit_content, fit_max_tokens, output_usage
+from .circuit_breaker import CircuitOpenError, make_breaker, tenant_breakers
+from .deadlines import DeadlineExceeded, StreamDeadline
+from .json_repair import parse_model_json
+from .metrics import metrics
+from .schema_guard import SchemaDivergence, StreamSchemaValidator
+from .tracing import span, start_span
+from .variants import merge_streams
 
 
 logger = logging.getLogger(__name__)
@@ -28,61 +47,896 @@ class AIContentGenerator:
             内容片段
         """
         raise NotImplementedError("子类必须实现此方法")
+    
+    async def generate_variants_stream(self, theme: str, content: str, images: List[str] = None,
+                                       template_type: str = 'normal', variants: int = 1):
+        """
+        流式生成多个版本（默认并发调用 generate_content_stream）
+        
+        Yields:
+            (版本序号, 内容片段)；某个版本失败时为 (版本序号, 异常)，其余版本继续
+        """
+        metrics.inc('variant_requests_total', mode='concurrent')
+        streams = [self.generate_content_stream(theme, content, images, template_type) for _ in range(variants)]
+        async for item in merge_streams(streams):
+            yield item
+    
+    async def generate_outline_stream(self, theme: str, content: str, images: List[str] = None,
+                                      template_type: str = 'normal') -> AsyncGenerator[str, None]:
+        """
+        大纲模式：先生成大纲，再并行生成各版块（默认与 generate_content_stream 相同）
+        
+        Yields:
+            内容片段，拼接后与普通模式的 JSON 格式相同
+        """
+        async for content_chunk in self.generate_content_stream(theme, content, images, template_type):
+            yield content_chunk
+    
+    async def optimize_text_stream(self, text: str, optimization_type: str = 'grammar') -> AsyncGenerator[str, None]:
+        """
+        流式优化一段文本（逐步返回）
+        
+        Args:
+            text: 待优化的 Markdown 片段
+            optimization_type: 优化类型 (grammar/seo/readability/engagement)
+            
+        Yields:
+            优化后的内容片段
+        """
+        raise NotImplementedError("子类必须实现此方法")
+    
+    async def warmup(self):
+        """预热（建立上游连接等），默认无操作"""
+    
+    def status(self) -> dict:
+        """返回生成器状态（用于就绪检查）"""
+        return {"model": self.model_name, "warmed_up": True}
 
 
 
 # 全局生成器实例
 _generator = None
+_generator_lock = threading.Lock()
 
 
 def get_ai_generator() -> AIContentGenerator:
-    """获取 AI 生成器实例（根据配置自动选择）"""
+    """获取 AI 生成器实例（根据配置自动选择，线程安全）"""
     global _generator
     
-    if _generator is None:
-        # 导入配置
+    if _generator is not None:
+        return _generator
+    
+    with _generator_lock:
+        if _generator is None:
+            # 导入配置
+            from . import config
+            
+            # 根据配置选择生成器（回放录制时不访问上游，地址和密钥可以不配置）
+            if config.AI_REPLAY_DIR:
+                logger.info(f"从录制回放上游响应: {config.AI_REPLAY_DIR}（{config.AI_REPLAY_SPEED}x）")
+            elif not config.CUSTOM_AI_API_KEY or not config.CUSTOM_AI_BASE_URL:
+                raise ValueError("自定义 AI 服务配置不完整")
+            else:
+                logger.info(f"使用自定义 AI 生成器: {config.CUSTOM_AI_BASE_URL}")
+            _generator = CustomAIGenerator(
+                base_url=config.CUSTOM_AI_BASE_URL or 'https://replay.invalid/v1',
+                api_key=config.CUSTOM_AI_API_KEY or 'replay',
+                model=config.CUSTOM_AI_MODEL,
+                timeout=config.CUSTOM_AI_TIMEOUT
+            )
+    
+    return _generator
+
+
+def get_initialized_generator():
+    """返回已创建的生成器实例（未创建时返回 None，不会触发初始化）"""
+    return _generator
+
+
+# ==================== 自带密钥（按租户的上游凭据） ====================
+
+# 请求头：租户自己的上游密钥 / 接口地址 / 模型（后两者缺省时使用服务端配置）
+API_KEY_HEADER = 'X-AI-API-Key'
+BASE_URL_HEADER = 'X-AI-Base-URL'
+MODEL_HEADER = 'X-AI-Model'
+
+_API_KEY_RE = re.compile(r'^[\x21-\x7e]{8,512}$')
+_MODEL_RE = re.compile(r'^[\w.:/-]{1,128}$')
+
+
+class UpstreamCredentials:
+    """租户的上游凭据；repr 中不包含密钥"""
+    
+    __slots__ = ('base_url', 'api_key', 'model')
+    
+    def __init__(self, base_url: str, api_key: str, model: str):
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key
+        self.model = model
+    
+    @property
+    def key_id(self) -> str:
+        """密钥指纹（可用于日志和指标）"""
+        return hashlib.sha256(self.api_key.encode('utf-8')).hexdigest()[:12]
+    
+    @property
+    def pool_key(self) -> tuple:
+        return (self.base_url, hashlib.sha256(self.api_key.encode('utf-8')).hexdigest(), self.model)
+    
+    def __repr__(self):
+        return f"UpstreamCredentials(base_url={self.base_url!r}, key_id={self.key_id!r}, model={self.model!r})"
+
+
+def parse_credentials(headers) -> Optional[UpstreamCredentials]:
+    """
+    从请求头读取并校验租户凭据
+    
+    Returns:
+        未携带密钥时返回 None（使用服务端配置）
+    
+    Raises:
+        ValueError: 未开启自带密钥或凭据不合法（错误信息不包含密钥）
+    """
+    from . import config
+    
+    api_key = (headers.get(API_KEY_HEADER) or '').strip()
+    if not api_key:
+        return None
+    if not config.AI_BYOK_ENABLED:
+        raise ValueError("服务未开启自带密钥")
+    if not _API_KEY_RE.match(api_key):
+        raise ValueError("API 密钥格式不正确")
+    
+    base_url = (headers.get(BASE_URL_HEADER) or config.CUSTOM_AI_BASE_URL or '').strip()
+    parts = urlsplit(base_url)
+    allowed_schemes = ('https', 'http') if config.AI_BYOK_ALLOW_HTTP else ('https',)
+    if parts.scheme not in allowed_schemes or not parts.hostname:
+        raise ValueError(f"接口地址必须是 {'/'.join(allowed_schemes)} URL")
+    if parts.username or parts.password or parts.query or parts.fragment:
+        raise ValueError("接口地址不能包含用户信息、查询参数或片段")
+    hostname = parts.hostname.lower()
+    if config.AI_BYOK_ALLOWED_HOSTS:
+        if hostname not in config.AI_BYOK_ALLOWED_HOSTS:
+            raise ValueError(f"不允许的接口地址: {parts.hostname}")
+    else:
+        _check_public_host(hostname)
+    
+    model = (headers.get(MODEL_HEADER) or config.CUSTOM_AI_MODEL or '').strip()
+    if not _MODEL_RE.match(model):
+        raise ValueError("模型名称不正确")
+    
+    return UpstreamCredentials(base_url, api_key, model)
+
+
+def _resolve_host(hostname: str) -> List[str]:
+    """解析主机名的全部地址"""
+    return [info[4][0] for info in socket.getaddrinfo(hostname, None, proto=socket.IPPROTO_TCP)]
+
+
+def _check_public_host(hostname: str) -> List[str]:
+    """
+    未配置 AI_BYOK_ALLOWED_HOSTS 时，租户接口地址只能是解析到公网地址的域名：
+    拒绝 IP 字面量、localhost，以及解析到回环、链路本地（含云元数据地址）、私有网段等地址的域名，
+    避免租户借服务端访问内网。返回解析到的地址
+    """
+    try:
+        ipaddress.ip_address(hostname.strip('[]'))
+    except ValueError:
+        pass
+    else:
+        raise ValueError("接口地址不能是 IP 地址")
+    if hostname == 'localhost' or hostname.endswith('.localhost'):
+        raise ValueError(f"不允许的接口地址: {hostname}")
+    try:
+        addresses = _resolve_host(hostname)
+    except OSError:
+        raise ValueError(f"无法解析接口地址: {hostname}") from None
+    if not addresses or not all(ipaddress.ip_address(address.split('%')[0]).is_global for address in addresses):
+        raise ValueError(f"接口地址指向内网: {hostname}")
+    return addresses
+
+
+def _public_address_backend():
+    """
+    租户连接使用的 httpcore 网络后端：每次建立连接时重新解析并检查主机名，直接连接检查通过的地址。
+    校验请求头时的解析结果不能保证连接时仍然有效（短 TTL 的域名可以在两次解析之间改指内网，即 DNS 重绑定）；
+    TLS 的 SNI 和证书校验仍使用原主机名
+    """
+    import httpcore
+
+    class PublicAddressBackend(httpcore.AsyncNetworkBackend):
+        def __init__(self):
+            self._backend = httpcore.AnyIOBackend()
+
+        async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+            try:
+                addresses = await asyncio.get_running_loop().run_in_executor(None, _check_public_host, host)
+            except ValueError as e:
+                metrics.inc('byok_blocked_connections_total')
+                raise httpcore.ConnectError(str(e)) from None
+            return await self._backend.connect_tcp(addresses[0], port, timeout=timeout,
+                                                   local_address=local_address, socket_options=socket_options)
+
+        async def connect_unix_socket(self, path, timeout=None, socket_options=None):
+            raise httpcore.ConnectError("租户接口地址不支持 Unix 套接字")
+
+        async def sleep(self, seconds):
+            await self._backend.sleep(seconds)
+
+    return PublicAddressBackend()
+
+
+class GeneratorPool:
+    """
+    按 (base_url, 密钥哈希, 模型) 缓存生成器的 LRU，每个生成器持有独立的上游连接池，
+    同一租户的请求复用已建立的连接；超过容量或空闲超时的生成器被移除并关闭连接池
+    （仍有进行中的请求时，等最后一个请求结束后关闭）。
+    有生成器时在后台事件循环中定期清理空闲的生成器，不必等下一个租户请求到来
+    """
+    
+    def __init__(self, max_size: int, idle_timeout: float, loop=None):
+        self.max_size = max(1, max_size)
+        self.idle_timeout = idle_timeout
+        self.loop = loop or background_loop
+        self._entries = OrderedDict()  # pool_key -> [generator, last_used]
+        self._lock = threading.Lock()
+        self._sweeper_pid = None
+    
+    def get(self, credentials: UpstreamCredentials) -> 'CustomAIGenerator':
         from . import config
         
-        # 根据配置选择生成器
-        if not config.CUSTOM_AI_API_KEY or not config.CUSTOM_AI_BASE_URL:
-            raise ValueError("自定义 AI 服务配置不完整")
-        
-        logger.info(f"使用自定义 AI 生成器: {config.CUSTOM_AI_BASE_URL}")
-        _generator = CustomAIGenerator(
-            base_url=config.CUSTOM_AI_BASE_URL,
-            api_key=config.CUSTOM_AI_API_KEY,
-            model=config.CUSTOM_AI_MODEL,
-            timeout=config.CUSTOM_AI_TIMEOUT
-        )
+        now = time.monotonic()
+        key = credentials.pool_key
+        evicted = []
+        with self._lock:
+            evicted.extend((g, 'idle') for g in self._pop_idle(now))
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                entry[1] = now
+                generator = entry[0]
+                metrics.inc('byok_pool_hits_total')
+            else:
+                # 租户提供的地址一律校验 TLS 证书
+                generator = CustomAIGenerator(
+                    base_url=credentials.base_url,
+                    api_key=credentials.api_key,
+                    model=credentials.model,
+                    timeout=config.CUSTOM_AI_TIMEOUT,
+                    verify=True,
+                    tenant=True,
+                )
+                self._entries[key] = [generator, now]
+                metrics.inc('byok_pool_misses_total')
+                self._ensure_sweeper()
+                while len(self._entries) > self.max_size:
+                    _, (oldest, _) = self._entries.popitem(last=False)
+                    evicted.append((oldest, 'capacity'))
+            metrics.set_gauge('byok_pools', len(self._entries))
         
-     
-            
+        for old, reason in evicted:
+            self._close(old, reason)
+        return generator
     
-    return _generator
+    def _pop_idle(self, now: float) -> List['CustomAIGenerator']:
+        idle = []
+        for key, (generator, last_used) in list(self._entries.items()):
+            if now - last_used >= self.idle_timeout and not generator.active_streams:
+                del self._entries[key]
+                idle.append(generator)
+        return idle
+    
+    def sweep(self) -> int:
+        """移除并关闭空闲的生成器，返回移除数量"""
+        with self._lock:
+            idle = self._pop_idle(time.monotonic())
+            metrics.set_gauge('byok_pools', len(self._entries))
+        for generator in idle:
+            self._close(generator, 'idle')
+        return len(idle)
+    
+    def _ensure_sweeper(self):
+        """启动定期清理（调用方持有 _lock）；fork 之后的子进程中重新启动"""
+        if self._sweeper_pid == os.getpid():
+            return
+        self._sweeper_pid = os.getpid()
+        self.loop.submit(self._sweep_periodically())
+    
+    async def _sweep_periodically(self):
+        """每隔半个空闲超时清理一次，没有生成器时退出（下次创建生成器时再启动）"""
+        interval = min(60.0, max(0.05, self.idle_timeout / 2))
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.warning(f"清理租户连接池失败: {e}")
+            with self._lock:
+                if not self._entries:
+                    self._sweeper_pid = None
+                    return
+    
+    def _close(self, generator: 'CustomAIGenerator', reason: str):
+        metrics.inc('byok_pool_evictions_total', reason=reason)
+        logger.info(f"关闭租户上游连接池: {generator.base_url}", extra={'reason': reason})
+        self.loop.submit(generator.close_when_idle())
+    
+    def close_all(self):
+        with self._lock:
+            generators = [entry[0] for entry in self._entries.values()]
+            self._entries.clear()
+            metrics.set_gauge('byok_pools', 0)
+        for generator in generators:
+            self._close(generator, 'shutdown')
+    
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "pools": len(self._entries),
+                "max_pools": self.max_size,
+                "active_streams": sum(entry[0].active_streams for entry in self._entries.values()),
+            }
+
+
+_tenant_pool = None
+
+
+def get_tenant_pool() -> GeneratorPool:
+    """租户生成器 LRU（懒加载）"""
+    global _tenant_pool
+    
+    if _tenant_pool is None:
+        with _generator_lock:
+            if _tenant_pool is None:
+                from . import config
+                
+                _tenant_pool = GeneratorPool(config.AI_BYOK_MAX_POOLS, config.AI_BYOK_IDLE_TIMEOUT)
+    return _tenant_pool
+
+
+def get_tenant_generator(credentials: UpstreamCredentials) -> 'CustomAIGenerator':
+    """获取租户凭据对应的生成器（复用该租户的上游连接池）"""
+    return get_tenant_pool().get(credentials)
+
+
+def warmup_ai_generator():
+    """
+    初始化生成器并预先建立上游连接（应用启动时在后台线程中调用）
 
+    上游暂时不可达时按指数退避重试（AI_WARMUP_RETRY_DELAY 起，最长 AI_WARMUP_RETRY_MAX 秒），
+    直到预热成功或期间已有生成请求成功访问上游
+    """
+    from . import config
+    
+    started = time.monotonic()
+    try:
+        generator = get_ai_generator()
+    except Exception as e:
+        logger.warning(f"AI 生成器预热失败: {e}")
+        return
+    
+    delay = config.AI_WARMUP_RETRY_DELAY
+    attempt = 1
+    while True:
+        try:
+            background_loop.run(generator.warmup())
+            logger.info(f"AI 生成器预热完成，耗时 {(time.monotonic() - started) * 1000:.0f}ms", extra={'attempts': attempt})
+            return
+        except Exception as e:
+            metrics.inc('warmup_failures_total')
+            logger.warning(f"AI 生成器预热失败（第 {attempt} 次），{delay:.0f} 秒后重试: {e}")
+        time.sleep(delay)
+        if generator.warmed_up:
+            logger.info("生成请求已成功访问上游，停止预热重试")
+            return
+        delay = min(delay * 2, config.AI_WARMUP_RETRY_MAX)
+        attempt += 1
+
+
+
+class UpstreamStatusError(Exception):
+    """上游返回非 200 状态码"""
+    
+    def __init__(self, status_code: int):
+        super().__init__(f"API 请求失败: {status_code}")
+        self.status_code = status_code
+
+
+def is_upstream_failure(error: BaseException) -> bool:
+    """是否计入熔断器：网络错误、超时、5xx 和 429；其余 4xx 说明上游可达"""
+    if isinstance(error, UpstreamStatusError):
+        return error.status_code >= 500 or error.status_code == 429
+    import httpx
+    
+    return isinstance(error, (DeadlineExceeded, httpx.TransportError))
 
 
 class CustomAIGenerator(AIContentGenerator):
     """自定义 AI 服务生成器（兼容 OpenAI API 格式）"""
     
-    def __init__(self, base_url: str, api_key: str, model: str, timeout: int = 60):
+    def __init__(self, base_url: str, api_key: str, model: str, timeout: int = 60, verify: bool = False,
+                 tenant: bool = False):
         super().__init__()
         self.base_url = base_url.rstrip('/')  # 移除末尾的斜杠
         self.api_key = api_key
         self.model_name = model
         self.timeout = timeout
+        # 是否校验上游 TLS 证书（服务端配置的上游沿用原有行为，租户地址必须校验）
+        self.verify = verify
+        
+        # 连接池客户端，在后台事件循环中懒加载
+        self._client = None
+        
+        # 预热/上游状态
+        self.warmed_up = False
+        self.last_warmup_error = None
+        self.upstream_latency_ms = None
+        self.upstream_checked_at = None
+        
+        # 进行中的流式请求数；被租户 LRU 移除后，等请求结束再关闭连接池
+        self.active_streams = 0
+        self._close_when_idle = False
         
-        # 禁用 SSL 验证警告
-        import urllib3
-        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+        # 上游是否支持一次返回多个 choice（n 参数）；发现不支持后改为并发调用
+        self.supports_n = True
+        # 上游是否接受 stream_options（流末尾返回 usage）；被拒绝后改为按输出文本估算
+        self.supports_stream_usage = True
+        
+        # 租户地址（未配置白名单时）在每次建立连接时重新检查，见 _public_address_backend
+        self.tenant = tenant
+        
+        # 上游熔断器：服务端上游按接口地址区分；租户按 (接口地址, 密钥指纹) 从全局登记表取得，
+        # 租户之间互不影响，生成器被移除后重建也沿用原状态
+        from . import config
+        netloc = urlsplit(self.base_url).netloc or self.base_url
+        if not config.CIRCUIT_BREAKER_ENABLED:
+            self.breaker = None
+        elif tenant:
+            self.breaker = tenant_breakers.get(netloc, UpstreamCredentials(base_url, api_key, model).key_id)
+        else:
+            self.breaker = make_breaker(netloc)
         
         logger.info(f"自定义 AI 生成器初始化: base_url={base_url}, model={model}, timeout={timeout}s")
     
-    async def generate_content_stream(self, theme: str, content: str, images: List[str] = None, template_type: str = 'normal') -> AsyncGenerator[str, None]:
+    def _get_client(self) -> 'httpx.AsyncClient':
+        """获取共享的连接池客户端（必须在后台事件循环中调用）"""
+        if self._client is None or self._client.is_closed:
+            # httpx（含 ssl / certifi）在首次调用上游时才导入，不拖慢冷启动
+            import httpx
+            from . import config
+            
+            limits = httpx.Limits(
+                max_connections=config.AI_POOL_MAX_CONNECTIONS,
+                max_keepalive_connections=config.AI_POOL_MAX_KEEPALIVE,
+                keepalive_expiry=config.AI_POOL_KEEPALIVE_EXPIRY,
+            )
+            # 连接超时单独配置；读/写超时作为兜底，首 token、停滞和总时长由 StreamDeadline 控制
+            timeout = httpx.Timeout(self.timeout, connect=config.AI_CONNECT_TIMEOUT)
+            transport = None
+            if config.AI_REPLAY_DIR:
+                from .replay import ReplayTransport
+                transport = ReplayTransport.from_path(config.AI_REPLAY_DIR, speed=config.AI_REPLAY_SPEED,
+                                                      strict=config.AI_REPLAY_STRICT)
+            elif self.tenant and not config.AI_BYOK_ALLOWED_HOSTS:
+                transport = httpx.AsyncHTTPTransport(verify=self.verify, limits=limits)
+                # httpx 没有公开设置网络后端的参数，替换底层 httpcore 连接池的后端
+                transport._pool._network_backend = _public_address_backend()
+            self._client = httpx.AsyncClient(timeout=timeout, limits=limits, verify=self.verify, proxy=None, transport=transport)
+        return self._client
+    
+    async def warmup(self):
+        """
+        预热：并发请求 /models，提前完成 DNS、TCP 和 TLS 握手，
+        使连接进入连接池供后续生成请求复用
+        """
+        from . import config
+        
+        client = self._get_client()
+        headers = {"Authorization": f"Bearer {self.api_key}"}
+        started = time.monotonic()
+        
+        async def ping():
+            # 只关心连接是否建立，任何 HTTP 状态码都视为上游可达
+            response = await client.get(f"{self.base_url}/models", headers=headers)
+            await response.aclose()
+            return response.status_code
+        
         try:
-            prompt = self._build_prompt(theme, content, template_type)
-            logger.info(f"使用模板类型: {template_type}")
+            results = await asyncio.gather(
+                *[ping() for _ in range(max(1, config.AI_WARMUP_CONNECTIONS))]
+            )
+            self.warmed_up = True
+            self.last_warmup_error = None
+            logger.info(f"上游连接预热成功: status={results[0]}, 连接数={len(results)}")
+        except Exception as e:
+            self.last_warmup_error = str(e)
+            raise
+        finally:
+            self.upstream_latency_ms = round((time.monotonic() - started) * 1000, 1)
+            self.upstream_checked_at = time.time()
+    
+    def pool_stats(self) -> dict:
+        """连接池状态（读取 httpcore 连接池内部信息，取不到时返回空统计）"""
+        stats = {"open": 0, "idle": 0, "active": 0}
+        if self._client is None or self._client.is_closed:
+            return stats
+        
+        pool = getattr(getattr(self._client, '_transport', None), '_pool', None)
+        for connection in list(getattr(pool, 'connections', [])):
+            if connection.is_closed():
+                continue
+            stats["open"] += 1
+            if connection.is_idle():
+                stats["idle"] += 1
+            else:
+                stats["active"] += 1
+        return stats
+    
+    def status(self) -> dict:
+        return {
+            "model": self.model_name,
+            "base_url": self.base_url,
+            "warmed_up": self.warmed_up,
+            "pool": self.pool_stats(),
+            "circuit": self.breaker.snapshot() if self.breaker is not None else None,
+            "upstream": {
+                "last_error": self.last_warmup_error,
+                "latency_ms": self.upstream_latency_ms,
+                "checked_at": self.upstream_checked_at,
+            },
+        }
+    
+    async def close(self):
+        """关闭连接池"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
+    async def close_when_idle(self):
+        """没有进行中的请求时立即关闭连接池，否则在最后一个请求结束后关闭"""
+        self._close_when_idle = True
+        if not self.active_streams:
+            await self.close()
+    
+    async def generate_content_stream(self, theme: str, content: str, images: List[str] = None, template_type: str = 'normal') -> AsyncGenerator[str, None]:
+        logger.info(f"使用模板类型: {template_type}", extra={'sample': 'request'})
+        
+        # 内容描述过长时拒绝或压缩，并按剩余上下文确定 max_tokens
+        content, messages = fit_content(content, lambda c: self._build_messages(theme, c, template_type), template_type)
+        prompt_tokens, max_tokens = fit_max_tokens(messages, template=template_type)
+        with span('ai.generate', template_type=template_type, model=self.model_name,
+                  prompt_tokens=prompt_tokens, max_tokens=max_tokens) as generate_span:
+            async for content_chunk in self._stream_validated(messages, template_type, generate_span, max_tokens):
+                yield content_chunk
+    
+    def _build_messages(self, theme: str, content: str, template_type: str = 'normal') -> List[dict]:
+        return [
+            {"role": "system", "content": "你是一个专业的内容创作助手..."},
+            {"role": "user", "content": self._build_prompt(theme, content, template_type)}
+        ]
+    
+    async def generate_outline_stream(self, theme: str, content: str, images: List[str] = None,
+                                      template_type: str = 'normal') -> AsyncGenerator[str, None]:
+        """
+        大纲模式（仅 normal 模板）：一次短调用生成标题、引导语、版块标题和结语，
+        再以最多 OUTLINE_CONCURRENCY 个并行调用生成各版块的要点，按版块顺序输出
+
+        输出拼接后与普通模式的 JSON 相同；每个版块在它之前的版块都完成后立即输出
+        """
+        from . import config
+        
+        if template_type != 'normal':
+            async for content_chunk in self.generate_content_stream(theme, content, images, template_type):
+                yield content_chunk
+            return
+        
+        content, messages = fit_content(content, lambda c: self._build_outline_messages(theme, c), 'outline')
+        prompt_tokens, max_tokens = fit_max_tokens(messages, config.OUTLINE_MAX_TOKENS, template='outline')
+        # 各次调用共享同一个总时长预算，首 token 和停滞按每次调用计时
+        deadline = StreamDeadline()
+        
+        with span('ai.generate', template_type=template_type, model=self.model_name, mode='outline',
+                  prompt_tokens=prompt_tokens, max_tokens=max_tokens) as generate_span:
+            with span('ai.outline'):
+                outline = parse_model_json(''.join([
+                    chunk async for chunk in self._stream_chat(messages, max_tokens=max_tokens, deadline=deadline)
+                ]))
+            titles = [
+                str(section.get('title', '')) if isinstance(section, dict) else str(section)
+                for section in (outline.get('sections') if isinstance(outline, dict) else None) or []
+            ]
+            if not titles:
+                raise ValueError("模型没有返回版块大纲")
+            generate_span.set_attribute('sections', len(titles))
+            metrics.observe('outline_sections', len(titles))
+            
+            head = json.dumps({"title": outline.get('title') or theme, "intro": outline.get('intro', '')}, ensure_ascii=False)
+            yield head[:-1] + ', "sections": ['
+            
+            semaphore = asyncio.Semaphore(max(1, config.OUTLINE_CONCURRENCY))
+            
+            async def generate_section(index: int) -> dict:
+                async with semaphore:
+                    section_messages = self._build_section_messages(theme, content, outline, titles, index)
+                    _, section_tokens = fit_max_tokens(section_messages, config.OUTLINE_SECTION_MAX_TOKENS, template='section')
+                    remaining = deadline.total and max(0.001, deadline.started + deadline.total - time.monotonic())
+                    with span('ai.section', index=index):
+                        text = ''.join([
+                            chunk async for chunk in self._stream_chat(
+                                section_messages, max_tokens=section_tokens, deadline=StreamDeadline(total=remaining)
+                            )
+                        ])
+                items = parse_model_json(text)
+                if isinstance(items, dict):
+                    items = items.get('items')
+                if not isinstance(items, list) or not items:
+                    raise ValueError(f"版块 {index + 1} 没有生成要点")
+                return {"title": titles[index], "items": [str(item) for item in items]}
+            
+            tasks = [asyncio.ensure_future(generate_section(index)) for index in range(len(titles))]
+            try:
+                for index, task in enumerate(tasks):
+                    section = await task
+                    yield (', ' if index else '') + json.dumps(section, ensure_ascii=False)
+            finally:
+                # 出错或客户端断开时取消其余版块的上游请求
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+            
+            yield '], ' + json.dumps({"footer": outline.get('footer', '')}, ensure_ascii=False)[1:]
+    
+    def _build_outline_messages(self, theme: str, content: str) -> List[dict]:
+        return [
+            {"role": "system", "content": "你是一个专业的内容创作助手..."},
+            {"role": "user", "content": self._build_outline_prompt(theme, content)}
+        ]
+    
+    def _build_section_messages(self, theme: str, content: str, outline: dict, titles: List[str], index: int) -> List[dict]:
+        return [
+            {"role": "system", "content": "你是一个专业的内容创作助手..."},
+            {"role": "user", "content": self._build_section_prompt(theme, content, outline, titles, index)}
+        ]
+    
+    async def generate_variants_stream(self, theme: str, content: str, images: List[str] = None,
+                                       template_type: str = 'normal', variants: int = 1):
+        """
+        一次上游调用（n 个 choice）生成多个版本，共享同一次提示词预填充和连接
+        
+        各版本分别增量校验格式；偏离格式或上游没有返回的版本单独补生成。
+        上游不支持 n 时改为并发调用
+        """
+        from . import config
+        
+        if variants <= 1 or not (config.AI_VARIANTS_USE_N and self.supports_n):
+            async for item in super().generate_variants_stream(theme, content, images, template_type, variants):
+                yield item
+            return
+        
+        content, messages = fit_content(content, lambda c: self._build_messages(theme, c, template_type), template_type)
+        # 单个 choice 被截断后无法续写，多 choice 调用不使用自适应的 max_tokens
+        prompt_tokens, max_tokens = fit_max_tokens(messages, config.AI_MAX_OUTPUT_TOKENS, template=template_type)
+        validate = config.SCHEMA_VALIDATION_ENABLED
+        validators = [StreamSchemaValidator(template_type, max_preamble=config.SCHEMA_MAX_PREAMBLE) for _ in range(variants)]
+        held = [[] for _ in range(variants)]
+        seen = set()
+        diverged = set()
+        
+        with span('ai.generate', template_type=template_type, model=self.model_name,
+                  prompt_tokens=prompt_tokens, max_tokens=max_tokens, variants=variants) as generate_span:
+            usage = StreamUsage()
+            stream = self._stream_choices(messages, max_tokens=max_tokens, n=variants, usage=usage)
+            try:
+                async for index, content_chunk in stream:
+                    if index >= variants or index in diverged:
+                        continue
+                    seen.add(index)
+                    validator = validators[index]
+                    if not validate or validator.committed:
+                        if validate:
+                            validator.feed(content_chunk)
+                        yield index, content_chunk
+                        continue
+                    
+                    try:
+                        validator.feed(content_chunk)
+                    except SchemaDivergence as e:
+                        # 单个 choice 无法单独取消，丢弃其后续输出，结束后补生成
+                        diverged.add(index)
+                        held[index] = []
+                        metrics.inc('schema_divergence_total', template=template_type, reason=e.reason)
+                        generate_span.add_event('schema_divergence', reason=e.reason, variant=index)
+                        continue
+                    held[index].append(content_chunk)
+                    if validator.committed:
+                        yield index, ''.join(held[index])
+                        held[index] = []
+            except UpstreamStatusError as e:
+                if seen or e.status_code not in (400, 422):
+                    raise
+                # 上游拒绝 n 参数
+                self.supports_n = False
+                metrics.inc('variant_n_fallback_total', reason='rejected')
+                logger.warning(f"上游不支持 n 参数（{e.status_code}），改为并发调用")
+            finally:
+                await stream.aclose()
+            
+            if not self.supports_n and not seen:
+                async for item in super().generate_variants_stream(theme, content, images, template_type, variants):
+                    yield item
+                return
+            
+            for index in sorted(seen - diverged):
+                if held[index]:
+                    yield index, ''.join(held[index])
+                # 使用的是 AI_MAX_OUTPUT_TOKENS 上限，截断时只记录
+                if usage.truncated(index):
+                    metrics.inc('completion_truncated_total', template=template_type)
+                output_usage.record(template_type, usage.tokens(index), truncated=usage.truncated(index))
+            
+            if seen == {0}:
+                # 上游忽略了 n 参数，只返回了一个 choice
+                self.supports_n = False
+                metrics.inc('variant_n_fallback_total', reason='ignored')
+                logger.warning("上游忽略了 n 参数，之后改为并发调用")
             
+            metrics.inc('variant_requests_total', mode='n')
+            retry = [index for index in range(variants) if index not in seen or index in diverged]
+            if retry:
+                generate_span.set_attribute('regenerated', len(retry))
+                streams = [self.generate_content_stream(theme, content, images, template_type) for _ in retry]
+                async for item in merge_streams(streams, retry):
+                    yield item
+    
+    async def _stream_validated(self, messages: List[dict], template_type: str, generate_span,
+                                max_tokens: int = None) -> AsyncGenerator[str, None]:
+        """
+        边生成边按模板校验输出：确认开头的顶层字段合法前先暂存输出，
+        明显偏离格式时取消上游请求并重试（最多 SCHEMA_MAX_RETRIES 次）
+        """
+        from . import config
+        
+        if not config.SCHEMA_VALIDATION_ENABLED:
+            async for content_chunk in self._stream_chat(messages, max_tokens=max_tokens, template=template_type):
+                yield content_chunk
+            return
+        
+        # 重试共享同一个总时长预算
+        deadline = StreamDeadline()
+        for attempt in range(config.SCHEMA_MAX_RETRIES + 1):
+            validator = StreamSchemaValidator(template_type, max_preamble=config.SCHEMA_MAX_PREAMBLE)
+            held = []
+            divergence = None
+            stream = self._stream_chat(messages, max_tokens=max_tokens, deadline=deadline, template=template_type)
+            try:
+                async for content_chunk in stream:
+                    if validator.committed:
+                        validator.feed(content_chunk)
+                        yield content_chunk
+                        continue
+                    
+                    try:
+                        validator.feed(content_chunk)
+                    except SchemaDivergence as e:
+                        divergence = e
+                        break
+                    held.append(content_chunk)
+                    if validator.committed:
+                        yield ''.join(held)
+                        held = []
+            finally:
+                # 中止时关闭上游流，立即释放连接、停止计费
+                await stream.aclose()
+            
+            if divergence is None:
+                if held:
+                    yield ''.join(held)
+                if validator.violations:
+                    metrics.inc('schema_late_violations_total', template=template_type)
+                    logger.warning(f"模型输出格式偏离（已发送，未重试）: {validator.violations[0]}")
+                return
+            
+            consumed = sum(len(c) for c in held)
+            metrics.inc('schema_divergence_total', template=template_type, reason=divergence.reason)
+            generate_span.add_event('schema_divergence', reason=divergence.reason, attempt=attempt, chars=consumed)
+            logger.warning(
+                f"模型输出偏离模板格式，已中止上游请求: {divergence}",
+                extra={'attempt': attempt + 1, 'chars': consumed}
+            )
+            if attempt < config.SCHEMA_MAX_RETRIES:
+                metrics.inc('schema_retries_total', template=template_type)
+        
+        raise Exception(f"模型输出不符合格式要求: {divergence}")
+    
+    async def optimize_text_stream(self, text: str, optimization_type: str = 'grammar') -> AsyncGenerator[str, None]:
+        prompt = self._build_optimize_prompt(text, optimization_type)
+        
+        messages = [
+            {"role": "system", "content": "你是一个专业的中文内容编辑..."},
+            {"role": "user", "content": prompt}
+        ]
+        _, max_tokens = fit_max_tokens(messages, template='optimize')
+        async for content_chunk in self._stream_chat(messages, temperature=0.3, max_tokens=max_tokens, template='optimize'):
+            yield content_chunk
+    
+    async def _stream_chat(self, messages: List[dict], temperature: float = 0.7, max_tokens: int = None,
+                           deadline: StreamDeadline = None, template: str = None) -> AsyncGenerator[str, None]:
+        """
+        调用 chat/completions 流式接口，逐块返回 delta 文本
+        
+        指定 template 时记录该模板的实际输出 token 数；因自适应的 max_tokens 被截断时，
+        带上已输出的内容续写一次（上限补足到 AI_MAX_OUTPUT_TOKENS），调用方看到的仍是连续的输出
+        """
+        from . import config
+        
+        usage = StreamUsage()
+        stream = self._stream_choices(messages, temperature, max_tokens, deadline, usage=usage)
+        try:
+            async for _, content_chunk in stream:
+                yield content_chunk
+        finally:
+            await stream.aclose()
+        if template is None:
+            return
+        
+        tokens = usage.tokens()
+        if not usage.truncated():
+            output_usage.record(template, tokens)
+            return
+        metrics.inc('completion_truncated_total', template=template)
+        if not max_tokens or max_tokens >= config.AI_MAX_OUTPUT_TOKENS:
+            output_usage.record(template, tokens, truncated=True)
+            logger.warning(f"模型输出达到 max_tokens 上限被截断: {tokens} tokens", extra={'template': template})
+            return
+        
+        continuation = messages + [
+            {"role": "assistant", "content": usage.text()},
+            {"role": "user", "content": "输出在中途被截断了。请从中断处继续输出剩余部分，不要重复已经输出的内容，也不要添加任何说明。"},
+        ]
+        try:
+            _, rest = fit_max_tokens(
+                continuation, max(config.AI_MIN_OUTPUT_TOKENS, config.AI_MAX_OUTPUT_TOKENS - tokens), template=template
+            )
+        except InputTooLarge:
+            output_usage.record(template, tokens, truncated=True)
+            return
+        metrics.inc('max_tokens_fallback_total', template=template)
+        logger.warning(f"输出在自适应上限 {max_tokens} tokens 处被截断，续写剩余部分", extra={'template': template})
+        more = StreamUsage()
+        stream = self._stream_choices(continuation, temperature, rest, deadline, usage=more)
+        try:
+            async for _, content_chunk in stream:
+                yield content_chunk
+        finally:
+            await stream.aclose()
+        output_usage.record(template, tokens + more.tokens(), truncated=more.truncated())
+    
+    async def _stream_choices(self, messages: List[dict], temperature: float = 0.7, max_tokens: int = None,
+                              deadline: StreamDeadline = None, n: int = 1, usage: StreamUsage = None):
+        """
+        调用 chat/completions 流式接口，逐块返回 (choice 序号, delta 文本)
+        
+        等待响应头、首个 token 和之后每个 token 时都受 deadline 限制（默认按配置新建）；
+        max_tokens 默认为 AI_MAX_OUTPUT_TOKENS。传入 usage 时记录输出的 token 数和各 choice 的结束原因
+        """
+        import httpx
+        from . import config
+        
+        if max_tokens is None:
+            max_tokens = config.AI_MAX_OUTPUT_TOKENS
+        if deadline is None:
+            deadline = StreamDeadline()
+        deadline.begin_attempt()
+        
+        # 设置 AI_RECORD_DIR 时录制本次上游响应
+        recording = None
+        # 熔断器打开时直接失败，不再连接上游
+        breaker = self.breaker
+        probe = breaker.before_call() if breaker is not None else False
+        outcome_recorded = False
+        
+        self.active_streams += 1
+        try:
             url = f"{self.base_url}/chat/completions"
             headers = {
                 "Content-Type": "application/json",
@@ -90,44 +944,129 @@ class CustomAIGenerator(AIContentGenerator):
             }
             payload = {
                 "model": self.model_name,
-                "messages": [
-                    {"role": "system", "content": "你是一个专业的内容创作助手..."},
-                    {"role": "user", "content": prompt}
-                ],
-                "temperature": 0.7,
-                "max_tokens": 2000,
+                "messages": messages,
+                "temperature": temperature,
+                "max_tokens": max_tokens,
                 "stream": True
             }
+            if n > 1:
+                payload["n"] = n
+            # 多个 choice 时 usage 是合计，各版本按输出文本估算，不需要上游返回
+            if usage is not None and n == 1 and config.AI_STREAM_USAGE and self.supports_stream_usage:
+                payload["stream_options"] = {"include_usage": True}
+            if config.AI_RECORD_DIR:
+                from .replay import Recording
+                recording = Recording(config.AI_RECORD_DIR, payload)
             
-            timeout = httpx.Timeout(10.0, read=180.0)
+            client = self._get_client()
             
-            async with httpx.AsyncClient(timeout=timeout, verify=False, proxy=None) as client:
-                async with client.stream('POST', url, headers=headers, json=payload) as response:
+            with span('upstream.request', model=self.model_name, max_tokens=max_tokens, n=n) as request_span:
+                # 连接建立到收到响应头 / 收到响应头到首个 token / 首个 token 之后的逐块输出
+                phase = start_span('upstream.connect')
+                response = None
+                try:
+                    request = client.build_request('POST', url, headers=headers, json=payload)
+                    response = await deadline.wait(client.send(request, stream=True))
+                    if response.status_code in (400, 422) and 'stream_options' in payload \
+                            and b'stream_options' in await deadline.wait(response.aread()):
+                        # 上游不接受 stream_options（错误信息中提到该参数）：之后不再发送，本次去掉后重发
+                        self.supports_stream_usage = False
+                        metrics.inc('stream_usage_fallback_total')
+                        logger.warning(f"上游不支持 stream_options（{response.status_code}），改为按输出文本估算 token 数")
+                        await response.aclose()
+                        del payload['stream_options']
+                        request = client.build_request('POST', url, headers=headers, json=payload)
+                        response = await deadline.wait(client.send(request, stream=True))
+                    phase.set_attribute('status_code', response.status_code)
+                    phase.end()
+                    if recording is not None:
+                        recording.response(response.status_code)
                     if response.status_code != 200:
-                        raise Exception(f"API 请求失败: {response.status_code}")
+                        raise UpstreamStatusError(response.status_code)
+                    # 生成请求成功访问上游，预热失败过也视为已就绪
+                    self.warmed_up = True
                     
-                    async for line in response.aiter_lines():
+                    phase = start_span('upstream.first_token')
+                    chunk_count = 0
+                    lines = response.aiter_lines()
+                    while True:
+                        # 只有内容 token 才重置停滞计时，上游的心跳行不算
+                        try:
+                            line = await deadline.wait(lines.__anext__())
+                        except StopAsyncIteration:
+                            if recording is not None:
+                                recording.complete = True
+                            break
+                        if recording is not None:
+                            recording.add(line)
                         if not line or line == 'data: [DONE]':
                             continue
                         
                         if line.startswith('data: '):
                             try:
                                 data = json.loads(line[6:])
-                                if 'choices' in data and len(data['choices']) > 0:
-                                    content_chunk = data['choices'][0].get('delta', {}).get('content', '')
+                                if usage is not None and data.get('usage'):
+                                    usage.completion_tokens = data['usage'].get('completion_tokens')
+                                for choice in data.get('choices') or []:
+                                    if usage is not None and choice.get('finish_reason'):
+                                        usage.finish_reasons[choice.get('index', 0)] = choice['finish_reason']
+                                    content_chunk = (choice.get('delta') or {}).get('content', '')
                                     if content_chunk:
-                                        yield content_chunk
+                                        deadline.mark_token()
+                                        if chunk_count == 0:
+                                            if breaker is not None:
+                                                breaker.record_success()
+                                                outcome_recorded = True
+                                            phase.end()
+                                            ttft_ms = request_span.elapsed_ms
+                                            request_span.set_attribute('ttft_ms', round(ttft_ms, 1))
+                                            metrics.observe('upstream_ttft_ms', ttft_ms)
+                                            phase = start_span('upstream.stream')
+                                        chunk_count += 1
+                                        if usage is not None:
+                                            usage.add(choice.get('index', 0), content_chunk)
+                                        yield choice.get('index', 0), content_chunk
 
                             except json.JSONDecodeError:
                                 continue
+                    request_span.set_attribute('chunks', chunk_count)
+                finally:
+                    phase.end()
+                    if response is not None:
+                        await response.aclose()
         
-        except httpx.ReadTimeout:
-            raise Exception("流式请求超时，请稍后重试")
-        except Exception as e:
-            logger.error(f"流式生成失败: {str(e)}", exc_info=True)
-            raise
+            if breaker is not None and not outcome_recorded:
+                # 上游正常结束但没有输出内容
+                breaker.record_success()
+                outcome_recorded = True
         
-    
+        except Exception as e:
+            if isinstance(e, httpx.ConnectTimeout):
+                error = DeadlineExceeded('connect', config.AI_CONNECT_TIMEOUT)
+            elif isinstance(e, httpx.ReadTimeout):
+                error = DeadlineExceeded('stall', self.timeout)
+            else:
+                error = e
+            if breaker is not None and not outcome_recorded:
+                if is_upstream_failure(error):
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+                outcome_recorded = True
+            # 完整堆栈由调用方记录，这里只记录一行，避免同一错误重复输出
+            logger.warning(f"上游流式请求失败: {str(error)}")
+            if error is e:
+                raise
+            raise error from None
+        finally:
+            if recording is not None:
+                recording.save()
+            if breaker is not None and not outcome_recorded:
+                # 客户端取消等未产生结果的调用，归还半开探测名额
+                breaker.release(probe)
+            self.active_streams -= 1
+            if self._close_when_idle and not self.active_streams:
+                await self.close()
     
     def _build_prompt(self, theme: str, content: str, template_type: str = 'normal') -> str:
         """构建提示词 - 根据模板类型返回不同的JSON格式要求"""
@@ -166,6 +1105,55 @@ class CustomAIGenerator(AIContentGenerator):
 6. 内容专业、准确、有深度
 7. 只输出JSON，不要有任何其他文字"""
     
+    def _build_outline_prompt(self, theme: str, content: str) -> str:
+        """构建大纲模式第一步的提示词 - 只返回版块标题，不展开要点"""
+        return f"""请根据以下信息为一篇文章拟定大纲，以JSON格式返回：
+
+主题：{theme}
+内容描述：{content}
+
+请严格按照以下JSON格式返回：
+{{
+  "title": "文章标题",
+  "intro": "引导语简介，一段话即可",
+  "sections": [
+    {{"title": "版块标题"}}
+  ],
+  "footer": "结语文字"
+}}
+
+重要要求：
+1. 必须返回合法的JSON格式，可以被JSON.parse()直接解析
+2. 所有字符串值必须在同一行内，不要包含换行符
+3. 不要在JSON外面包裹```json```代码块标记
+4. sections数组可包含2-6个版块，只写版块标题，不要写要点
+5. 各版块之间不要重复，按阅读顺序排列
+6. 只输出JSON，不要有任何其他文字"""
+    
+    def _build_section_prompt(self, theme: str, content: str, outline: dict, titles: List[str], index: int) -> str:
+        """构建大纲模式第二步的提示词 - 只生成一个版块的要点"""
+        outline_text = '\n'.join(f"{i + 1}. {title}" for i, title in enumerate(titles))
+        return f"""请为下面这篇文章中的一个版块撰写要点，以JSON格式返回：
+
+主题：{theme}
+内容描述：{content}
+文章标题：{outline.get('title') or theme}
+文章大纲：
+{outline_text}
+
+需要撰写的版块：{index + 1}. {titles[index]}
+
+请严格按照以下JSON格式返回：
+["要点1", "要点2", "要点3"]
+
+重要要求：
+1. 必须返回合法的JSON数组，可以被JSON.parse()直接解析
+2. 所有字符串值必须在同一行内，不要包含换行符
+3. 不要在JSON外面包裹```json```代码块标记
+4. 包含2-8个要点，只写这一个版块，不要与其他版块的内容重复
+5. 内容专业、准确、有深度
+6. 只输出JSON，不要有任何其他文字"""
+    
     def _build_wechat_prompt(self, theme: str, content: str) -> str:
         """构建微信聊天的提示词 - 返回JSON格式"""
         return f"""请根据以下信息生成一段微信聊天记录，以JSON格式返回：
@@ -194,4 +1182,25 @@ class CustomAIGenerator(AIContentGenerator):
 6. 对话内容自然真实
 7. 只输出JSON，不要有任何其他文字"""
     
-    
\ No newline at end of file
+    
+    def _build_optimize_prompt(self, text: str, optimization_type: str = 'grammar') -> str:
+        """构建内容优化的提示词 - 只返回优化后的 Markdown 片段"""
+        goals = {
+            'grammar': '修正错别字、语法和标点错误，保持原意和语气不变',
+            'seo': '在不改变原意的前提下优化标题和关键词表达，使其更利于搜索引擎收录',
+            'readability': '调整句子结构和段落节奏，使内容更通顺易读',
+            'engagement': '增强表达的感染力和吸引力，使读者更愿意读下去',
+        }
+        goal = goals.get(optimization_type, goals['grammar'])
+        return f"""请优化下面这段 Markdown 内容。
+
+优化目标：{goal}
+
+待优化内容：
+{text}
+
+重要要求：
+1. 保留原有的 Markdown 结构（标题层级、列表、代码块、链接、图片）
+2. 这只是完整文档中的一个片段，不要添加开场白、总结或额外的标题
+3. 不要在结果外面包裹```markdown```代码块标记
+4. 只输出优化后的内容，不要有任何解释文字"""
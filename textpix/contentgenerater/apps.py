@@ -1,6 +1,28 @@
+import os
+import sys
+import threading
+
 from django.apps import AppConfig
 
 
 class ContentgeneraterConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "contentgenerater"
+
+    def ready(self):
+        from . import config
+
+        if not config.AI_WARMUP_ON_STARTUP or self._is_management_command():
+            return
+
+        from .ai_service import warmup_ai_generator
+
+        # 在后台线程中预热，不阻塞服务启动；预热完成前 /api/ready 返回 503
+        threading.Thread(target=warmup_ai_generator, name='ai-warmup', daemon=True).start()
+
+    @staticmethod
+    def _is_management_command():
+        """migrate / collectstatic / test 等管理命令不需要预热"""
+        if os.path.basename(sys.argv[0]) != 'manage.py':
+            return False
+        return sys.argv[1:2] != ['runserver']
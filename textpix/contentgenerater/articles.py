@@ -0,0 +1,102 @@
+"""
+文章存储
+生成完成的 JSON 按内容 ID 持久化，HTML 只渲染一次，
+读取时优先走缓存（内容 ID 即 ETag，内容不可变）
+"""
+import hashlib
+import json
+import logging
+from typing import Dict, List, Optional
+
+from django.core.cache import cache
+
+from . import config
+from .models import Article
+from .streaming_renderer import render_html
+
+logger = logging.getLogger(__name__)
+
+
+def make_content_id(data: Dict, template_type: str = 'normal') -> str:
+    """根据模板类型和规范化后的 JSON 计算内容 ID（相同内容得到相同 ID）"""
+    canonical = json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(f"{template_type}\0{canonical}".encode('utf-8')).hexdigest()[:32]
+
+
+def make_etag(content_id: str) -> str:
+    """文章 ETag（内容寻址，ID 不变内容就不变）"""
+    return f'"{content_id}"'
+
+
+def _cache_key(content_id: str) -> str:
+    return f"article:{content_id}"
+
+
+def save_article(data: Dict, template_type: str = 'normal', theme: str = '') -> Article:
+    """
+    保存生成结果（已存在相同内容时直接返回，不重复渲染）
+
+    Args:
+        data: 模型生成的最终 JSON
+        template_type: 模板类型
+        theme: 主题
+
+    Returns:
+        Article 实例
+    """
+    content_id = make_content_id(data, template_type)
+    article, created = Article.objects.get_or_create(
+        content_id=content_id,
+        defaults={
+            'template_type': template_type,
+            'theme': theme[:200],
+            'data': data,
+            'html': render_html(data, template_type),
+        }
+    )
+    if created:
+        logger.info(f"文章已保存: {content_id}")
+    _cache_article(article)
+    return article
+
+
+def _cache_article(article: Article) -> Dict:
+    entry = {
+        'content_id': article.content_id,
+        'template_type': article.template_type,
+        'data': article.data,
+        'html': article.html,
+    }
+    cache.set(_cache_key(article.content_id), entry, config.ARTICLE_CACHE_TIMEOUT)
+    return entry
+
+
+def get_article(content_id: str) -> Optional[Dict]:
+    """读取文章（先查缓存，未命中时一次按索引查询数据库）"""
+    entry = cache.get(_cache_key(content_id))
+    if entry is not None:
+        return entry
+
+    article = Article.objects.filter(content_id=content_id).first()
+    if article is None:
+        return None
+    return _cache_article(article)
+
+
+def _group_cache_key(group_id: str) -> str:
+    return f"variants:{group_id}"
+
+
+def save_variant_group(content_ids: List[str]) -> str:
+    """把同一次请求生成的多个版本缓存为一组，返回组 ID（版本顺序不变）"""
+    group_id = hashlib.sha256('\0'.join(content_ids).encode('utf-8')).hexdigest()[:32]
+    cache.set(_group_cache_key(group_id), list(content_ids), config.ARTICLE_CACHE_TIMEOUT)
+    return group_id
+
+
+def get_variant_group(group_id: str) -> Optional[List[Dict]]:
+    """读取一组版本（组已过期时返回 None，单篇文章已不存在时跳过）"""
+    content_ids = cache.get(_group_cache_key(group_id))
+    if content_ids is None:
+        return None
+    return [entry for entry in (get_article(content_id) for content_id in content_ids) if entry is not None]
@@ -0,0 +1,271 @@
+"""
+输入与 token 预算
+按模板估算提示词的 token 数：内容描述超过 MAX_CONTENT_LENGTH 时拒绝或确定性地压缩，
+并根据模型上下文长度调整 max_tokens，避免超长输入拖慢预填充或超出上下文；
+按模板统计实际输出的 token 数，用高分位数加余量代替固定的 max_tokens
+"""
+import math
+import re
+import threading
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .metrics import metrics
+
+# 中日韩文字和全角标点大致一个字一个 token，其余字符大致 4 个一个 token
+_CJK_PATTERN = r'[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]'
+_cjk = None
+# 每条消息的格式开销（role、分隔符）和整个请求的固定开销
+_MESSAGE_OVERHEAD = 4
+_REQUEST_OVERHEAD = 3
+# 估算误差余量
+_ESTIMATE_MARGIN = 1.1
+
+_SENTENCE_END = re.compile(r'[。！？!?；;\n]|\.\s')
+TRIM_MARKER = '\n……\n'
+
+
+class InputTooLarge(ValueError):
+    """输入超出长度或上下文限制"""
+
+    code = 'input_too_large'
+    retryable = False
+
+
+def estimate_tokens(text: str) -> int:
+    """估算文本的 token 数（偏保守，不依赖具体模型的分词器）"""
+    global _cjk
+    if not text:
+        return 0
+    if _cjk is None:
+        # 大字符集的正则编译较慢，首次使用时才编译
+        _cjk = re.compile(_CJK_PATTERN)
+    cjk = len(_cjk.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def count_message_tokens(messages: List[dict]) -> int:
+    """估算 chat 消息列表的 token 数"""
+    return _REQUEST_OVERHEAD + sum(
+        _MESSAGE_OVERHEAD + estimate_tokens(message.get('content') or '') for message in messages
+    )
+
+
+def condense(text: str, max_chars: int) -> str:
+    """
+    确定性地压缩文本到 max_chars 以内：
+    先合并多余空白、去掉重复的行，仍然超长时保留开头和结尾（在句子边界截断），中间用省略号连接
+    """
+    lines = []
+    seen = set()
+    for line in text.splitlines():
+        line = re.sub(r'[ \t\u3000]+', ' ', line).strip()
+        if line and line in seen:
+            continue
+        if line:
+            seen.add(line)
+        elif lines and not lines[-1]:
+            continue
+        lines.append(line)
+    text = '\n'.join(lines).strip()
+    if len(text) <= max_chars:
+        return text
+
+    budget = max_chars - len(TRIM_MARKER)
+    if budget <= 0:
+        return text[:max_chars]
+    head_budget = int(budget * 0.7)
+    tail_budget = budget - head_budget
+
+    head = text[:head_budget]
+    ends = [m.end() for m in _SENTENCE_END.finditer(head)]
+    if ends and ends[-1] >= head_budget // 2:
+        head = head[:ends[-1]]
+
+    tail = text[-tail_budget:] if tail_budget else ''
+    match = _SENTENCE_END.search(tail)
+    if match and match.end() <= tail_budget // 2:
+        tail = tail[match.end():]
+
+    return head.rstrip() + TRIM_MARKER + tail.lstrip()
+
+
+def check_content_length(content: str) -> str:
+    """
+    按 MAX_CONTENT_LENGTH 检查内容描述；超长时按 CONTENT_OVERFLOW_POLICY 拒绝（抛出 InputTooLarge）或压缩
+    """
+    from . import config
+
+    limit = config.MAX_CONTENT_LENGTH
+    if not limit or len(content) <= limit:
+        return content
+    if config.CONTENT_OVERFLOW_POLICY != 'trim':
+        metrics.inc('input_rejected_total', reason='length')
+        raise InputTooLarge(f"内容描述过长（{len(content)} 字），最多 {limit} 字")
+    metrics.inc('input_trimmed_total', reason='length')
+    return condense(content, limit)
+
+
+class StreamUsage:
+    """一次流式调用的输出统计：上游 usage 块中的 completion_tokens（没有时按输出文本估算）和各 choice 的结束原因"""
+
+    def __init__(self):
+        self.completion_tokens = None
+        self.finish_reasons = {}
+        self._chunks = {}
+
+    def add(self, index: int, chunk: str):
+        self._chunks.setdefault(index, []).append(chunk)
+
+    def text(self, index: int = 0) -> str:
+        return ''.join(self._chunks.get(index, []))
+
+    def tokens(self, index: int = 0) -> int:
+        # 多个 choice 时 usage 是合计，按各自的文本估算
+        if self.completion_tokens is not None and len(self._chunks) <= 1:
+            return self.completion_tokens
+        return estimate_tokens(self.text(index))
+
+    def truncated(self, index: int = 0) -> bool:
+        return self.finish_reasons.get(index) == 'length'
+
+
+def _percentile(ordered: List[int], pct: float) -> int:
+    """最近秩法分位数（ordered 已排序且非空）"""
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))]
+
+
+class OutputUsage:
+    """
+    按模板记录最近 ADAPTIVE_MAX_TOKENS_WINDOW 次的实际输出 token 数，
+    样本足够后以 ADAPTIVE_MAX_TOKENS_PERCENTILE 分位数乘以 (1 + ADAPTIVE_MAX_TOKENS_MARGIN) 作为 max_tokens
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._truncated = {}
+
+    def record(self, template: str, tokens: int, truncated: bool = False):
+        from . import config
+
+        metrics.observe('completion_tokens', tokens, template=template)
+        with self._lock:
+            samples = self._samples.get(template)
+            if samples is None:
+                samples = self._samples[template] = deque(maxlen=max(1, config.ADAPTIVE_MAX_TOKENS_WINDOW))
+            samples.append(tokens)
+            if truncated:
+                self._truncated[template] = self._truncated.get(template, 0) + 1
+
+    def suggest(self, template: str, ceiling: int) -> Optional[int]:
+        """样本不足或未启用时返回 None（使用固定的上限）"""
+        from . import config
+
+        if not config.ADAPTIVE_MAX_TOKENS:
+            return None
+        with self._lock:
+            ordered = sorted(self._samples.get(template, ()))
+        if not ordered or len(ordered) < config.ADAPTIVE_MAX_TOKENS_MIN_SAMPLES:
+            return None
+        value = math.ceil(_percentile(ordered, config.ADAPTIVE_MAX_TOKENS_PERCENTILE) * (1 + config.ADAPTIVE_MAX_TOKENS_MARGIN))
+        return min(ceiling, max(config.AI_MIN_OUTPUT_TOKENS, value))
+
+    def snapshot(self) -> Dict:
+        """各模板的输出分布和当前的 max_tokens，供 /api/metrics 展示"""
+        from . import config
+
+        with self._lock:
+            templates = {template: sorted(samples) for template, samples in self._samples.items()}
+            truncated = dict(self._truncated)
+        result = {}
+        for template, ordered in templates.items():
+            result[template] = {
+                'samples': len(ordered),
+                'p50': _percentile(ordered, 50),
+                'p95': _percentile(ordered, 95),
+                'max': ordered[-1],
+                'truncated': truncated.get(template, 0),
+                'max_tokens': self.suggest(template, config.AI_MAX_OUTPUT_TOKENS) or config.AI_MAX_OUTPUT_TOKENS,
+            }
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+            self._truncated.clear()
+
+
+# 全局输出用量统计
+output_usage = OutputUsage()
+
+
+def fit_max_tokens(messages: List[dict], max_tokens: int = None, template: str = 'default') -> Tuple[int, int]:
+    """
+    根据上下文长度调整 max_tokens
+
+    没有指定 max_tokens 时，按该模板观测到的输出长度确定（见 OutputUsage），样本不足时使用 AI_MAX_OUTPUT_TOKENS
+
+    Returns:
+        (提示词估算 token 数, 调整后的 max_tokens)
+
+    Raises:
+        InputTooLarge: 留给输出的 token 少于 AI_MIN_OUTPUT_TOKENS
+    """
+    from . import config
+
+    prompt_tokens = count_message_tokens(messages)
+    metrics.observe('prompt_tokens', prompt_tokens, template=template)
+
+    requested = max_tokens or output_usage.suggest(template, config.AI_MAX_OUTPUT_TOKENS) or config.AI_MAX_OUTPUT_TOKENS
+    if not config.AI_CONTEXT_WINDOW:
+        return prompt_tokens, requested
+    available = config.AI_CONTEXT_WINDOW - math.ceil(prompt_tokens * _ESTIMATE_MARGIN)
+    if available < min(requested, config.AI_MIN_OUTPUT_TOKENS):
+        metrics.inc('input_rejected_total', reason='context')
+        raise InputTooLarge(f"提示词约 {prompt_tokens} tokens，超出模型上下文（{config.AI_CONTEXT_WINDOW}）")
+    if available < requested:
+        metrics.inc('max_tokens_clamped_total', template=template)
+        return prompt_tokens, available
+    return prompt_tokens, requested
+
+
+def fit_content(content: str, build_messages: Callable[[str], List[dict]], template: str = 'default') -> Tuple[str, List[dict]]:
+    """
+    让内容描述连同模板一起放进上下文，同时给输出留出至少 AI_MIN_OUTPUT_TOKENS
+
+    超出时按 CONTENT_OVERFLOW_POLICY 拒绝或逐步压缩内容描述
+
+    Returns:
+        (最终的内容描述, 消息列表)
+    """
+    from . import config
+
+    content = check_content_length(content)
+    messages = build_messages(content)
+    if not config.AI_CONTEXT_WINDOW:
+        return content, messages
+
+    limit = math.floor((config.AI_CONTEXT_WINDOW - config.AI_MIN_OUTPUT_TOKENS) / _ESTIMATE_MARGIN)
+    excess = count_message_tokens(messages) - limit
+    if excess <= 0:
+        return content, messages
+    if config.CONTENT_OVERFLOW_POLICY != 'trim':
+        metrics.inc('input_rejected_total', reason='context')
+        raise InputTooLarge("内容描述过长，超出模型上下文")
+
+    # 按 token 超出比例缩短，估算偏差时再缩短一些
+    for _ in range(5):
+        content_tokens = estimate_tokens(content)
+        target = content_tokens - excess
+        if target <= 0:
+            break
+        content = condense(content, int(len(content) * target / content_tokens * 0.95))
+        messages = build_messages(content)
+        excess = count_message_tokens(messages) - limit
+        if excess <= 0:
+            metrics.inc('input_trimmed_total', reason='context')
+            return content, messages
+
+    metrics.inc('input_rejected_total', reason='context')
+    raise InputTooLarge("提示词模板本身超出模型上下文")
@@ -0,0 +1,215 @@
+"""
+上游熔断器
+连续失败次数或时间窗口内的错误率超过阈值时打开：此后的请求不再连接上游，直接返回可重试的错误；
+打开一段时间后进入半开状态，放行少量探测请求，探测成功则关闭，失败则重新打开
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    """熔断器打开，请求未发往上游"""
+
+    code = 'circuit_open'
+    retryable = True
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"上游服务暂不可用，请 {retry_after:.0f} 秒后重试")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    用法:
+        probe = breaker.before_call()  # 打开时抛出 CircuitOpenError；半开时返回 True 表示本次是探测请求
+        try:
+            ...
+            breaker.record_success()
+        except Exception:
+            breaker.record_failure()
+            raise
+        finally:
+            breaker.release(probe)     # 调用未产生结果（如客户端取消）时归还探测名额
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, error_rate: float = 0.5,
+                 min_requests: int = 10, window: float = 60.0, open_seconds: float = 30.0,
+                 half_open_probes: int = 1, key_id: str = ''):
+        self.name = name
+        self.key_id = key_id
+        # 指标标签：租户熔断器另带密钥指纹，与同一地址的服务端熔断器分开
+        self.labels = {'upstream': name, 'key_id': key_id} if key_id else {'upstream': name}
+        self.failure_threshold = failure_threshold
+        self.error_rate = error_rate
+        self.min_requests = min_requests
+        self.window = window
+        self.open_seconds = open_seconds
+        self.half_open_probes = max(1, half_open_probes)
+
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._outcomes = deque()  # (时间, 是否成功)
+        self._probes = 0
+        self._lock = threading.Lock()
+        metrics.set_gauge('circuit_state', _STATE_VALUES[CLOSED], **self.labels)
+
+    # ---------- 状态 ----------
+
+    def _transition(self, state: str, reason: str = ''):
+        if state == self.state:
+            return
+        previous, self.state = self.state, state
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+        if state != HALF_OPEN:
+            self._probes = 0
+        if state == CLOSED:
+            self.consecutive_failures = 0
+            self._outcomes.clear()
+
+        metrics.set_gauge('circuit_state', _STATE_VALUES[state], **self.labels)
+        metrics.inc('circuit_transitions_total', to=state, **self.labels)
+        log = logger.warning if state == OPEN else logger.info
+        name = f"{self.name}（密钥 {self.key_id}）" if self.key_id else self.name
+        log(f"上游熔断器 {name}: {previous} -> {state}" + (f"（{reason}）" if reason else ''))
+
+    def _prune(self, now: float):
+        while self._outcomes and now - self._outcomes[0][0] > self.window:
+            self._outcomes.popleft()
+
+    def _should_open(self, now: float) -> str:
+        if self.failure_threshold and self.consecutive_failures >= self.failure_threshold:
+            return f"连续失败 {self.consecutive_failures} 次"
+        self._prune(now)
+        total = len(self._outcomes)
+        if self.error_rate and total >= self.min_requests:
+            failures = sum(1 for _, ok in self._outcomes if not ok)
+            if failures / total >= self.error_rate:
+                return f"{self.window:g}s 内错误率 {failures}/{total}"
+        return ''
+
+    # ---------- 调用 ----------
+
+    def before_call(self):
+        with self._lock:
+            if self.state == OPEN:
+                elapsed = time.monotonic() - self.opened_at
+                if elapsed < self.open_seconds:
+                    metrics.inc('circuit_rejected_total', **self.labels)
+                    raise CircuitOpenError(self.name, self.open_seconds - elapsed)
+                self._transition(HALF_OPEN, '开始探测')
+
+            if self.state == HALF_OPEN:
+                if self._probes >= self.half_open_probes:
+                    metrics.inc('circuit_rejected_total', **self.labels)
+                    raise CircuitOpenError(self.name, 1)
+                self._probes += 1
+                return True
+        return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._transition(CLOSED, '探测成功')
+                return
+            self.consecutive_failures = 0
+            self._outcomes.append((time.monotonic(), True))
+
+    def record_failure(self):
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._transition(OPEN, '探测失败')
+                return
+            if self.state == OPEN:
+                return
+            now = time.monotonic()
+            self.consecutive_failures += 1
+            self._outcomes.append((now, False))
+            reason = self._should_open(now)
+            if reason:
+                self._transition(OPEN, reason)
+
+    def release(self, probe: bool):
+        """探测请求未产生结果（被取消）时归还名额"""
+        if not probe:
+            return
+        with self._lock:
+            if self.state == HALF_OPEN and self._probes > 0:
+                self._probes -= 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            self._prune(time.monotonic())
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "window_requests": len(self._outcomes),
+                "window_failures": sum(1 for _, ok in self._outcomes if not ok),
+            }
+
+
+def make_breaker(name: str, key_id: str = '') -> CircuitBreaker:
+    """按配置创建熔断器"""
+    from . import config
+
+    return CircuitBreaker(
+        name,
+        failure_threshold=config.CIRCUIT_FAILURE_THRESHOLD,
+        error_rate=config.CIRCUIT_ERROR_RATE,
+        min_requests=config.CIRCUIT_MIN_REQUESTS,
+        window=config.CIRCUIT_WINDOW,
+        open_seconds=config.CIRCUIT_OPEN_SECONDS,
+        half_open_probes=config.CIRCUIT_HALF_OPEN_PROBES,
+        key_id=key_id,
+    )
+
+
+class BreakerRegistry:
+    """
+    租户熔断器按 (接口地址, 密钥指纹) 保存在进程内，不随生成器存亡：
+    租户生成器被 LRU 移除后重建时沿用原来的熔断状态。
+    超过 max_size 时优先移除最久未用且处于正常状态的熔断器（它们不携带需要保留的状态）
+    """
+
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self._breakers: 'OrderedDict[tuple, CircuitBreaker]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, name: str, key_id: str) -> CircuitBreaker:
+        key = (name, key_id)
+        with self._lock:
+            breaker = self._breakers.get(key)
+            if breaker is not None:
+                self._breakers.move_to_end(key)
+                return breaker
+            breaker = self._breakers[key] = make_breaker(name, key_id)
+            while len(self._breakers) > self.max_size:
+                idle = next((k for k, b in self._breakers.items()
+                             if b.state == CLOSED and not b.consecutive_failures), None)
+                self._breakers.pop(idle if idle is not None else next(iter(self._breakers)))
+            return breaker
+
+    def clear(self):
+        with self._lock:
+            self._breakers.clear()
+
+    def __len__(self):
+        return len(self._breakers)
+
+
+# 全局租户熔断器
+tenant_breakers = BreakerRegistry()
@@ -20,16 +20,186 @@ def get_config(key, default=None):
 CUSTOM_AI_BASE_URL = get_config('CUSTOM_AI_BASE_URL', '')
 CUSTOM_AI_API_KEY = get_config('CUSTOM_AI_API_KEY', '')
 CUSTOM_AI_MODEL = get_config('CUSTOM_AI_MODEL', '')
+# 单次读取上游的兜底超时（秒），正常情况下由下面的首 token / 停滞限制先触发
 CUSTOM_AI_TIMEOUT = int(get_config('CUSTOM_AI_TIMEOUT', '60'))
 
+# -------------------- 上游时间预算（秒，0 表示不限制） --------------------
+# 建立连接 / 发出请求到收到首个 token / 相邻两个 token 之间的最大间隔
+AI_CONNECT_TIMEOUT = float(get_config('AI_CONNECT_TIMEOUT', '10'))
+AI_FIRST_TOKEN_TIMEOUT = float(get_config('AI_FIRST_TOKEN_TIMEOUT', '30'))
+AI_STALL_TIMEOUT = float(get_config('AI_STALL_TIMEOUT', '20'))
+
+# -------------------- 上游熔断 --------------------
+# 上游连续失败或错误率过高时暂停请求，直接返回可重试的错误
+CIRCUIT_BREAKER_ENABLED = get_config('CIRCUIT_BREAKER_ENABLED', 'True').lower() == 'true'
+# 连续失败多少次后打开（0 表示不按连续次数判断）
+CIRCUIT_FAILURE_THRESHOLD = int(get_config('CIRCUIT_FAILURE_THRESHOLD', '5'))
+# 统计窗口（秒）内请求数不少于 CIRCUIT_MIN_REQUESTS 且错误率达到 CIRCUIT_ERROR_RATE 时打开（0 表示不按错误率判断）
+CIRCUIT_ERROR_RATE = float(get_config('CIRCUIT_ERROR_RATE', '0.5'))
+CIRCUIT_MIN_REQUESTS = int(get_config('CIRCUIT_MIN_REQUESTS', '10'))
+CIRCUIT_WINDOW = float(get_config('CIRCUIT_WINDOW', '60'))
+# 打开后多久（秒）进入半开状态 / 半开时同时放行的探测请求数
+CIRCUIT_OPEN_SECONDS = float(get_config('CIRCUIT_OPEN_SECONDS', '30'))
+CIRCUIT_HALF_OPEN_PROBES = int(get_config('CIRCUIT_HALF_OPEN_PROBES', '1'))
+
+# -------------------- 上游连接池与预热 --------------------
+# 连接池最大连接数 / 最大空闲连接数 / 空闲连接保持时间（秒）
+AI_POOL_MAX_CONNECTIONS = int(get_config('AI_POOL_MAX_CONNECTIONS', '20'))
+AI_POOL_MAX_KEEPALIVE = int(get_config('AI_POOL_MAX_KEEPALIVE', '10'))
+AI_POOL_KEEPALIVE_EXPIRY = float(get_config('AI_POOL_KEEPALIVE_EXPIRY', '60'))
+# 应用启动时预热生成器并建立上游连接（默认关闭）
+AI_WARMUP_ON_STARTUP = get_config('AI_WARMUP_ON_STARTUP', 'False').lower() == 'true'
+# 预热时预先建立的连接数
+AI_WARMUP_CONNECTIONS = int(get_config('AI_WARMUP_CONNECTIONS', '1'))
+# 预热失败后的首次重试间隔 / 最长重试间隔（秒，按指数退避）
+AI_WARMUP_RETRY_DELAY = float(get_config('AI_WARMUP_RETRY_DELAY', '1'))
+AI_WARMUP_RETRY_MAX = float(get_config('AI_WARMUP_RETRY_MAX', '60'))
+
+# -------------------- 自带密钥（租户凭据） --------------------
+# 允许请求通过 X-AI-API-Key / X-AI-Base-URL / X-AI-Model 头使用自己的上游凭据（默认关闭）
+AI_BYOK_ENABLED = get_config('AI_BYOK_ENABLED', 'False').lower() == 'true'
+# 允许的上游主机（逗号分隔，建议配置）；留空时只允许解析到公网地址的域名（拒绝 IP 地址、localhost 和内网地址，
+# 每次建立连接时重新检查并直接连接检查过的地址）
+AI_BYOK_ALLOWED_HOSTS = [h.strip().lower() for h in get_config('AI_BYOK_ALLOWED_HOSTS', '').split(',') if h.strip()]
+# 是否允许 http 地址
+AI_BYOK_ALLOW_HTTP = get_config('AI_BYOK_ALLOW_HTTP', 'False').lower() == 'true'
+# 最多同时保留的租户连接池数 / 空闲多久（秒）后关闭
+AI_BYOK_MAX_POOLS = int(get_config('AI_BYOK_MAX_POOLS', '32'))
+AI_BYOK_IDLE_TIMEOUT = float(get_config('AI_BYOK_IDLE_TIMEOUT', '300'))
+
+# -------------------- 上游录制与回放 --------------------
+# 录制目录：非空时把每次上游流式响应（含逐行到达时间）写入该目录
+AI_RECORD_DIR = get_config('AI_RECORD_DIR', '')
+# 回放目录（或单个录制文件）：非空时不访问上游，从录制返回响应（不需要配置上游地址和密钥）
+AI_REPLAY_DIR = get_config('AI_REPLAY_DIR', '')
+# 回放倍速：1 按原始节奏，大于 1 加速，0 不等待
+AI_REPLAY_SPEED = float(get_config('AI_REPLAY_SPEED', '1'))
+# 严格模式：没有与请求指纹匹配的录制时报错，而不是依次使用其他录制
+AI_REPLAY_STRICT = get_config('AI_REPLAY_STRICT', 'False').lower() == 'true'
+
 # ==================== 内容生成配置 ====================
 
 DEFAULT_LANGUAGE = get_config('CONTENT_LANGUAGE', 'zh-CN')
+# 内容描述的最大字数；超出时 reject(拒绝) | trim(去掉重复和多余空白，仍超长时保留首尾)
 MAX_CONTENT_LENGTH = int(get_config('MAX_CONTENT_LENGTH', '10000'))
-GENERATION_TIMEOUT = int(get_config('GENERATION_TIMEOUT', '60'))
+CONTENT_OVERFLOW_POLICY = get_config('CONTENT_OVERFLOW_POLICY', 'reject')
+# 模型上下文长度（token，0 表示不检查）/ 输出 max_tokens 上限 / 至少留给输出的 token 数
+AI_CONTEXT_WINDOW = int(get_config('AI_CONTEXT_WINDOW', '32768'))
+AI_MAX_OUTPUT_TOKENS = int(get_config('AI_MAX_OUTPUT_TOKENS', '2000'))
+AI_MIN_OUTPUT_TOKENS = int(get_config('AI_MIN_OUTPUT_TOKENS', '512'))
+# 按模板统计实际输出的 token 数，样本数达到 MIN_SAMPLES 后以 PERCENTILE 分位数 ×(1+MARGIN) 作为 max_tokens
+# （不低于 AI_MIN_OUTPUT_TOKENS、不超过 AI_MAX_OUTPUT_TOKENS）；因此被截断时带上已输出内容续写一次
+ADAPTIVE_MAX_TOKENS = get_config('ADAPTIVE_MAX_TOKENS', 'True').lower() == 'true'
+ADAPTIVE_MAX_TOKENS_PERCENTILE = float(get_config('ADAPTIVE_MAX_TOKENS_PERCENTILE', '95'))
+ADAPTIVE_MAX_TOKENS_MARGIN = float(get_config('ADAPTIVE_MAX_TOKENS_MARGIN', '0.2'))
+ADAPTIVE_MAX_TOKENS_MIN_SAMPLES = int(get_config('ADAPTIVE_MAX_TOKENS_MIN_SAMPLES', '20'))
+ADAPTIVE_MAX_TOKENS_WINDOW = int(get_config('ADAPTIVE_MAX_TOKENS_WINDOW', '200'))
+# 请求上游在流末尾返回 usage（stream_options.include_usage）；上游以 400/422 拒绝该参数时自动停止发送，
+# 设为 False 则始终不发送，按输出文本估算
+AI_STREAM_USAGE = get_config('AI_STREAM_USAGE', 'True').lower() == 'true'
+# 一次生成的总时长上限（秒，包括格式重试），应小于 gunicorn 的 worker 超时
+GENERATION_TIMEOUT = float(get_config('GENERATION_TIMEOUT', '110'))
 ENABLE_CACHE = get_config('ENABLE_CACHE', 'True').lower() == 'true'
+# 近似重复请求缓存：主题和内容描述的相似度（Jaccard）不低于阈值时复用同一模板下已生成的结果
+SEMANTIC_CACHE_THRESHOLD = float(get_config('SEMANTIC_CACHE_THRESHOLD', '0.8'))
+# 最多缓存的生成结果数 / 缓存时间（秒）
+SEMANTIC_CACHE_SIZE = int(get_config('SEMANTIC_CACHE_SIZE', '1000'))
+SEMANTIC_CACHE_TTL = float(get_config('SEMANTIC_CACHE_TTL', '3600'))
+
+# 边生成边按模板校验输出格式，明显偏离时中止上游请求并重试
+SCHEMA_VALIDATION_ENABLED = get_config('SCHEMA_VALIDATION_ENABLED', 'True').lower() == 'true'
+# 偏离格式时的最大重试次数
+SCHEMA_MAX_RETRIES = int(get_config('SCHEMA_MAX_RETRIES', '1'))
+# JSON 开始前允许的说明文字字符数，超过视为输出的不是 JSON
+SCHEMA_MAX_PREAMBLE = int(get_config('SCHEMA_MAX_PREAMBLE', '40'))
+
+# 一次请求最多生成的版本数（variants 参数）
+MAX_VARIANTS = int(get_config('MAX_VARIANTS', '4'))
+# 多版本优先使用上游的 n 参数（一次调用返回多个 choice），关闭或上游不支持时并发调用
+AI_VARIANTS_USE_N = get_config('AI_VARIANTS_USE_N', 'True').lower() == 'true'
+# 大纲模式（请求 mode=outline，仅 normal 模板）：先生成大纲，再并行生成各版块的要点
+# 同时生成的版块数、大纲和单个版块的 max_tokens
+OUTLINE_CONCURRENCY = int(get_config('OUTLINE_CONCURRENCY', '4'))
+OUTLINE_MAX_TOKENS = int(get_config('OUTLINE_MAX_TOKENS', '800'))
+OUTLINE_SECTION_MAX_TOKENS = int(get_config('OUTLINE_SECTION_MAX_TOKENS', '600'))
+
+# ==================== 流式输出配置 ====================
+
+# 每个流的缓冲区高水位（块数），客户端落后超过该值时触发溢出策略
+STREAM_BUFFER_HIGH_WATER = int(get_config('STREAM_BUFFER_HIGH_WATER', '64'))
+# 溢出策略: coalesce(合并文本块，不阻塞上游) | block(暂停读取上游) | abort(中止生成)
+STREAM_BUFFER_OVERFLOW_POLICY = get_config('STREAM_BUFFER_OVERFLOW_POLICY', 'coalesce')
+# SSE 心跳间隔（秒，0 表示不发送）：排队或等待上游时发送注释行，避免代理因空闲断开连接
+SSE_HEARTBEAT_INTERVAL = float(get_config('SSE_HEARTBEAT_INTERVAL', '15'))
+# 每个 worker 进程内同时进行的生成数上限（SSE 与 WebSocket 共用，0 表示不限制），超出时按到达顺序排队并推送排队位置；
+# 只在一个进程同时处理多个请求（gthread 或 ASGI worker）时起作用，同步 worker 一次只处理一个请求
+SSE_MAX_GENERATIONS = int(get_config('SSE_MAX_GENERATIONS', '0'))
+# 最长排队时间（秒），超时返回可重试的错误
+SSE_QUEUE_TIMEOUT = float(get_config('SSE_QUEUE_TIMEOUT', '60'))
+
+# WebSocket 生成接口（仅 ASGI 部署可用，路径 /api/ws）：一个连接可同时进行多个生成、随时取消
+WEBSOCKET_ENABLED = get_config('WEBSOCKET_ENABLED', 'False').lower() == 'true'
+# 每个连接同时进行的生成数上限
+WEBSOCKET_MAX_GENERATIONS = int(get_config('WEBSOCKET_MAX_GENERATIONS', '4'))
+# 进度事件的推送间隔（秒，0 表示不推送）
+WEBSOCKET_PROGRESS_INTERVAL = float(get_config('WEBSOCKET_PROGRESS_INTERVAL', '1.0'))
+# 单条客户端消息的最大字节数
+WEBSOCKET_MAX_MESSAGE_BYTES = int(get_config('WEBSOCKET_MAX_MESSAGE_BYTES', '65536'))
+
+# ==================== 文章存储配置 ====================
+
+# 生成完成后是否保存文章（用于分享链接）
+ARTICLE_STORE_ENABLED = get_config('ARTICLE_STORE_ENABLED', 'True').lower() == 'true'
+# 文章缓存时间（秒）
+ARTICLE_CACHE_TIMEOUT = int(get_config('ARTICLE_CACHE_TIMEOUT', '3600'))
+
+# ==================== 图片渲染配置 ====================
+
+# 每个 Web worker 的渲染进程数（0 表示 CPU 核数 / WEB_CONCURRENCY）
+RASTER_WORKERS = int(get_config('RASTER_WORKERS', '0'))
+# 同一主机上的 Web worker 进程数（gunicorn 也读取该变量作为默认 worker 数），用于平分渲染进程
+WEB_CONCURRENCY = int(get_config('WEB_CONCURRENCY', '1'))
+# 图片宽度（像素）
+RASTER_WIDTH = int(get_config('RASTER_WIDTH', '750'))
+# 字体路径（留空时依次查找 contentgenerater/fonts/ 和系统 CJK 字体）
+RASTER_FONT_PATH = get_config('RASTER_FONT_PATH', '')
+RASTER_BOLD_FONT_PATH = get_config('RASTER_BOLD_FONT_PATH', '')
+# 单张图片渲染超时（秒）与缓存时间（秒）
+RASTER_TIMEOUT = float(get_config('RASTER_TIMEOUT', '30'))
+RASTER_CACHE_TIMEOUT = int(get_config('RASTER_CACHE_TIMEOUT', '86400'))
+
+# ==================== 内容优化配置 ====================
+
+# 单个分块的最大字符数（按段落/标题边界切分）
+OPTIMIZE_CHUNK_SIZE = int(get_config('OPTIMIZE_CHUNK_SIZE', '1500'))
+# 同时进行优化的分块数量上限
+OPTIMIZE_CONCURRENCY = int(get_config('OPTIMIZE_CONCURRENCY', '4'))
+# 分块结果缓存的最大条目数
+OPTIMIZE_CACHE_SIZE = int(get_config('OPTIMIZE_CACHE_SIZE', '512'))
+
+# ==================== 请求追踪配置 ====================
+
+# span 导出方式: none(不导出) | file(本地 JSONL 文件) | otlp(OTLP/HTTP JSON 接口)
+TRACE_EXPORTER = get_config('TRACE_EXPORTER', 'none').lower()
+# 请求采样比例（0~1，在根 span 决定，子 span 继承）
+TRACE_SAMPLE_RATE = float(get_config('TRACE_SAMPLE_RATE', '0.1'))
+TRACE_FILE = get_config('TRACE_FILE', 'logs/traces.jsonl')
+TRACE_OTLP_ENDPOINT = get_config('TRACE_OTLP_ENDPOINT', 'http://localhost:4318/v1/traces')
+TRACE_SERVICE_NAME = get_config('TRACE_SERVICE_NAME', 'textpix')
+
+# ==================== 性能剖析配置 ====================
+
+# 按比例剖析请求（0 表示关闭采样）
+PROFILE_SAMPLE_RATE = float(get_config('PROFILE_SAMPLE_RATE', '0'))
+# 请求带有 X-Profile-Token: <该值> 时剖析该请求（留空表示不允许按请求头开启）
+PROFILE_TOKEN = get_config('PROFILE_TOKEN', '')
+# 剖析结果目录与最多保留份数
+PROFILE_DIR = get_config('PROFILE_DIR', 'logs/profiles')
+PROFILE_MAX_FILES = int(get_config('PROFILE_MAX_FILES', '200'))
 
 # ==================== 日志配置 ====================
 
 LOG_LEVEL = get_config('LOG_LEVEL', 'INFO')
+# 日志中最多输出的请求/模型内容字符数
+LOG_PAYLOAD_CHARS = int(get_config('LOG_PAYLOAD_CHARS', '200'))
 LOG_FILE = get_config('LOG_FILE', 'logs/contentgenerater.log')
@@ -0,0 +1,82 @@
+"""
+上游请求的时间预算
+连接、首个 token、token 之间的最大间隔、总时长分别限制，任一超出立即中止，
+避免停滞的上游流长时间占住 worker
+"""
+import asyncio
+import time
+from typing import Awaitable, Optional, Tuple
+
+from .metrics import metrics
+
+_MESSAGES = {
+    'connect': "连接上游超时（{limit}s）",
+    'first_token': "等待模型首个输出超时（{limit}s）",
+    'stall': "模型输出停滞，超过 {limit}s 未收到新内容",
+    'total': "生成超过总时长限制（{limit}s）",
+}
+
+
+class DeadlineExceeded(Exception):
+    """超出时间预算；phase: connect | first_token | stall | total"""
+
+    code = 'deadline_exceeded'
+    retryable = True
+
+    def __init__(self, phase: str, limit: float):
+        super().__init__(_MESSAGES[phase].format(limit=f"{limit:g}"))
+        self.phase = phase
+        self.limit = limit
+        metrics.inc('deadline_exceeded_total', phase=phase)
+
+
+class StreamDeadline:
+    """
+    一次生成请求的时间预算（重试共享总时长，首 token 计时按每次尝试重新开始）
+
+    各限制为 0 或 None 时不生效
+    """
+
+    def __init__(self, total: float = None, first_token: float = None, stall: float = None):
+        from . import config
+
+        self.total = config.GENERATION_TIMEOUT if total is None else total
+        self.first_token = config.AI_FIRST_TOKEN_TIMEOUT if first_token is None else first_token
+        self.stall = config.AI_STALL_TIMEOUT if stall is None else stall
+        self.started = time.monotonic()
+        self.attempt_started = self.started
+        self.last_token = None
+
+    def begin_attempt(self):
+        self.attempt_started = time.monotonic()
+        self.last_token = None
+
+    def mark_token(self):
+        self.last_token = time.monotonic()
+
+    def remaining(self) -> Tuple[Optional[float], str, float]:
+        """返回 (剩余秒数, 最先到期的限制, 该限制的秒数)；没有限制时剩余秒数为 None"""
+        now = time.monotonic()
+        candidates = []
+        if self.total:
+            candidates.append((self.started + self.total - now, 'total', self.total))
+        if self.last_token is None:
+            if self.first_token:
+                candidates.append((self.attempt_started + self.first_token - now, 'first_token', self.first_token))
+        elif self.stall:
+            candidates.append((self.last_token + self.stall - now, 'stall', self.stall))
+        if not candidates:
+            return None, '', 0
+        return min(candidates)
+
+    async def wait(self, awaitable: Awaitable):
+        """在剩余预算内等待，超时抛出 DeadlineExceeded"""
+        timeout, phase, limit = self.remaining()
+        if timeout is not None and timeout <= 0:
+            if asyncio.iscoroutine(awaitable):
+                awaitable.close()
+            raise DeadlineExceeded(phase, limit)
+        try:
+            return await asyncio.wait_for(awaitable, timeout)
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(phase, limit) from None
@@ -0,0 +1,89 @@
+"""
+后台事件循环
+所有上游请求都在同一个常驻事件循环线程中执行，
+使 httpx 连接池可以跨请求复用（同步视图通过线程安全的方式提交协程）
+"""
+import asyncio
+import atexit
+import logging
+import os
+import threading
+from typing import AsyncGenerator, Iterator
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundLoop:
+    """在独立守护线程中运行的事件循环"""
+
+    def __init__(self, name: str = 'contentgenerater-loop'):
+        self.name = name
+        self._loop = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def get_loop(self) -> asyncio.AbstractEventLoop:
+        """获取事件循环（首次调用或 fork 之后自动启动）"""
+        # gunicorn --preload 等场景下 fork 后线程不会被继承，需要重新创建
+        if self._loop is not None and self._pid == os.getpid():
+            return self._loop
+
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+
+                def run():
+                    asyncio.set_event_loop(loop)
+                    loop.call_soon(ready.set)
+                    loop.run_forever()
+
+                thread = threading.Thread(target=run, name=self.name, daemon=True)
+                thread.start()
+                ready.wait()
+
+                self._loop = loop
+                self._thread = thread
+                self._pid = os.getpid()
+                logger.info(f"后台事件循环已启动: pid={self._pid}")
+        return self._loop
+
+    @property
+    def running(self) -> bool:
+        return self._loop is not None and self._pid == os.getpid() and self._loop.is_running()
+
+    def submit(self, coro):
+        """提交协程到后台循环，返回 concurrent.futures.Future（contextvars 随调用方复制）"""
+        return asyncio.run_coroutine_threadsafe(coro, self.get_loop())
+
+    def run(self, coro, timeout: float = None):
+        """在后台循环中执行协程并阻塞等待结果"""
+        return self.submit(coro).result(timeout)
+
+    def iterate(self, async_gen: AsyncGenerator) -> Iterator:
+        """将异步生成器转换为同步迭代器，供同步视图逐块 yield"""
+        try:
+            while True:
+                try:
+                    yield self.run(async_gen.__anext__())
+                except StopAsyncIteration:
+                    break
+        finally:
+            # 客户端断开时关闭异步生成器，释放上游连接
+            try:
+                self.run(async_gen.aclose(), timeout=5)
+            except Exception as e:
+                logger.warning(f"关闭异步生成器失败: {e}")
+
+    def stop(self):
+        """停止后台循环"""
+        if self.running:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+
+
+# 全局后台事件循环
+background_loop = BackgroundLoop()
+
+atexit.register(background_loop.stop)
@@ -0,0 +1,247 @@
+"""
+容错 JSON 修复
+模型输出不是严格 JSON 时（多余逗号、max_tokens 截断、前后夹带说明文字、字符串中的原始换行/未转义引号），
+尽量恢复出最长的有效前缀并补全未闭合的结构，而不是整体放弃
+"""
+import json
+from typing import Any, List, Optional, Tuple
+
+from .metrics import metrics
+
+_CONTROL_ESCAPES = {'\n': '\\n', '\r': '\\r', '\t': '\\t', '\b': '\\b', '\f': '\\f'}
+_CLOSERS = {'{': '}', '[': ']'}
+
+
+class JSONRepairError(ValueError):
+    """无法从文本中恢复出 JSON"""
+
+
+def strip_fences(text: str) -> str:
+    """去掉首尾的 markdown 代码块标记"""
+    text = text.strip()
+    if text.startswith('```json'):
+        text = text[7:]
+    elif text.startswith('```'):
+        text = text[3:]
+    if text.endswith('```'):
+        text = text[:-3]
+    return text.strip()
+
+
+def json_starts(text: str, limit: int = 16) -> List[int]:
+    """
+    可能的 JSON 起点：说明文字中也可能出现括号（如“下面是文章 [草稿]：{...}”），
+    因此依次给出每个 { / [ 的位置（最多 limit 个），由调用方逐个尝试
+    """
+    starts = [i for i, ch in enumerate(text) if ch in '{[']
+    if not starts:
+        raise JSONRepairError("文本中没有 JSON 对象")
+    return starts[:limit]
+
+
+class _Repairer:
+    """
+    单遍扫描：转义字符串中的控制字符和可疑引号、删除多余逗号、丢弃顶层值之后的文本，
+    同时记录每个完整值之后的截断点（输出长度 + 当时的容器栈），用于从截断处回退
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.out = []
+        self.stack = []          # 容器栈：'{' / '['
+        self.expect = []         # 对应容器的期望：key / colon / value / comma
+        self.cuts = []           # [(输出长度, 容器栈)]
+        self.in_string = False
+        self.string_is_key = False
+        self.last_comma = None   # 最近一个逗号在 out 中的位置（用于删除多余逗号）
+        self.primitive = False   # 正在读取数字 / true / false / null
+        self.done = False
+        self.end = 0             # 扫描停止的位置（完整读取顶层值时即其结束位置）
+
+    def _cut(self):
+        self.cuts.append((len(self.out), tuple(self.stack)))
+
+    def _value_done(self):
+        if self.expect:
+            self.expect[-1] = 'comma'
+            self._cut()
+        else:
+            self.done = True
+
+    def _next_significant(self, index: int) -> str:
+        while index < len(self.text) and self.text[index] in ' \t\r\n':
+            index += 1
+        return self.text[index] if index < len(self.text) else ''
+
+    def run(self):
+        text = self.text
+        i = 0
+        while i < len(text) and not self.done:
+            ch = text[i]
+
+            if self.in_string:
+                if ch == '\\' and i + 1 < len(text):
+                    self.out.append(text[i:i + 2])
+                    i += 2
+                    continue
+                if ch == '"':
+                    # 字符串中未转义的引号：后面不是结构字符时视为普通字符
+                    follow = self._next_significant(i + 1)
+                    expected = ':' if self.string_is_key else ',}]'
+                    if follow and follow not in expected:
+                        self.out.append('\\"')
+                        i += 1
+                        continue
+                    self.out.append('"')
+                    self.in_string = False
+                    if self.string_is_key:
+                        self.expect[-1] = 'colon'
+                    else:
+                        self._value_done()
+                elif ch in _CONTROL_ESCAPES or ord(ch) < 0x20:
+                    self.out.append(_CONTROL_ESCAPES.get(ch, '\\u%04x' % ord(ch)))
+                else:
+                    self.out.append(ch)
+                i += 1
+                continue
+
+            if self.primitive and (ch in ',}] \t\r\n'):
+                self.primitive = False
+                self._value_done()
+                if self.done:
+                    break
+
+            if ch in '{[':
+                self.out.append(ch)
+                self.stack.append(ch)
+                self.expect.append('key' if ch == '{' else 'value')
+                self.last_comma = None
+                self._cut()
+            elif ch in '}]':
+                if not self.stack or _CLOSERS[self.stack[-1]] != ch:
+                    # 不匹配的闭合符号：丢弃
+                    i += 1
+                    continue
+                if self.last_comma is not None:
+                    # 多余的逗号
+                    del self.out[self.last_comma]
+                    self.last_comma = None
+                self.out.append(ch)
+                self.stack.pop()
+                self.expect.pop()
+                self._value_done()
+            elif ch == '"':
+                self.in_string = True
+                self.string_is_key = bool(self.expect) and self.expect[-1] == 'key'
+                self.out.append(ch)
+                self.last_comma = None
+            elif ch == ':':
+                self.out.append(ch)
+                if self.expect:
+                    self.expect[-1] = 'value'
+            elif ch == ',':
+                self.last_comma = len(self.out)
+                self.out.append(ch)
+                if self.expect:
+                    self.expect[-1] = 'key' if self.stack[-1] == '{' else 'value'
+            elif ch in ' \t\r\n':
+                self.out.append(ch)
+            else:
+                if not self.primitive:
+                    self.primitive = True
+                    self.last_comma = None
+                self.out.append(ch)
+            i += 1
+        self.end = i
+
+    def candidates(self) -> List[str]:
+        """按从长到短的顺序给出补全后的候选文本"""
+        candidates = []
+        body = ''.join(self.out)
+        if self.done:
+            return [body]
+
+        # 1. 直接在末尾补全（截断在字符串中时先闭合字符串）
+        tail = body
+        if self.in_string:
+            if tail.endswith('\\'):
+                tail = tail[:-1]
+            tail += '"'
+            if self.string_is_key:
+                tail = None
+        if tail is not None:
+            candidates.append(_close(tail, self.stack))
+
+        # 2. 回退到之前的完整值之后
+        for length, stack in reversed(self.cuts):
+            candidates.append(_close(''.join(self.out[:length]), list(stack)))
+        return candidates
+
+
+def _close(body: str, stack) -> str:
+    body = body.rstrip()
+    if body.endswith(','):
+        body = body[:-1]
+    return body + ''.join(_CLOSERS[c] for c in reversed(stack))
+
+
+def repair_json(text: str) -> Tuple[Any, bool]:
+    """
+    从模型输出中恢复 JSON
+
+    Returns:
+        (解析结果, 是否经过修复)
+
+    Raises:
+        JSONRepairError: 无法恢复
+    """
+    text = strip_fences(text)
+    try:
+        return json.loads(text), False
+    except json.JSONDecodeError:
+        pass
+
+    # 起点之前的说明文字丢弃，顶层值之后的文本在扫描时丢弃；
+    # 解析出的数组之后还有对象时（如“[草稿]：{...}”），数组多半是说明文字中的括号，优先取后面的对象
+    fallback = None
+    for start in json_starts(text):
+        repairer = _Repairer(text[start:])
+        repairer.run()
+        for candidate in repairer.candidates():
+            try:
+                data = json.loads(candidate)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(data, list) and '{' in text[start + repairer.end:]:
+                if fallback is None:
+                    fallback = data
+                break
+            return data, True
+    if fallback is not None:
+        return fallback, True
+    raise JSONRepairError("无法修复 JSON")
+
+
+def parse_model_json(text: str) -> Any:
+    """
+    严格解析失败时尝试修复，并记录指标：
+    json_parse_total{result=strict|repaired|failed} 以及修复率 json_repair_rate（修复成功 / 总数）
+    """
+    result = 'failed'
+    try:
+        data, repaired = repair_json(text)
+        result = 'repaired' if repaired else 'strict'
+    finally:
+        metrics.inc('json_parse_total', result=result)
+        metrics.set_gauge('json_repair_rate', repair_rate())
+    return data
+
+
+def repair_rate() -> Optional[float]:
+    """经过修复才解析成功的比例（没有样本时返回 None）"""
+    counts = {
+        result: metrics.get_counter('json_parse_total', result=result)
+        for result in ('strict', 'repaired', 'failed')
+    }
+    total = sum(counts.values())
+    return round(counts['repaired'] / total, 4) if total else None
@@ -0,0 +1,175 @@
+"""
+非阻塞日志
+- QueuedStreamHandler: 调用方只把日志记录放入队列，由后台线程写控制台，
+  控制台 I/O 不再阻塞请求线程或事件循环；队列满时丢弃并计数
+- StructuredFormatter: 把 extra 传入的字段以 key=value 或 JSON 形式输出
+- SamplingFilter: 按比例采样每个请求 / 每个数据块级别的日志
+- RateLimitFilter: 同一位置的重复告警/错误日志限流
+
+注意：本模块在 settings.LOGGING 加载时导入，不能依赖 Django 应用
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+# LogRecord 自带的属性，其余属性视为 extra 结构化字段
+_RESERVED_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'sample'}
+
+
+class QueuedStreamHandler(logging.handlers.QueueHandler):
+    """
+    基于队列的后台日志处理器
+
+    后台线程在首次写日志时启动，并记录所在进程：gunicorn --preload 等场景下 fork 出的子进程
+    不会继承线程，子进程首次写日志时换用新队列并重新启动（与 event_loop.BackgroundLoop 相同）
+    """
+
+    def __init__(self, stream=None, queue_size: int = 10000):
+        super().__init__(queue.Queue(maxsize=queue_size))
+        self.target = logging.StreamHandler(stream or sys.stderr)
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+        self.listener = None
+        self._pid = None
+        self._closed = False
+        self._start_lock = threading.Lock()
+        atexit.register(self.close)
+
+    def _ensure_listener(self):
+        """当前进程还没有后台线程时启动（首次写日志或 fork 之后）"""
+        if self._pid == os.getpid() or self._closed:
+            return
+        with self._start_lock:
+            if self._pid == os.getpid() or self._closed:
+                return
+            if self._pid is not None:
+                # 从父进程继承的队列可能残留父进程的记录，或在 fork 时处于加锁状态
+                self.queue = queue.Queue(maxsize=self.queue.maxsize)
+            self.listener = logging.handlers.QueueListener(self.queue, self.target, respect_handler_level=False)
+            self.listener.start()
+            self._pid = os.getpid()
+
+    def setFormatter(self, fmt):
+        # 格式化在后台线程中完成
+        super().setFormatter(fmt)
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # 同进程内的线程队列不需要序列化，只固定消息内容，避免参数在格式化前被修改
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+
+    def close(self):
+        self._closed = True
+        listener, self.listener = self.listener, None
+        # fork 出的子进程中没有父进程的后台线程，不需要停止
+        if listener is not None and self._pid == os.getpid():
+            try:
+                listener.stop()
+            except Exception:
+                pass
+        super().close()
+
+
+class StructuredFormatter(logging.Formatter):
+    """在普通日志格式后追加结构化字段，或整体输出为 JSON"""
+
+    def __init__(self, fmt=None, datefmt=None, style='%', as_json: bool = False):
+        super().__init__(fmt, datefmt, style)
+        self.as_json = as_json
+
+    @staticmethod
+    def extra_fields(record) -> dict:
+        return {
+            key: value for key, value in record.__dict__.items()
+            if key not in _RESERVED_ATTRS and not key.startswith('_')
+        }
+
+    def format(self, record):
+        fields = self.extra_fields(record)
+        if self.as_json:
+            payload = {
+                'time': self.formatTime(record, self.datefmt),
+                'level': record.levelname,
+                'logger': record.name,
+                'message': record.getMessage(),
+                **fields,
+            }
+            if record.exc_info:
+                payload['exc_info'] = self.formatException(record.exc_info)
+            return json.dumps(payload, ensure_ascii=False, default=str)
+
+        line = super().format(record)
+        if fields:
+            line += ' ' + ' '.join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+class SamplingFilter(logging.Filter):
+    """
+    日志采样：通过 extra={'sample': 'request'} / {'sample': 'chunk'} 标记的记录按比例保留，
+    WARNING 及以上级别的记录总是保留
+    """
+
+    def __init__(self, request_rate: float = 1.0, chunk_rate: float = 0.0):
+        super().__init__()
+        self.rates = {'request': float(request_rate), 'chunk': float(chunk_rate)}
+
+    def filter(self, record):
+        category = getattr(record, 'sample', None)
+        if category is None or record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(category, 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    重复日志限流：同一代码位置、同一级别的 WARNING 及以上日志在 period 秒内最多输出 burst 条，
+    被抑制的条数在下一个窗口的第一条日志中注明
+    """
+
+    def __init__(self, burst: int = 5, period: float = 60.0):
+        super().__init__()
+        self.burst = int(burst)
+        self.period = float(period)
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING or self.burst <= 0:
+            return True
+
+        key = (record.name, record.levelno, record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            started, count, suppressed = self._windows.get(key, (now, 0, 0))
+            if now - started >= self.period:
+                started, count = now, 0
+
+            if count >= self.burst:
+                self._windows[key] = (started, count, suppressed + 1)
+                return False
+
+            self._windows[key] = (started, count + 1, 0)
+
+        if suppressed:
+            record.suppressed = suppressed
+        return True
@@ -0,0 +1,62 @@
+"""列出并汇总请求剖析结果"""
+import io
+import pstats
+
+from django.core.management.base import BaseCommand, CommandError
+
+from contentgenerater import config
+from contentgenerater.profiling import list_profiles
+
+
+class Command(BaseCommand):
+    help = '列出 PROFILE_DIR 中的请求剖析结果，或汇总其中一份（--show）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=None, help='剖析结果目录（默认 PROFILE_DIR）')
+        parser.add_argument('--limit', type=int, default=20, help='最多列出的条数 / 汇总时输出的函数数')
+        parser.add_argument('--show', metavar='NAME', help='汇总指定剖析结果（名称或请求 ID，latest 表示最新一份）')
+        parser.add_argument(
+            '--sort', default='cumulative', choices=['cumulative', 'tottime', 'ncalls'],
+            help='汇总时的排序方式'
+        )
+
+    def handle(self, *args, **options):
+        profiles = list_profiles(options['dir'] or config.PROFILE_DIR)
+        if options['show']:
+            self.show(profiles, options['show'], options['sort'], options['limit'])
+        else:
+            self.list(profiles, options['limit'])
+
+    def list(self, profiles, limit):
+        if not profiles:
+            self.stdout.write('没有剖析结果')
+            return
+
+        self.stdout.write(f"{'名称':<52} {'原因':<8} {'状态':<10} {'耗时(ms)':>10} {'同步/异步步数':>14}")
+        for meta in profiles[:limit]:
+            steps = f"{meta.get('sync_steps', 0)}/{meta.get('async_steps', 0)}"
+            self.stdout.write(
+                f"{meta['name']:<52} {meta.get('reason', ''):<8} {meta.get('status', ''):<10} "
+                f"{meta.get('wall_ms', 0):>10} {steps:>14}"
+            )
+        self.stdout.write(f"共 {len(profiles)} 份")
+
+    def show(self, profiles, name, sort, limit):
+        if name == 'latest':
+            matches = profiles[:1]
+        else:
+            matches = [m for m in profiles if m['name'] == name or m.get('request_id') == name]
+        if not matches:
+            raise CommandError(f"找不到剖析结果: {name}")
+
+        meta = matches[0]
+        for key in ('name', 'request_id', 'method', 'path', 'reason', 'status', 'started_at', 'wall_ms'):
+            self.stdout.write(f"{key}: {meta.get(key)}")
+        if not meta['stats_path']:
+            self.stdout.write('（没有 pstats 数据）')
+            return
+
+        buffer = io.StringIO()
+        stats = pstats.Stats(meta['stats_path'], stream=buffer)
+        stats.strip_dirs().sort_stats(sort).print_stats(limit)
+        self.stdout.write(buffer.getvalue())
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.10 on 2026-10-19 05:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Article',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_id', models.CharField(help_text='内容 ID（JSON 内容哈希）', max_length=32, unique=True)),
+                ('template_type', models.CharField(choices=[('normal', '普通文章'), ('wechat', '微信聊天')], default='normal', max_length=16)),
+                ('theme', models.CharField(blank=True, default='', max_length=200)),
+                ('data', models.JSONField(help_text='模型生成的最终 JSON')),
+                ('html', models.TextField(help_text='渲染好的 HTML（只渲染一次）')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -1,3 +1,23 @@
 from django.db import models
 
-# Create your models here.
+
+class Article(models.Model):
+    """生成的文章/聊天记录（按内容 ID 存储最终 JSON 和渲染好的 HTML）"""
+
+    TEMPLATE_CHOICES = [
+        ('normal', '普通文章'),
+        ('wechat', '微信聊天'),
+    ]
+
+    content_id = models.CharField(max_length=32, unique=True, help_text="内容 ID（JSON 内容哈希）")
+    template_type = models.CharField(max_length=16, choices=TEMPLATE_CHOICES, default='normal')
+    theme = models.CharField(max_length=200, blank=True, default='')
+    data = models.JSONField(help_text="模型生成的最终 JSON")
+    html = models.TextField(help_text="渲染好的 HTML（只渲染一次）")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.content_id} ({self.template_type})"
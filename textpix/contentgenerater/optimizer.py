@@ -0,0 +1,244 @@
+"""
+分块并行内容优化
+按段落/标题边界切分 Markdown（边界由内容决定），限流并发调用模型，按顺序流式返回，
+未修改的分块按内容哈希命中缓存
+"""
+import asyncio
+import hashlib
+import logging
+import re
+import threading
+from collections import OrderedDict
+from typing import AsyncGenerator, List, Optional, Tuple
+
+from . import config
+
+logger = logging.getLogger(__name__)
+
+# 分块之间的分隔符（重新组装时使用）
+CHUNK_SEPARATOR = "\n\n"
+
+_HEADING_RE = re.compile(r'^\s{0,3}#{1,6}\s')
+_FENCE_RE = re.compile(r'^\s{0,3}(```|~~~)')
+
+
+def _split_blocks(markdown: str) -> List[Tuple[str, bool]]:
+    """
+    将 Markdown 切分为块（段落/标题/代码块）
+
+    Returns:
+        (块文本, 是否为标题) 列表
+    """
+    blocks = []
+    current = []
+    in_fence = False
+
+    def flush():
+        if current:
+            blocks.append(("\n".join(current), bool(_HEADING_RE.match(current[0]))))
+            current.clear()
+
+    for line in markdown.replace('\r\n', '\n').split('\n'):
+        if _FENCE_RE.match(line):
+            in_fence = not in_fence
+            current.append(line)
+            continue
+
+        if in_fence:
+            current.append(line)
+            continue
+
+        if not line.strip():
+            flush()
+        elif _HEADING_RE.match(line):
+            flush()
+            current.append(line)
+            flush()
+        else:
+            current.append(line)
+
+    flush()
+    return blocks
+
+
+def _is_anchor(block: str, target: int) -> bool:
+    """
+    由块内容决定是否在该块之后切分：按内容哈希抽样，概率与块长度成正比，
+    平均每 target 个字符出现一次。是否切分只取决于块本身，与它在文档中的位置无关
+    """
+    digest = int(hashlib.sha1(block.encode('utf-8')).hexdigest()[:8], 16)
+    return digest < 0x100000000 * len(block) / max(1, target)
+
+
+def split_markdown(markdown: str, max_chars: int = None) -> List[str]:
+    """
+    按段落/标题边界将 Markdown 切分为若干分块
+
+    分块边界由内容决定（标题之前，以及按内容哈希选中的段落之后），
+    在文档前面插入或删除段落只影响附近的分块，其余分块不变、可以命中缓存；
+    分块超过 max_chars 时强制切分，单个段落超过 max_chars 时不会被拆开
+
+    Args:
+        markdown: 原始 Markdown
+        max_chars: 单个分块的最大字符数
+
+    Returns:
+        分块列表，用 CHUNK_SEPARATOR 连接即可还原文档
+    """
+    if max_chars is None:
+        max_chars = config.OPTIMIZE_CHUNK_SIZE
+    # 内容决定的边界平均间隔半个分块，强制切分很少发生
+    target = max(1, max_chars // 2)
+
+    chunks = []
+    current = []
+    current_len = 0
+
+    for block, is_heading in _split_blocks(markdown):
+        overflows = bool(current) and current_len + len(block) + len(CHUNK_SEPARATOR) > max_chars
+        if current and (is_heading or overflows):
+            chunks.append(CHUNK_SEPARATOR.join(current))
+            current = []
+            current_len = 0
+
+        current.append(block)
+        current_len += len(block) + len(CHUNK_SEPARATOR)
+        if not is_heading and _is_anchor(block, target):
+            chunks.append(CHUNK_SEPARATOR.join(current))
+            current = []
+            current_len = 0
+
+    if current:
+        chunks.append(CHUNK_SEPARATOR.join(current))
+
+    return chunks
+
+
+class ChunkCache:
+    """分块优化结果缓存（LRU，线程安全）"""
+
+    def __init__(self, max_size: int = 512):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(chunk: str, optimization_type: str, model: str = '') -> str:
+        """根据分块内容、优化类型和模型计算缓存键"""
+        raw = f"{model}\0{optimization_type}\0{chunk}".encode('utf-8')
+        return hashlib.sha256(raw).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+# 全局分块缓存
+chunk_cache = ChunkCache(max_size=config.OPTIMIZE_CACHE_SIZE)
+
+
+def _clean_output(text: str, original: str) -> str:
+    """去掉模型额外包裹的代码块标记和首尾空白（原文本身是代码块时保留）"""
+    text = text.strip()
+    if text.startswith('```') and not original.lstrip().startswith('```'):
+        first_newline = text.find('\n')
+        text = text[first_newline + 1:] if first_newline != -1 else ''
+        if text.rstrip().endswith('```'):
+            text = text.rstrip()[:-3]
+    return text.strip()
+
+
+async def _optimize_chunk(generator, chunk: str, optimization_type: str, semaphore: asyncio.Semaphore) -> str:
+    """优化单个分块（优先命中缓存）"""
+    key = ChunkCache.make_key(chunk, optimization_type, generator.model_name)
+    cached = chunk_cache.get(key)
+    if cached is not None:
+        return cached
+
+    async with semaphore:
+        parts = []
+        async for piece in generator.optimize_text_stream(chunk, optimization_type):
+            parts.append(piece)
+
+    optimized = _clean_output(''.join(parts), chunk)
+    if not optimized:
+        # 模型没有返回内容时保留原文，不写入缓存
+        logger.warning("分块优化结果为空，保留原文")
+        return chunk
+
+    chunk_cache.set(key, optimized)
+    logger.info(f"分块优化完成 - 原长度 {len(chunk)}, 新长度 {len(optimized)}", extra={'sample': 'chunk'})
+    return optimized
+
+
+async def optimize_markdown_stream(
+    generator,
+    markdown: str,
+    optimization_type: str = 'grammar',
+    concurrency: int = None,
+    max_chars: int = None
+) -> AsyncGenerator[Tuple[int, int, str], None]:
+    """
+    分块并行优化 Markdown，按原始顺序逐块返回
+
+    所有分块同时排队、最多 concurrency 个并发调用模型；
+    前面的分块一完成就立即返回，不必等待整篇文档
+
+    Args:
+        generator: AI 生成器实例
+        markdown: 原始 Markdown
+        optimization_type: 优化类型
+        concurrency: 最大并发数
+        max_chars: 单个分块的最大字符数
+
+    Yields:
+        (分块序号, 分块总数, 优化后的分块)
+    """
+    if concurrency is None:
+        concurrency = config.OPTIMIZE_CONCURRENCY
+
+    chunks = split_markdown(markdown, max_chars)
+    total = len(chunks)
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    logger.info(f"内容优化分块完成 - 共 {total} 块, 并发 {concurrency}", extra={'sample': 'request'})
+
+    tasks = [
+        asyncio.ensure_future(_optimize_chunk(generator, chunk, optimization_type, semaphore))
+        for chunk in chunks
+    ]
+
+    try:
+        for index, task in enumerate(tasks):
+            yield index, total, await task
+    finally:
+        # 客户端断开或出错时取消尚未完成的分块
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def optimize_markdown(generator, markdown: str, optimization_type: str = 'grammar') -> str:
+    """优化整篇 Markdown，返回重新组装后的文档"""
+    parts = []
+    async for _, _, optimized in optimize_markdown_stream(generator, markdown, optimization_type):
+        parts.append(optimized)
+    return CHUNK_SEPARATOR.join(parts)
@@ -0,0 +1,243 @@
+"""
+按请求的性能剖析（默认关闭）
+- 按比例采样请求（PROFILE_SAMPLE_RATE），或请求带有正确的 X-Profile-Token 头
+- 同步侧：SSE 事件流每次 next() 期间开启 cProfile
+- 异步侧：后台事件循环中只在本请求的协程步骤执行期间开启 cProfile，不会混入其他请求
+- 结束时合并两侧结果写入 PROFILE_DIR：<名称>.prof（pstats）+ <名称>.json（请求元数据）
+
+查看: python manage.py profiles [--show <名称>]
+"""
+import contextvars
+import hmac
+import json
+import logging
+import os
+import random
+import time
+from datetime import datetime, timezone
+from typing import AsyncGenerator, Dict, Iterator, List, Optional
+
+from . import config
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'X-Profile-Token'
+
+_current_profile = contextvars.ContextVar('textpix_current_profile', default=None)
+
+
+def profile_reason(request) -> Optional[str]:
+    """判断是否剖析该请求，返回原因（header / sampled），不剖析时返回 None"""
+    token = request.headers.get(PROFILE_HEADER)
+    if token and config.PROFILE_TOKEN and hmac.compare_digest(token, config.PROFILE_TOKEN):
+        return 'header'
+    rate = config.PROFILE_SAMPLE_RATE
+    if rate > 0 and (rate >= 1.0 or random.random() < rate):
+        return 'sampled'
+    return None
+
+
+class _Profiler:
+    """cProfile 包装：同一时刻已有剖析器时跳过本次（Python 3.12+ 只允许一个）"""
+
+    def __init__(self):
+        # 只有被剖析的请求才导入 cProfile / pstats
+        import cProfile
+
+        self.profile = cProfile.Profile()
+        self.steps = 0
+        self.skipped = 0
+
+    def enable(self) -> bool:
+        try:
+            self.profile.enable()
+        except ValueError:
+            self.skipped += 1
+            return False
+        self.steps += 1
+        return True
+
+    def disable(self):
+        self.profile.disable()
+
+
+class _ProfiledStep:
+    """逐步驱动协程，只在协程自身执行期间开启剖析"""
+
+    def __init__(self, coro, profiler: _Profiler):
+        self.coro = coro
+        self.profiler = profiler
+
+    def __await__(self):
+        value, error = None, None
+        while True:
+            enabled = self.profiler.enable()
+            try:
+                if error is not None:
+                    yielded = self.coro.throw(error)
+                else:
+                    yielded = self.coro.send(value)
+            except StopIteration as e:
+                return e.value
+            finally:
+                if enabled:
+                    self.profiler.disable()
+            try:
+                value, error = (yield yielded), None
+            except BaseException as e:
+                value, error = None, e
+
+
+class _ProfiledAsyncGenerator:
+    def __init__(self, async_gen: AsyncGenerator, profiler: _Profiler):
+        self.async_gen = async_gen
+        self.profiler = profiler
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        return _ProfiledStep(self.async_gen.__anext__(), self.profiler)
+
+    def aclose(self):
+        return _ProfiledStep(self.async_gen.aclose(), self.profiler)
+
+
+class RequestProfile:
+    """一次请求的剖析数据"""
+
+    def __init__(self, request_id: str, reason: str, metadata: Dict = None):
+        self.request_id = request_id
+        self.reason = reason
+        self.metadata = dict(metadata or {})
+        self.started_at = datetime.now(timezone.utc)
+        self._start = time.perf_counter()
+        self.sync = _Profiler()
+        self.async_ = _Profiler()
+        self.status = 'ok'
+
+    def wrap_iterator(self, iterator: Iterator) -> Iterator:
+        """剖析同步迭代器的每一步，迭代结束（或客户端断开）时保存结果"""
+        try:
+            while True:
+                token = _current_profile.set(self)
+                enabled = self.sync.enable()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    if enabled:
+                        self.sync.disable()
+                    _current_profile.reset(token)
+                yield item
+        except GeneratorExit:
+            self.status = 'cancelled'
+            raise
+        except BaseException:
+            self.status = 'error'
+            raise
+        finally:
+            if hasattr(iterator, 'close'):
+                iterator.close()
+            self.save()
+
+    def wrap_async(self, async_gen: AsyncGenerator) -> AsyncGenerator:
+        return _ProfiledAsyncGenerator(async_gen, self.async_)
+
+    def save(self) -> Optional[str]:
+        """合并同步/异步剖析结果并写入 PROFILE_DIR，返回文件名前缀"""
+        wall_ms = (time.perf_counter() - self._start) * 1000
+        try:
+            os.makedirs(config.PROFILE_DIR, exist_ok=True)
+            name = f"{self.started_at.strftime('%Y%m%dT%H%M%S')}-{self.request_id}"
+            base = os.path.join(config.PROFILE_DIR, name)
+
+            import pstats
+
+            stats = None
+            for profiler in (self.sync, self.async_):
+                if profiler.steps:
+                    if stats is None:
+                        stats = pstats.Stats(profiler.profile)
+                    else:
+                        stats.add(profiler.profile)
+            if stats is not None:
+                stats.dump_stats(base + '.prof')
+
+            meta = {
+                **self.metadata,
+                'request_id': self.request_id,
+                'reason': self.reason,
+                'status': self.status,
+                'started_at': self.started_at.isoformat(),
+                'wall_ms': round(wall_ms, 1),
+                'sync_steps': self.sync.steps,
+                'async_steps': self.async_.steps,
+                'skipped_steps': self.sync.skipped + self.async_.skipped,
+                'has_stats': stats is not None,
+            }
+            with open(base + '.json', 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False, indent=2)
+        except Exception as e:
+            logger.warning(f"保存剖析结果失败: {e}")
+            return None
+
+        metrics.inc('profiles_captured_total', reason=self.reason)
+        _prune(config.PROFILE_DIR, config.PROFILE_MAX_FILES)
+        logger.info(f"已保存请求剖析结果: {name}", extra={'wall_ms': meta['wall_ms']})
+        return name
+
+
+def start_profile(request, request_id: str, **metadata) -> Optional[RequestProfile]:
+    """按配置决定是否剖析该请求"""
+    reason = profile_reason(request)
+    if reason is None:
+        return None
+    return RequestProfile(request_id, reason, {'method': request.method, 'path': request.path, **metadata})
+
+
+def wrap_async(async_gen: AsyncGenerator) -> AsyncGenerator:
+    """当前请求正在剖析时，剖析异步生成器在后台事件循环中的每一步；否则原样返回"""
+    profile = _current_profile.get()
+    if profile is None:
+        return async_gen
+    return profile.wrap_async(async_gen)
+
+
+# ==================== 读取 ====================
+
+def list_profiles(directory: str = None) -> List[Dict]:
+    """按时间倒序列出已保存的剖析结果"""
+    directory = directory or config.PROFILE_DIR
+    if not os.path.isdir(directory):
+        return []
+
+    profiles = []
+    for filename in sorted(os.listdir(directory), reverse=True):
+        if not filename.endswith('.json'):
+            continue
+        name = filename[:-5]
+        try:
+            with open(os.path.join(directory, filename), encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            continue
+        meta['name'] = name
+        stats_path = os.path.join(directory, name + '.prof')
+        meta['stats_path'] = stats_path if os.path.exists(stats_path) else None
+        profiles.append(meta)
+    return profiles
+
+
+def _prune(directory: str, max_files: int):
+    """只保留最近 max_files 份剖析结果"""
+    if max_files <= 0:
+        return
+    for meta in list_profiles(directory)[max_files:]:
+        for suffix in ('.json', '.prof'):
+            try:
+                os.remove(os.path.join(directory, meta['name'] + suffix))
+            except OSError:
+                pass
@@ -0,0 +1,443 @@
+"""
+服务端 PNG 渲染
+使用 Pillow 将文章（normal）和聊天记录（wechat）渲染为图片，
+布局与 StreamingHTMLRenderer / WechatHTMLRenderer 的样式保持一致。
+
+渲染在独立的进程池中执行，Web 进程本身不加载 Pillow、不占用 CPU，
+结果按文档哈希缓存。每个 Web worker 进程各有一个进程池，默认按整机 CPU 核数平均分配；
+渲染超时时新请求改用新的进程池，旧进程池中其他请求的渲染完成后终止其全部进程，
+超时的渲染不会一直占用 CPU，也不会连累其他请求
+"""
+import glob
+import hashlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 设计稿宽度（CSS 像素），输出图片按 width / DESIGN_WIDTH 等比放大
+DESIGN_WIDTH = 375
+
+# 随项目/镜像提供的字体目录
+BUNDLED_FONT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fonts')
+
+# 常见的 CJK 系统字体位置（Dockerfile 中安装 fonts-noto-cjk）
+SYSTEM_FONT_CANDIDATES = [
+    '/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc',
+    '/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc',
+    '/usr/share/fonts/truetype/wqy/wqy-microhei.ttc',
+    '/System/Library/Fonts/PingFang.ttc',
+    'C:/Windows/Fonts/msyh.ttc',
+]
+
+
+def find_font(preferred: Optional[str] = None, bold: bool = False) -> Optional[str]:
+    """查找可用字体：配置路径 > 项目自带 fonts/ 目录 > 系统 CJK 字体"""
+    if preferred and os.path.exists(preferred):
+        return preferred
+
+    bundled = sorted(
+        path for pattern in ('*.ttf', '*.otf', '*.ttc')
+        for path in glob.glob(os.path.join(BUNDLED_FONT_DIR, pattern))
+    )
+    if bundled:
+        bold_fonts = [path for path in bundled if 'bold' in os.path.basename(path).lower()]
+        regular_fonts = [path for path in bundled if path not in bold_fonts]
+        if bold and bold_fonts:
+            return bold_fonts[0]
+        return (regular_fonts or bundled)[0]
+
+    for path in SYSTEM_FONT_CANDIDATES:
+        if bold:
+            bold_path = path.replace('Regular', 'Bold')
+            if bold_path != path and os.path.exists(bold_path):
+                return bold_path
+        if os.path.exists(path):
+            return path
+    return None
+
+
+@lru_cache(maxsize=64)
+def _load_font(path: Optional[str], size: int):
+    """加载字体（每个进程按路径和字号缓存）"""
+    from PIL import ImageFont
+
+    if path:
+        return ImageFont.truetype(path, size)
+    # 没有可用字体时退回 Pillow 内置字体（不含中文字形）
+    return ImageFont.load_default(size)
+
+
+def font_supports_cjk(path: Optional[str]) -> bool:
+    """字体是否包含中文字形：缺字时绘制的是 .notdef 方框，与私用区字符的绘制结果相同"""
+    from PIL import Image, ImageDraw
+
+    font = _load_font(path, 32)
+
+    def draw(char):
+        image = Image.new('L', (64, 64))
+        ImageDraw.Draw(image).text((8, 8), char, font=font, fill=255)
+        return image.tobytes()
+
+    return draw('中') != draw('\U000f0000')
+
+
+def check_fonts(font_path: Optional[str] = None) -> Optional[str]:
+    """在渲染进程中检查字体：返回将使用的常规字体路径，没有包含中文字形的字体时返回 None"""
+    path = find_font(font_path)
+    return path if path and font_supports_cjk(path) else None
+
+
+def _report_fonts(future):
+    """进程池启动时的字体检查结果：没有中文字体时告警，而不是静默输出方框"""
+    from .metrics import metrics
+
+    try:
+        path = future.result()
+    except Exception as e:
+        logger.warning(f"检查渲染字体失败: {e}")
+        return
+    metrics.set_gauge('raster_cjk_font', 1 if path else 0)
+    if path is None:
+        logger.warning("未找到包含中文字形的字体，图片中的中文将显示为方框："
+                       "请安装 fonts-noto-cjk、把字体放入 contentgenerater/fonts/ 或设置 RASTER_FONT_PATH")
+    else:
+        logger.info(f"PNG 渲染字体: {path}")
+
+
+def _hex(color: str):
+    color = color.lstrip('#')
+    return tuple(int(color[i:i + 2], 16) for i in (0, 2, 4))
+
+
+def _wrap(text: str, font, max_width: float) -> List[str]:
+    """按像素宽度折行：中文逐字折行，英文尽量在空格处折行"""
+    lines = []
+    for paragraph in str(text).split('\n'):
+        line = ''
+        for char in paragraph:
+            candidate = line + char
+            if line and font.getlength(candidate) > max_width:
+                space = line.rfind(' ')
+                if char.isascii() and char != ' ' and space > 0 and line[-1] != ' ':
+                    lines.append(line[:space])
+                    line = line[space + 1:] + char
+                else:
+                    lines.append(line)
+                    line = '' if char == ' ' else char
+            else:
+                line = candidate
+        lines.append(line)
+    return lines
+
+
+class _Canvas:
+    """两遍渲染：先只计算高度（draw 为 None），再按高度创建图片真正绘制"""
+
+    def __init__(self, width: int, fonts: Dict[str, Optional[str]], draw=None):
+        self.width = width
+        self.scale = width / DESIGN_WIDTH
+        self.fonts = fonts
+        self.draw = draw
+
+    def px(self, value: float) -> int:
+        return int(round(value * self.scale))
+
+    def font(self, size: float, bold: bool = False):
+        return _load_font(self.fonts['bold' if bold else 'regular'], self.px(size))
+
+    def text_block(self, text: str, x: int, y: int, max_width: int, size: float,
+                   color: str, bold: bool = False, line_height: float = 1.6, align: str = 'left') -> int:
+        """绘制自动折行的文本，返回文本块高度"""
+        font = self.font(size, bold)
+        step = self.px(size * line_height)
+        lines = _wrap(text, font, max_width)
+        if self.draw is not None:
+            offset = (step - self.px(size)) // 2
+            for i, line in enumerate(lines):
+                line_x = x
+                if align == 'center':
+                    line_x = x + (max_width - font.getlength(line)) / 2
+                elif align == 'right':
+                    line_x = x + max_width - font.getlength(line)
+                self.draw.text((line_x, y + i * step + offset), line, font=font, fill=_hex(color))
+        return step * len(lines)
+
+
+def _layout_normal(canvas: _Canvas, data: Dict) -> int:
+    """普通文章布局（对应 StreamingHTMLRenderer 的样式）"""
+    padding = canvas.px(20)
+    content_width = canvas.width - padding * 2
+    y = canvas.px(10) + padding
+
+    if data.get('title'):
+        y += canvas.text_block(data['title'], padding, y, content_width, 22, '#000000', bold=True, line_height=1.4)
+        y += canvas.px(15)
+
+    if data.get('intro'):
+        y += canvas.text_block(data['intro'], padding, y, content_width, 15, '#555555')
+        y += canvas.px(30)
+
+    sections = data.get('sections') or []
+    for index, section in enumerate(sections if isinstance(sections, list) else []):
+        if not isinstance(section, dict):
+            continue
+        title = f"{str(index + 1).zfill(2)} {section.get('title', '')}"
+        y += canvas.text_block(title, padding, y, content_width, 16, '#333333', bold=True)
+        y += canvas.px(10)
+        for item in section.get('items') or []:
+            y += canvas.text_block(f"- {item}", padding, y, content_width, 15, '#555555')
+            y += canvas.px(5)
+        y += canvas.px(25)
+
+    if data.get('footer'):
+        y += canvas.px(15)
+        y += canvas.text_block(data['footer'], padding, y, content_width, 15, '#555555')
+
+    return y + canvas.px(20) + padding
+
+
+def _layout_wechat(canvas: _Canvas, data: Dict) -> int:
+    """微信聊天布局（对应 WechatHTMLRenderer 的样式）"""
+    from .streaming_renderer import WechatHTMLRenderer
+
+    colors = WechatHTMLRenderer()
+    draw = canvas.draw
+    width = canvas.width
+    header_height = canvas.px(50)
+
+    if draw is not None:
+        draw.rectangle((0, 0, width, header_height), fill=_hex('#ededed'))
+        draw.line((0, header_height, width, header_height), fill=_hex('#d9d9d9'), width=max(1, canvas.px(0.5)))
+    chat_header = data.get('chat_header') or data.get('chatHeader') or '聊天'
+    canvas.text_block(chat_header, 0, canvas.px(13), width, 16, '#000000', line_height=1.5, align='center')
+
+    padding = canvas.px(15)
+    avatar = canvas.px(45)
+    gap = canvas.px(10)
+    bubble_max = int((width - padding * 2) * 0.7)
+    y = header_height + canvas.px(20)
+
+    messages = data.get('messages') or []
+    for message in messages if isinstance(messages, list) else []:
+        if not isinstance(message, dict):
+            continue
+
+        if message.get('type') == 'time':
+            y += canvas.px(15)
+            y += canvas.text_block(message.get('time', ''), 0, y, width, 12, '#999999', line_height=1.4, align='center')
+            y += canvas.px(15)
+            continue
+
+        right = message.get('align') == 'right'
+        nickname = message.get('nickname') or message.get('sender') or ''
+        text = message.get('text') or message.get('content') or ''
+        avatar_x = width - padding - avatar if right else padding
+
+        if draw is not None:
+            draw.rounded_rectangle(
+                (avatar_x, y, avatar_x + avatar, y + avatar),
+                radius=canvas.px(5), fill=_hex(colors.avatar_color(nickname))
+            )
+            canvas.text_block(nickname[:1] or '?', avatar_x, y + canvas.px(11), avatar, 18, '#ffffff',
+                              line_height=1.3, align='center')
+
+        content_x = avatar_x - gap - bubble_max if right else avatar_x + avatar + gap
+        block_y = y
+        if message.get('showNickname') is not False:
+            block_y += canvas.text_block(nickname, content_x, block_y, bubble_max, 13, '#999999',
+                                         line_height=1.3, align='right' if right else 'left')
+            block_y += canvas.px(5)
+
+        font = canvas.font(16)
+        pad_x, pad_y = canvas.px(15), canvas.px(10)
+        lines = _wrap(text, font, bubble_max - pad_x * 2)
+        text_width = max([font.getlength(line) for line in lines] + [0])
+        bubble_width = int(text_width) + pad_x * 2
+        bubble_height = canvas.px(16 * 1.5) * len(lines) + pad_y * 2
+        bubble_x = avatar_x - gap - bubble_width if right else content_x
+
+        if draw is not None:
+            draw.rounded_rectangle(
+                (bubble_x, block_y, bubble_x + bubble_width, block_y + bubble_height),
+                radius=canvas.px(8), fill=_hex('#95ec69' if right else '#ffffff')
+            )
+        canvas.text_block(text, bubble_x + pad_x, block_y + pad_y, bubble_max - pad_x * 2, 16, '#000000',
+                          line_height=1.5)
+
+        y = max(y + avatar, block_y + bubble_height) + canvas.px(20)
+
+    return y + canvas.px(20)
+
+
+def render_png(data: Dict, template_type: str = 'normal', width: int = 750,
+               font_path: Optional[str] = None, bold_font_path: Optional[str] = None) -> bytes:
+    """
+    将生成的 JSON 渲染为 PNG（纯函数，可在进程池中执行）
+
+    Args:
+        data: 模型生成的 JSON
+        template_type: 模板类型 (normal/wechat)
+        width: 图片宽度（像素）
+        font_path: 常规字体路径
+        bold_font_path: 粗体字体路径
+
+    Returns:
+        PNG 字节
+    """
+    from PIL import Image, ImageDraw
+
+    regular = find_font(font_path)
+    fonts = {'regular': regular, 'bold': find_font(bold_font_path, bold=True) or regular}
+    layout = _layout_wechat if template_type == 'wechat' else _layout_normal
+    background = '#f5f5f5' if template_type == 'wechat' else '#ffffff'
+
+    # 第一遍只计算高度
+    height = layout(_Canvas(width, fonts), data)
+
+    image = Image.new('RGB', (width, max(height, 1)), _hex(background))
+    layout(_Canvas(width, fonts, ImageDraw.Draw(image)), data)
+
+    output = io.BytesIO()
+    image.save(output, format='PNG', optimize=False)
+    return output.getvalue()
+
+
+# ==================== 进程池与缓存 ====================
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def default_workers() -> int:
+    """
+    每个 Web worker 的渲染进程数：整机 CPU 核数平均分给同一主机上的 WEB_CONCURRENCY 个 Web worker，
+    避免每个 Web worker 都按核数启动进程池、渲染进程总数成倍超出核数
+    """
+    from . import config
+
+    if config.RASTER_WORKERS:
+        return config.RASTER_WORKERS
+    return max(1, (os.cpu_count() or 1) // max(1, config.WEB_CONCURRENCY))
+
+
+class RenderPool:
+    """
+    渲染进程池：记录进行中的任务，以便在渲染超时后安全地终止进程
+
+    已在执行的渲染无法单独中断。超时后进程池被停用（retire）：不再接收新任务，
+    其他请求进行中的渲染照常完成，之后终止全部进程（连同超时的渲染）
+    """
+
+    def __init__(self, workers: int):
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        self._pending = set()
+        self._abandoned = set()
+        self._retired = False
+        self._terminated = False
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args):
+        future = self.executor.submit(fn, *args)
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self._lock:
+            self._pending.discard(future)
+            self._abandoned.discard(future)
+        self._terminate_if_idle()
+
+    def retire(self, abandoned):
+        """停用进程池；abandoned 为已超时、不再等待结果的任务"""
+        with self._lock:
+            self._retired = True
+            self._abandoned.add(abandoned)
+        self._terminate_if_idle()
+
+    def _terminate_if_idle(self):
+        with self._lock:
+            if not self._retired or self._terminated or not self._pending <= self._abandoned:
+                return
+            self._terminated = True
+            stuck = len(self._abandoned)
+        # 先取出进程：shutdown 之后进程表会被清空
+        processes = list((getattr(self.executor, '_processes', None) or {}).values())
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        logger.warning(f"已终止停用的渲染进程池: {len(processes)} 个进程，其中 {stuck} 个渲染超时")
+
+    def shutdown(self, **kwargs):
+        self.executor.shutdown(**kwargs)
+
+
+def get_executor() -> RenderPool:
+    """获取渲染进程池（懒加载；使用 spawn，避免 fork 继承后台事件循环线程）"""
+    global _executor
+
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                from . import config
+
+                workers = default_workers()
+                _executor = RenderPool(workers)
+                logger.info(f"PNG 渲染进程池已启动: workers={workers}")
+                _executor.submit(check_fonts, config.RASTER_FONT_PATH or None).add_done_callback(_report_fonts)
+    return _executor
+
+
+def _retire(pool: RenderPool, future):
+    """渲染超时：之后的请求使用新的进程池，旧进程池在其他渲染完成后终止"""
+    global _executor
+
+    with _executor_lock:
+        if _executor is pool:
+            _executor = None
+    logger.warning("PNG 渲染超时，停用当前渲染进程池，其余渲染完成后终止")
+    pool.retire(future)
+
+
+def make_image_key(data: Dict, template_type: str, width: int) -> str:
+    """按文档内容、模板和宽度计算图片缓存键"""
+    canonical = json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    raw = f"{template_type}\0{width}\0{canonical}".encode('utf-8')
+    return 'png:' + hashlib.sha256(raw).hexdigest()
+
+
+def get_png(data: Dict, template_type: str = 'normal', width: int = None) -> bytes:
+    """获取文档 PNG（先查缓存，未命中时提交到进程池渲染）"""
+    from django.core.cache import cache
+    from . import config
+
+    width = width or config.RASTER_WIDTH
+    key = make_image_key(data, template_type, width)
+    png = cache.get(key)
+    if png is not None:
+        return png
+
+    pool = get_executor()
+    future = pool.submit(
+        render_png, data, template_type, width,
+        config.RASTER_FONT_PATH or None, config.RASTER_BOLD_FONT_PATH or None
+    )
+    try:
+        png = future.result(timeout=config.RASTER_TIMEOUT)
+    except FutureTimeoutError:
+        # 尚未开始的渲染直接取消；已在执行的无法中断，只能停用进程池后终止渲染进程
+        if not future.cancel():
+            _retire(pool, future)
+        raise TimeoutError(f"图片渲染超时（{config.RASTER_TIMEOUT} 秒）") from None
+    cache.set(key, png, config.RASTER_CACHE_TIMEOUT)
+    return png
@@ -0,0 +1,177 @@
+"""
+上游流式响应的录制与回放
+录制：设置 AI_RECORD_DIR 后，每次上游流式请求的状态码和逐行 SSE 输出（连同相对请求开始的时间）写入 JSON 文件；
+回放：设置 AI_REPLAY_DIR 后，上游请求改由 ReplayTransport 从录制文件返回，按原始节奏或加速（AI_REPLAY_SPEED）输出，
+不需要真实的上游即可运行回归测试和性能测试
+
+录制文件格式:
+    {
+        "version": 1,
+        "key": "按 model / messages / n 计算的请求指纹",
+        "request": {"model": "...", "messages": [...], "temperature": 0.7, "max_tokens": 2000},
+        "status": 200,
+        "headers_at": 0.21,                          # 收到响应头的时间（秒）
+        "events": [[0.35, "data: {...}"], [0.38, ""], ...],   # 每一行及其到达时间（秒）
+        "complete": true                             # 是否读到了流的结尾
+    }
+"""
+import asyncio
+import glob
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Dict, List
+
+import httpx
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+
+
+class ReplayMiss(LookupError):
+    """严格模式下没有与请求匹配的录制"""
+
+
+def fixture_key(payload: Dict) -> str:
+    """请求指纹：只看模型、消息和 choice 数，温度和 max_tokens 变化时仍能匹配"""
+    basis = json.dumps(
+        {'model': payload.get('model'), 'messages': payload.get('messages'), 'n': payload.get('n', 1)},
+        ensure_ascii=False, sort_keys=True
+    )
+    return hashlib.sha256(basis.encode('utf-8')).hexdigest()[:16]
+
+
+class Recording:
+    """一次上游流式请求的录制（在后台事件循环中使用）"""
+
+    def __init__(self, directory: str, payload: Dict):
+        self.directory = directory
+        self.key = fixture_key(payload)
+        self.request = {k: payload[k] for k in ('model', 'messages', 'temperature', 'max_tokens', 'n') if k in payload}
+        self.started = time.monotonic()
+        self.status = None
+        self.headers_at = None
+        self.events = []
+        self.complete = False
+
+    def _elapsed(self) -> float:
+        return round(time.monotonic() - self.started, 4)
+
+    def response(self, status: int):
+        self.status = status
+        self.headers_at = self._elapsed()
+
+    def add(self, line: str):
+        self.events.append([self._elapsed(), line])
+
+    def save(self) -> str:
+        """写入 <目录>/<请求指纹>.json（同一请求再次录制时覆盖），没有收到响应时不写入"""
+        if self.status is None:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{self.key}.json")
+        data = {
+            'version': FORMAT_VERSION,
+            'key': self.key,
+            'recorded_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'request': self.request,
+            'status': self.status,
+            'headers_at': self.headers_at,
+            'complete': self.complete,
+        }
+        # 每行一个事件，便于查看和比较录制文件
+        head = json.dumps(data, ensure_ascii=False, indent=1)[:-2]
+        events = ',\n'.join(f"  {json.dumps(event, ensure_ascii=False)}" for event in self.events)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(f'{head},\n "events": [\n{events}\n ]\n}}\n')
+        metrics.inc('upstream_recordings_total', status=self.status)
+        logger.info(f"已录制上游响应: {path}", extra={'events': len(self.events)})
+        return path
+
+
+def load_fixtures(path: str) -> List[Dict]:
+    """读取单个录制文件或目录下的全部录制（按录制时间排序）"""
+    paths = sorted(glob.glob(os.path.join(path, '*.json'))) if os.path.isdir(path) else [path]
+    fixtures = []
+    for fixture_path in paths:
+        with open(fixture_path, encoding='utf-8') as f:
+            fixture = json.load(f)
+        if fixture.get('version') != FORMAT_VERSION:
+            raise ValueError(f"不支持的录制文件版本: {fixture_path}")
+        fixtures.append(fixture)
+    fixtures.sort(key=lambda fixture: fixture.get('recorded_at', ''))
+    return fixtures
+
+
+class _ReplayStream(httpx.AsyncByteStream):
+    """按录制时间逐行输出响应体"""
+
+    def __init__(self, events: List, speed: float, started: float):
+        self.events = events
+        self.speed = speed
+        self.started = started
+
+    async def __aiter__(self):
+        loop = asyncio.get_running_loop()
+        for at, line in self.events:
+            if self.speed > 0:
+                delay = self.started + at / self.speed - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            yield f"{line}\n".encode('utf-8')
+
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    """
+    从录制文件返回上游响应
+
+    先按请求指纹匹配；没有匹配时，非严格模式依次循环使用全部录制，严格模式抛出 ReplayMiss。
+    speed 为回放倍速：1 按原始节奏，10 加速 10 倍，0 不等待
+    """
+
+    def __init__(self, fixtures: List[Dict], speed: float = 1.0, strict: bool = False):
+        if not fixtures:
+            raise ValueError("没有可回放的录制")
+        self.fixtures = fixtures
+        self.speed = speed
+        self.strict = strict
+        self.by_key = {fixture['key']: fixture for fixture in fixtures}
+        self.requests = []
+        self._next = 0
+
+    @classmethod
+    def from_path(cls, path: str, speed: float = 1.0, strict: bool = False) -> 'ReplayTransport':
+        return cls(load_fixtures(path), speed=speed, strict=strict)
+
+    def match(self, payload: Dict) -> Dict:
+        fixture = self.by_key.get(fixture_key(payload))
+        if fixture is not None:
+            metrics.inc('upstream_replays_total', match='key')
+            return fixture
+        if self.strict:
+            raise ReplayMiss(f"没有与请求匹配的录制: {fixture_key(payload)}")
+        fixture = self.fixtures[self._next % len(self.fixtures)]
+        self._next += 1
+        metrics.inc('upstream_replays_total', match='sequence')
+        return fixture
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        payload = json.loads(request.content or b'{}')
+        fixture = self.match(payload)
+        self.requests.append(payload)
+
+        if self.speed > 0 and fixture.get('headers_at'):
+            await asyncio.sleep(fixture['headers_at'] / self.speed)
+        return httpx.Response(
+            fixture['status'],
+            headers={'content-type': 'text/event-stream'},
+            stream=_ReplayStream(fixture.get('events', []), self.speed, started),
+            request=request,
+        )
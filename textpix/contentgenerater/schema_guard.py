@@ -0,0 +1,134 @@
+"""
+流式输出格式校验
+边接收模型输出边按模板校验顶层结构：输出的是说明文字而不是 JSON、出现模板之外的顶层字段、
+字段类型不对时，在前几十个 token 内就能发现，由调用方取消上游请求并重试，不必等到整篇生成完毕
+"""
+from typing import Dict, List
+
+# 各模板允许的顶层字段及其类型（与 _build_normal_prompt / _build_wechat_prompt 中的格式一致）
+TEMPLATE_SCHEMAS: Dict[str, Dict[str, str]] = {
+    'normal': {'title': 'string', 'intro': 'string', 'sections': 'array', 'footer': 'string'},
+    'wechat': {'title': 'string', 'chat_header': 'string', 'chatHeader': 'string', 'messages': 'array'},
+}
+
+_VALUE_TYPES = {'"': 'string', '[': 'array', '{': 'object'}
+_FENCE_CHARS = set('`json')
+
+
+class SchemaDivergence(Exception):
+    """模型输出明显偏离模板格式"""
+
+    def __init__(self, reason: str, message: str):
+        super().__init__(message)
+        self.reason = reason
+
+
+class StreamSchemaValidator:
+    """
+    增量校验器：逐块 feed 模型输出
+
+    确认前 commit_keys 个顶层字段合法之前（committed 为 False），发现偏离时抛出 SchemaDivergence；
+    确认之后内容已经发给客户端，不再中止，只把偏离记录到 violations
+    """
+
+    def __init__(self, template_type: str = 'normal', commit_keys: int = 1, max_preamble: int = 40):
+        self.template_type = template_type
+        self.schema = TEMPLATE_SCHEMAS.get(template_type, TEMPLATE_SCHEMAS['normal'])
+        self.commit_keys = max(1, commit_keys)
+        self.max_preamble = max_preamble
+        self.committed = False
+        self.violations: List[str] = []
+        self.keys: List[str] = []
+
+        self._started = False      # 已遇到顶层 {
+        self._finished = False     # 顶层对象已闭合
+        self._preamble = 0         # { 之前的非空白、非代码块标记字符数
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._reading_key = False
+        self._key = []
+        self._expect_value = False  # 顶层字段的冒号之后，等待值的第一个字符
+        self._current_key = None
+
+    def feed(self, chunk: str):
+        for ch in chunk:
+            if self._finished:
+                return
+            if not self._started:
+                self._feed_preamble(ch)
+            else:
+                self._feed_body(ch)
+
+    def _diverge(self, reason: str, message: str):
+        if self.committed:
+            self.violations.append(message)
+            return
+        raise SchemaDivergence(reason, message)
+
+    def _feed_preamble(self, ch: str):
+        if ch == '{':
+            self._started = True
+            self._depth = 1
+        elif ch == '[':
+            self._started = True
+            self._finished = True
+            self._diverge('not_object', "顶层不是 JSON 对象")
+        elif not ch.isspace() and ch not in _FENCE_CHARS:
+            self._preamble += 1
+            if self._preamble > self.max_preamble:
+                self._finished = True
+                self._diverge('prose', "输出的是文字说明而不是 JSON")
+
+    def _feed_body(self, ch: str):
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+            elif ch == '\\':
+                self._escape = True
+                return
+            elif ch == '"':
+                self._in_string = False
+                if self._reading_key:
+                    self._reading_key = False
+                    self._current_key = ''.join(self._key)
+                return
+            if self._reading_key:
+                self._key.append(ch)
+            return
+
+        if ch.isspace():
+            return
+
+        if self._expect_value:
+            self._expect_value = False
+            self._check_value(ch)
+
+        if ch == '"':
+            self._in_string = True
+            if self._depth == 1 and self._current_key is None:
+                self._reading_key = True
+                self._key = []
+        elif ch in '{[':
+            self._depth += 1
+        elif ch in '}]':
+            self._depth -= 1
+            if self._depth == 0:
+                self._finished = True
+        elif ch == ':' and self._depth == 1 and self._current_key is not None:
+            self._expect_value = True
+        elif ch == ',' and self._depth == 1:
+            self._current_key = None
+
+    def _check_value(self, ch: str):
+        key = self._current_key
+        self.keys.append(key)
+        if key not in self.schema:
+            self._diverge('unexpected_key', f"出现模板 {self.template_type} 之外的字段: {key}")
+            return
+        actual = _VALUE_TYPES.get(ch, 'primitive')
+        if actual != self.schema[key]:
+            self._diverge('wrong_type', f"字段 {key} 应为 {self.schema[key]}，实际为 {actual}")
+            return
+        if len(self.keys) >= self.commit_keys:
+            self.committed = True
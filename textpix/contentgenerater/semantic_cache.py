@@ -0,0 +1,254 @@
+"""
+近似重复请求缓存
+用户重复提交时常常只改了空白、标点或词序，精确匹配几乎命中不了。
+这里把 theme / content 规范化后切成特征（英文单词、中文相邻二字组），
+用 MinHash 签名 + LSH 分桶在内存中找候选，再按 Jaccard 相似度判断是否复用（主题须单独达到阈值），
+不需要 GPU 或外部向量服务。规范化后完全相同的请求先按 sha256 精确查找，不计算签名
+"""
+import hashlib
+import heapq
+import random
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, Hashable, Optional, Tuple
+
+from . import config
+from .metrics import metrics
+
+_WORD = re.compile(r'[a-z0-9]+')
+_CJK_RUN = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+')
+# 中文之间的空白（如“如何高效 远程协作”）不算分隔
+_CJK_SPACE = re.compile(r'(?<=[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff])\s+(?=[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff])')
+_NON_WORD = re.compile(r'[\W_]+')
+_PRIME = (1 << 61) - 1
+
+
+def normalize(text: str) -> str:
+    """全角转半角、统一大小写（标点和空白在切分特征时丢弃）"""
+    return unicodedata.normalize('NFKC', text or '').lower()
+
+
+def shingles(text: str) -> FrozenSet[str]:
+    """
+    文本特征集合：英文/数字按单词，中文按相邻二字组（单字的片段保留单字）
+
+    集合与顺序无关，调换词序只影响片段边界处的少量二字组
+    """
+    text = _CJK_SPACE.sub('', normalize(text))
+    features = set(_WORD.findall(text))
+    for run in _CJK_RUN.findall(text):
+        if len(run) == 1:
+            features.add(run)
+        features.update(run[i:i + 2] for i in range(len(run) - 1))
+    return frozenset(features)
+
+
+RequestParts = Tuple[FrozenSet[str], FrozenSet[str]]
+
+
+def request_parts(theme: str, content: str) -> RequestParts:
+    """主题和内容描述各自的特征集合"""
+    return shingles(theme), shingles(content)
+
+
+def _combine(parts: RequestParts) -> FrozenSet[str]:
+    theme, content = parts
+    return frozenset([f"t:{s}" for s in theme] + [f"c:{s}" for s in content])
+
+
+def request_features(theme: str, content: str) -> FrozenSet[str]:
+    """生成请求的特征（用于 MinHash 找候选）：主题和内容描述分开标记，避免两者之间互相匹配"""
+    return _combine(request_parts(theme, content))
+
+
+def request_similarity(a: RequestParts, b: RequestParts, threshold: float) -> float:
+    """
+    两个请求的相似度：主题单独计算 Jaccard，达到 threshold 时返回主题和内容描述合并后的 Jaccard，否则返回 0
+
+    主题通常很短，与内容描述合成一个集合时会被相同的描述淹没，
+    “北京旅游攻略”和“南京旅游攻略”配同一段描述时合并后的相似度超过 0.9，因此主题必须单独达到阈值
+    """
+    if jaccard(a[0], b[0]) < threshold:
+        return 0.0
+    return jaccard(_combine(a), _combine(b))
+
+
+def exact_key(theme: str, content: str) -> str:
+    """规范化并去掉标点和空白后的 sha256，只差这些的请求得到同一个键"""
+    text = _NON_WORD.sub('', normalize(theme)) + '\0' + _NON_WORD.sub('', normalize(content))
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def _hash64(feature: str) -> int:
+    return int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+class MinHasher:
+    """
+    MinHash 签名（固定种子，同一配置下签名可复现）
+
+    特征很多时（长内容描述）只取哈希值最小的 max_features 个计算签名：
+    这是按哈希值的一致采样，相似的集合取到的样本也相似，签名只用于找候选，
+    最终仍按完整特征集合计算相似度；计算量不再随文本长度增长
+    """
+
+    def __init__(self, num_perm: int = 64, seed: int = 1, max_features: int = 256):
+        rng = random.Random(seed)
+        self.num_perm = num_perm
+        self.max_features = max_features
+        self.params = [(rng.randrange(1, _PRIME), rng.randrange(0, _PRIME)) for _ in range(num_perm)]
+
+    def signature(self, features: FrozenSet[str]) -> Tuple[int, ...]:
+        if not features:
+            return (_PRIME,) * self.num_perm
+        hashes = [_hash64(feature) for feature in features]
+        if self.max_features and len(hashes) > self.max_features:
+            hashes = heapq.nsmallest(self.max_features, hashes)
+        return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in self.params)
+
+
+class _Entry:
+    __slots__ = ('partition', 'key', 'parts', 'signature', 'value', 'created')
+
+    def __init__(self, partition, key, parts, signature, value):
+        self.partition = partition
+        self.key = key
+        self.parts = parts
+        self.signature = signature
+        self.value = value
+        self.created = time.monotonic()
+
+
+class NearDuplicateCache:
+    """
+    近似重复缓存（LRU + 过期时间，线程安全）
+
+    partition 隔离不同模板 / 模型 / 租户，只在同一分区内查找；
+    bands 个 LSH 分桶中任一相同即为候选，主题的 Jaccard 相似度和主题加内容描述的整体相似度都不低于 threshold 时命中
+    """
+
+    def __init__(self, threshold: float = 0.8, max_size: int = 1000, ttl: float = 3600,
+                 num_perm: int = 64, bands: int = 16):
+        if num_perm % bands:
+            raise ValueError("num_perm 必须是 bands 的整数倍")
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl = ttl
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.hasher = MinHasher(num_perm)
+        self._entries: 'OrderedDict[int, _Entry]' = OrderedDict()
+        self._buckets: Dict[tuple, set] = {}
+        self._exact: Dict[tuple, int] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def _band_keys(self, partition: Hashable, signature: Tuple[int, ...]):
+        for band in range(self.bands):
+            yield partition, band, signature[band * self.rows:(band + 1) * self.rows]
+
+    def _remove(self, entry_id: int):
+        entry = self._entries.pop(entry_id)
+        if self._exact.get((entry.partition, entry.key)) == entry_id:
+            del self._exact[(entry.partition, entry.key)]
+        for key in self._band_keys(entry.partition, entry.signature):
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[key]
+
+    def lookup(self, partition: Hashable, theme: str, content: str) -> Optional[Tuple[Any, float]]:
+        """
+        查找相似请求的缓存结果
+
+        Returns:
+            (缓存的值, 相似度)；没有命中时返回 None
+        """
+        # 规范化后完全相同：直接命中，不计算特征和签名
+        key = exact_key(theme, content)
+        now = time.monotonic()
+        exact = None
+        with self._lock:
+            entry_id = self._exact.get((partition, key))
+            if entry_id is not None:
+                if self.ttl and now - self._entries[entry_id].created > self.ttl:
+                    self._remove(entry_id)
+                else:
+                    self._entries.move_to_end(entry_id)
+                    exact = self._entries[entry_id]
+        if exact is not None:
+            metrics.inc('semantic_cache_lookups_total', result='hit')
+            metrics.inc('semantic_cache_exact_hits_total')
+            metrics.observe('semantic_cache_hit_similarity', 1.0)
+            return exact.value, 1.0
+
+        parts = request_parts(theme, content)
+        signature = self.hasher.signature(_combine(parts))
+
+        with self._lock:
+            candidates = set()
+            for key in self._band_keys(partition, signature):
+                candidates.update(self._buckets.get(key, ()))
+
+            best_id, best = None, 0.0
+            for entry_id in candidates:
+                entry = self._entries[entry_id]
+                if self.ttl and now - entry.created > self.ttl:
+                    self._remove(entry_id)
+                    continue
+                similarity = request_similarity(parts, entry.parts, self.threshold)
+                if similarity > best:
+                    best_id, best = entry_id, similarity
+
+            if best_id is None or best < self.threshold:
+                metrics.inc('semantic_cache_lookups_total', result='miss')
+                return None
+            self._entries.move_to_end(best_id)
+            value = self._entries[best_id].value
+
+        metrics.inc('semantic_cache_lookups_total', result='hit')
+        metrics.observe('semantic_cache_hit_similarity', best)
+        return value, best
+
+    def add(self, partition: Hashable, theme: str, content: str, value: Any):
+        key = exact_key(theme, content)
+        parts = request_parts(theme, content)
+        signature = self.hasher.signature(_combine(parts))
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = _Entry(partition, key, parts, signature, value)
+            self._exact[(partition, key)] = entry_id
+            for key in self._band_keys(partition, signature):
+                self._buckets.setdefault(key, set()).add(entry_id)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+            metrics.set_gauge('semantic_cache_entries', len(self._entries))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+            self._exact.clear()
+            metrics.set_gauge('semantic_cache_entries', 0)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# 全局生成结果缓存
+generation_cache = NearDuplicateCache(
+    threshold=config.SEMANTIC_CACHE_THRESHOLD,
+    max_size=config.SEMANTIC_CACHE_SIZE,
+    ttl=config.SEMANTIC_CACHE_TTL,
+)
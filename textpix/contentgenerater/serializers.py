@@ -3,6 +3,9 @@
 """
 from rest_framework import serializers
 
+from . import config
+from .budget import InputTooLarge, check_content_length
+
 
 class GenerateRequestSerializer(serializers.Serializer):
     """内容生成请求序列化器"""
@@ -20,6 +23,31 @@ class GenerateRequestSerializer(serializers.Serializer):
         default='normal',
         help_text="模板类型: normal(普通文章) | wechat(微信聊天)"
     )
+    mode = serializers.ChoiceField(
+        choices=['single', 'outline'],
+        required=False,
+        default='single',
+        help_text="生成方式: single(一次生成全文) | outline(先生成大纲再并行生成各版块，仅 normal 模板)"
+    )
+    variants = serializers.IntegerField(
+        min_value=1,
+        max_value=config.MAX_VARIANTS,
+        required=False,
+        default=1,
+        help_text="生成的版本数，大于 1 时各版本交错返回"
+    )
+    cache = serializers.BooleanField(
+        required=False,
+        default=True,
+        help_text="是否允许复用近似重复请求的生成结果"
+    )
+    
+    def validate_content(self, value):
+        """超过 MAX_CONTENT_LENGTH 时按配置拒绝或压缩"""
+        try:
+            return check_content_length(value)
+        except InputTooLarge as e:
+            raise serializers.ValidationError(str(e))
 
 
 class GenerateResponseSerializer(serializers.Serializer):
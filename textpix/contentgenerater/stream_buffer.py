@@ -0,0 +1,227 @@
+"""
+上游读取与客户端写入解耦
+上游消费者作为独立任务运行在后台事件循环中，尽快读完上游并写入有界缓冲区；
+客户端按自己的速度从缓冲区读取。慢客户端不会拖慢上游读取、占住上游连接
+"""
+import asyncio
+import contextvars
+import logging
+import threading
+from collections import deque
+from typing import AsyncGenerator, AsyncIterator, Iterator, List
+
+from django.db import connections
+
+from . import config
+from .event_loop import background_loop
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# 缓冲区溢出策略
+POLICY_COALESCE = 'coalesce'  # 合并为更大的块（文本块无损，上游不被阻塞）
+POLICY_BLOCK = 'block'        # 暂停读取上游，等待客户端追上（退化为同步节奏）
+POLICY_ABORT = 'abort'        # 中止本次生成
+OVERFLOW_POLICIES = (POLICY_COALESCE, POLICY_BLOCK, POLICY_ABORT)
+
+_END = object()
+# iter_idle 在一段时间没有数据时产出的标记
+IDLE = object()
+
+
+class BufferOverflowError(Exception):
+    """客户端过慢，缓冲区溢出（abort 策略）"""
+
+
+class StreamPump:
+    """
+    把异步生成器泵入有界缓冲区
+
+    用法:
+        pump = StreamPump(async_gen)
+        for chunk in pump:       # 同步视图
+            ...
+    """
+
+    def __init__(self, async_gen: AsyncGenerator, high_water: int = None, policy: str = None, loop=None):
+        self.async_gen = async_gen
+        self.high_water = max(1, high_water or config.STREAM_BUFFER_HIGH_WATER)
+        self.policy = policy or config.STREAM_BUFFER_OVERFLOW_POLICY
+        if self.policy not in OVERFLOW_POLICIES:
+            logger.warning(f"未知的缓冲区溢出策略 {self.policy}，使用 {POLICY_COALESCE}")
+            self.policy = POLICY_COALESCE
+        self.loop = loop or background_loop
+
+        self._buffer = deque()
+        self._error = None
+        self._finished = False
+        # Python 3.10+ 的 asyncio.Event 在首次等待时才绑定事件循环
+        self._data_ready = asyncio.Event()
+        self._space_ready = asyncio.Event()
+        self._future = None
+        self.max_depth = 0
+        self.overflows = 0
+
+    # ---------- 生产者（运行在后台事件循环中） ----------
+
+    async def _run(self):
+        metrics.add_gauge('stream_pumps_active', 1)
+        try:
+            async for item in self.async_gen:
+                await self._put(item)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._error = e
+        finally:
+            self._finished = True
+            self._data_ready.set()
+            metrics.add_gauge('stream_pumps_active', -1)
+            metrics.inc('stream_pumps_total')
+            metrics.observe('stream_buffer_max_depth', self.max_depth)
+            if self.overflows:
+                # 客户端至少有一次跟不上上游
+                metrics.inc('stream_clients_lagging_total', policy=self.policy)
+                metrics.inc('stream_buffer_overflows_total', self.overflows, policy=self.policy)
+            await self.async_gen.aclose()
+
+    async def _put(self, item):
+        if len(self._buffer) >= self.high_water:
+            self.overflows += 1
+            if self.policy == POLICY_COALESCE and isinstance(item, str) and isinstance(self._buffer[-1], str):
+                self._buffer[-1] += item
+                self._data_ready.set()
+                return
+            if self.policy == POLICY_ABORT:
+                raise BufferOverflowError(f"客户端接收过慢，缓冲区超过 {self.high_water} 块")
+            # block 策略（或无法合并的非文本块）：等待消费者腾出空间
+            while len(self._buffer) >= self.high_water:
+                self._space_ready.clear()
+                await self._space_ready.wait()
+
+        self._buffer.append(item)
+        self.max_depth = max(self.max_depth, len(self._buffer))
+        self._data_ready.set()
+
+    # ---------- 消费者 ----------
+
+    def start(self):
+        if self._future is None:
+            self._future = self.loop.submit(self._run())
+        return self
+
+    async def _take(self, timeout: float = None) -> List:
+        """取出缓冲区中的全部数据（在后台事件循环中执行）；超时返回空列表"""
+        while not self._buffer and not self._finished:
+            self._data_ready.clear()
+            try:
+                await asyncio.wait_for(self._data_ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+
+        items = list(self._buffer)
+        self._buffer.clear()
+        self._space_ready.set()
+        if not items and self._finished:
+            if self._error is not None:
+                raise self._error
+            return [_END]
+        return items
+
+    def next_batch(self, timeout: float = None) -> List:
+        """
+        同步获取下一批数据
+
+        Returns:
+            数据列表；超时返回空列表；流结束时返回 None
+        """
+        self.start()
+        items = self.loop.run(self._take(timeout))
+        if items and items[-1] is _END:
+            return None
+        return items
+
+    def __iter__(self) -> Iterator:
+        return self.iter_idle()
+
+    def iter_idle(self, idle_timeout: float = None) -> Iterator:
+        """逐个产出数据；超过 idle_timeout 秒没有数据时产出 IDLE（调用方可借此发送心跳）"""
+        try:
+            while True:
+                items = self.next_batch(idle_timeout)
+                if items is None:
+                    break
+                if not items:
+                    yield IDLE
+                    continue
+                yield from items
+        finally:
+            self.close()
+
+    def close(self):
+        """取消上游读取（客户端断开或出错时调用）"""
+        if self._future is not None and not self._future.done():
+            self._future.cancel()
+
+
+class _Failure:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+async def iterate_in_thread(iterator: Iterator, max_pending: int = 16) -> AsyncIterator:
+    """
+    在一个专用线程中迭代同步迭代器，逐项交给异步调用方
+
+    ASGI 下 Django 会先把同步的 StreamingHttpResponse 迭代器整个读完再发送，SSE 就失去了流式效果；
+    视图改为返回这个异步迭代器。整个迭代在同一个线程和同一个 contextvars 上下文中执行，
+    请求追踪等上下文变量可以正常设置和恢复。调用方停止读取（客户端断开）时，
+    线程在产出下一项后关闭迭代器，执行其中的清理代码
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    slots = threading.Semaphore(max(1, max_pending))
+    stopped = threading.Event()
+
+    def deliver(item):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+        except RuntimeError:
+            # 事件循环已关闭
+            stopped.set()
+
+    def produce():
+        try:
+            for item in iterator:
+                slots.acquire()
+                if stopped.is_set():
+                    break
+                deliver(item)
+        except Exception as e:
+            deliver(_Failure(e))
+        finally:
+            try:
+                close = getattr(iterator, 'close', None)
+                if close is not None:
+                    close()
+            finally:
+                # 迭代中（如保存文章）打开的数据库连接属于这个线程，线程结束前关闭，
+                # 否则连接不会被请求结束信号回收，一直占用到进程退出
+                connections.close_all()
+                deliver(_END)
+
+    thread = threading.Thread(target=contextvars.copy_context().run, args=(produce,), name='sse-stream', daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = await queue.get()
+            slots.release()
+            if item is _END:
+                break
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        stopped.set()
+        # 唤醒等待空位的线程，让它看到停止标记
+        slots.release()
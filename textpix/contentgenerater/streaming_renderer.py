@@ -4,9 +4,12 @@
 """
 import json
 import re
-from typing import AsyncGenerator, Dict, List
+from typing import AsyncGenerator, Dict, Iterator, List
 import logging
 
+from .json_repair import parse_model_json, repair_json
+from .tracing import span
+
 logger = logging.getLogger(__name__)
 
 
@@ -119,6 +122,8 @@ class StreamingHTMLRenderer:
         section_number = str(index + 1).zfill(2)
         title = section.get('title', '')
         items = section.get('items', [])
+        if not isinstance(items, list):
+            items = [items]
         
         items_html = '\n'.join([
             f'                <li>- {self._escape(item)}</li>'
@@ -136,6 +141,210 @@ class StreamingHTMLRenderer:
     def render_footer_note(self, footer: str) -> str:
         """渲染结语"""
         return f"        <div class=\"footer-note\">{self._escape(footer)}</div>\n"
+    
+    def iter_document(self, data: Dict) -> Iterator[str]:
+        """按顺序逐段渲染完整文档"""
+        yield self.get_html_header(data.get('title', '文章'))
+        
+        if 'title' in data:
+            yield self.render_title(data['title'])
+        
+        if 'intro' in data:
+            yield self.render_intro(data['intro'])
+        
+        if 'sections' in data and isinstance(data['sections'], list):
+            for i, section in enumerate(data['sections']):
+                if isinstance(section, dict):
+                    yield self.render_section(section, i)
+        
+        if 'footer' in data:
+            yield self.render_footer_note(data['footer'])
+        
+        yield self.get_html_footer()
+    
+    def render_document(self, data: Dict) -> str:
+        """一次性渲染完整文档"""
+        return ''.join(self.iter_document(data))
+    
+    def iter_partial(self, data: Dict, complete: bool = False) -> Iterator[str]:
+        """
+        按已解析出的部分继续渲染（只输出之前没有输出过的片段）
+
+        出现 sections 后输出页头、标题和简介；某个版块之后出现下一个版块或结语时，该版块才算完整。
+        complete 为 True 时输出剩余部分和页尾
+        """
+        sections = data.get('sections') if isinstance(data.get('sections'), list) else None
+        if not self.html_sent:
+            if sections is None and not complete:
+                return
+            self.html_sent = True
+            yield self.get_html_header(data.get('title', '文章'))
+            if 'title' in data:
+                yield self.render_title(data['title'])
+            if 'intro' in data:
+                yield self.render_intro(data['intro'])
+        
+        sections = sections or []
+        finished = len(sections) if complete or 'footer' in data else len(sections) - 1
+        while self.sections_count < finished:
+            section = sections[self.sections_count]
+            if isinstance(section, dict):
+                yield self.render_section(section, self.sections_count)
+            self.sections_count += 1
+        
+        if complete:
+            if 'footer' in data:
+                yield self.render_footer_note(data['footer'])
+            yield self.get_html_footer()
+
+
+class WechatHTMLRenderer(StreamingHTMLRenderer):
+    """微信聊天记录渲染器（与前端 wechatRenderer 保持一致的布局）"""
+    
+    AVATAR_COLORS = [
+        '#1AAD19', '#FA9D3B', '#576B95', '#EE5253',
+        '#10AC84', '#5F27CD', '#00D2D3', '#FF6B6B'
+    ]
+    
+    def get_html_header(self, title: str = "") -> str:
+        """获取HTML头部"""
+        return f"""<!DOCTYPE html>
+<html lang="zh-CN">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>{self._escape(title)}</title>
+    <style>
+        * {{ margin: 0; padding: 0; box-sizing: border-box; }}
+        body {{
+            font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", "PingFang SC", "Hiragino Sans GB", "Microsoft YaHei", sans-serif;
+            background: #ededed;
+            padding: 20px;
+        }}
+        .chat-container {{
+            max-width: 500px;
+            margin: 0 auto;
+            background: #f5f5f5;
+            border-radius: 10px;
+            overflow: hidden;
+            box-shadow: 0 2px 10px rgba(0,0,0,0.1);
+        }}
+        .chat-header {{
+            background: #ededed;
+            padding: 15px;
+            text-align: center;
+            font-size: 16px;
+            color: #000;
+            border-bottom: 1px solid #d9d9d9;
+        }}
+        .chat-messages {{ padding: 20px 15px; background: #f5f5f5; min-height: 400px; }}
+        .message {{ margin-bottom: 20px; display: flex; align-items: flex-start; }}
+        .message.left {{ flex-direction: row; }}
+        .message.right {{ flex-direction: row-reverse; }}
+        .avatar {{
+            width: 45px;
+            height: 45px;
+            border-radius: 5px;
+            flex-shrink: 0;
+            display: flex;
+            align-items: center;
+            justify-content: center;
+            color: #fff;
+            font-size: 18px;
+            font-weight: 500;
+        }}
+        .message-content {{ max-width: 70%; margin: 0 10px; }}
+        .message-bubble {{
+            padding: 10px 15px;
+            border-radius: 5px;
+            font-size: 16px;
+            line-height: 1.5;
+            word-wrap: break-word;
+        }}
+        .message.left .message-bubble {{ background: #fff; border-radius: 0 8px 8px 8px; }}
+        .message.right .message-bubble {{ background: #95ec69; border-radius: 8px 0 8px 8px; }}
+        .message-time {{ text-align: center; color: #999; font-size: 12px; margin: 15px 0; }}
+        .nickname {{ font-size: 13px; color: #999; margin-bottom: 5px; }}
+        .message.right .nickname {{ text-align: right; }}
+    </style>
+</head>
+<body>
+    <div class="chat-container">
+"""
+    
+    def avatar_color(self, nickname: str) -> str:
+        """根据昵称生成头像背景色（与前端 getAvatarColor 算法一致）"""
+        value = 0
+        for char in nickname:
+            value = (ord(char) + ((value << 5) - value)) & 0xFFFFFFFF
+        if value & 0x80000000:
+            value -= 0x100000000
+        return self.AVATAR_COLORS[abs(value) % len(self.AVATAR_COLORS)]
+    
+    def render_chat_header(self, chat_header: str) -> str:
+        """渲染聊天标题"""
+        return f"""        <div class="chat-header">{self._escape(chat_header)}</div>
+        <div class="chat-messages">
+"""
+    
+    def render_message(self, message: Dict) -> str:
+        """渲染单条消息或时间分隔线"""
+        if message.get('type') == 'time':
+            return f"            <div class=\"message-time\">{self._escape(message.get('time', ''))}</div>\n"
+        
+        align = 'right' if message.get('align') == 'right' else 'left'
+        nickname = message.get('nickname') or message.get('sender') or ''
+        text = message.get('text') or message.get('content') or ''
+        nickname_html = ''
+        if message.get('showNickname') is not False:
+            nickname_html = f"<div class=\"nickname\">{self._escape(nickname)}</div>"
+        
+        return f"""            <div class="message {align}">
+                <div class="avatar" style="background-color: {self.avatar_color(nickname)}">{self._escape(nickname[:1] or '?')}</div>
+                <div class="message-content">
+                    {nickname_html}
+                    <div class="message-bubble">{self._escape(text)}</div>
+                </div>
+            </div>
+"""
+    
+    def get_html_footer(self) -> str:
+        """获取HTML尾部"""
+        return """        </div>
+    </div>
+</body>
+</html>"""
+    
+    def iter_document(self, data: Dict) -> Iterator[str]:
+        """按顺序逐段渲染聊天记录"""
+        yield self.get_html_header(data.get('title', '微信聊天'))
+        yield self.render_chat_header(data.get('chat_header') or data.get('chatHeader') or '聊天')
+        
+        messages = data.get('messages', [])
+        if isinstance(messages, list):
+            for message in messages:
+                if isinstance(message, dict):
+                    yield self.render_message(message)
+        
+        yield self.get_html_footer()
+    
+    def iter_partial(self, data: Dict, complete: bool = False) -> Iterator[str]:
+        """聊天记录在生成完成后一次性渲染"""
+        if complete and not self.html_sent:
+            self.html_sent = True
+            yield from self.iter_document(data)
+
+
+def get_renderer(template_type: str = 'normal') -> StreamingHTMLRenderer:
+    """根据模板类型获取渲染器"""
+    if template_type == 'wechat':
+        return WechatHTMLRenderer()
+    return StreamingHTMLRenderer()
+
+
+def render_html(data: Dict, template_type: str = 'normal') -> str:
+    """将生成的 JSON 数据一次性渲染为完整 HTML"""
+    return get_renderer(template_type).render_document(data)
 
 
 class JSONStreamParser:
@@ -206,105 +415,78 @@ async def stream_render_from_ai(
     if renderer is None:
         renderer = StreamingHTMLRenderer()
     
-    parser = JSONStreamParser()
     json_buffer = ""
-    html_header_sent = False
-    data_parsed = False
     
-    try:
-        # 收集所有AI输出
-        async for chunk in ai_generator:
-            json_buffer += chunk
-        
-        # AI生成完毕，解析JSON
-        logger.info(f"AI生成完毕，开始解析JSON，长度: {len(json_buffer)}")
-        
-        # 清理JSON字符串
-        json_str = json_buffer.strip()
-        
-        # 移除可能的markdown代码块标记
-        if json_str.startswith('```json'):
-            json_str = json_str[7:]
-        elif json_str.startswith('```'):
-            json_str = json_str[3:]
+    with span('render.stream_from_ai', renderer=type(renderer).__name__) as render_span:
+        try:
+            async for chunk in ai_generator:
+                json_buffer += chunk
+                # 可能刚完成一个版块（大纲模式下各版块整块到达）：先渲染已完成的部分
+                if '}' in chunk:
+                    try:
+                        partial, _ = repair_json(json_buffer)
+                    except ValueError:
+                        continue
+                    if isinstance(partial, dict):
+                        for html_part in renderer.iter_partial(partial):
+                            yield html_part
         
-        if json_str.endswith('```'):
-            json_str = json_str[:-3]
+            # AI生成完毕，解析JSON
+            logger.info(f"AI生成完毕，开始解析JSON，长度: {len(json_buffer)}", extra={'sample': 'request'})
+            render_span.add_event('ai_output_complete', length=len(json_buffer))
         
-        json_str = json_str.strip()
+            json_str = json_buffer.strip()
         
-        # 解析JSON
-        try:
-            data = json.loads(json_str)
-            logger.info(f"JSON解析成功: {data.keys()}")
-            
-            # 发送HTML头部
-            title = data.get('title', '文章')
-            yield renderer.get_html_header(title)
-            
-            # 发送标题
-            if 'title' in data:
-                yield renderer.render_title(data['title'])
-            
-            # 发送简介
-            if 'intro' in data:
-                yield renderer.render_intro(data['intro'])
-            
-            # 发送sections
-            if 'sections' in data and isinstance(data['sections'], list):
-                for i, section in enumerate(data['sections']):
-                    yield renderer.render_section(section, i)
+            # 解析JSON（不是严格 JSON 时尝试修复，截断的输出也能渲染已完成的部分）
+            try:
+                data = extract_json_from_text(json_str)
+                logger.info(f"JSON解析成功: {list(data.keys())}", extra={'sample': 'request'})
             
-            # 发送结语
-            if 'footer' in data:
-                yield renderer.render_footer_note(data['footer'])
-            
-            # 发送HTML尾部
-            yield renderer.get_html_footer()
+                # 逐段发送剩余的HTML
+                for html_part in renderer.iter_partial(data, complete=True):
+                    yield html_part
             
-            data_parsed = True
+                render_span.set_attribute('parsed', True)
             
-        except json.JSONDecodeError as e:
-            logger.error(f"JSON解析失败: {e}")
-            logger.error(f"JSON内容: {json_str[:500]}...")
+            except ValueError as e:
+                from . import config
+                logger.warning(f"JSON解析失败: {e}", extra={'length': len(json_str)})
+                render_span.set_attribute('parsed', False)
+                logger.debug(f"JSON内容: {json_str[:config.LOG_PAYLOAD_CHARS]}...")
             
-            # 解析失败，返回原始内容
-            if not html_header_sent:
-                yield renderer.get_html_header("内容生成")
-                html_header_sent = True
+                # 解析失败，返回原始内容
+                if not renderer.html_sent:
+                    yield renderer.get_html_header("内容生成")
+                    renderer.html_sent = True
             
-            yield f"        <div class=\"intro\">AI返回内容格式错误，原始内容：<br><pre>{renderer._escape(json_str[:1000])}</pre></div>\n"
-            yield renderer.get_html_footer()
+                yield f"        <div class=\"intro\">AI返回内容格式错误，原始内容：<br><pre>{renderer._escape(json_str[:1000])}</pre></div>\n"
+                yield renderer.get_html_footer()
     
-    except Exception as e:
-        logger.error(f"流式渲染错误: {e}", exc_info=True)
-        if not html_header_sent:
-            yield renderer.get_html_header("错误")
-        yield f"        <div class=\"intro\" style=\"color: red;\">渲染错误: {renderer._escape(str(e))}</div>\n"
-        yield renderer.get_html_footer()
+        except Exception as e:
+            logger.error(f"流式渲染错误: {e}", exc_info=True)
+            if not renderer.html_sent:
+                yield renderer.get_html_header("错误")
+            yield f"        <div class=\"intro\" style=\"color: red;\">渲染错误: {renderer._escape(str(e))}</div>\n"
+            yield renderer.get_html_footer()
 
 
 def extract_json_from_text(text: str) -> Dict:
     """
     从文本中提取JSON对象（处理AI可能返回的markdown格式）
     
+    不是严格 JSON 时（多余逗号、被 max_tokens 截断、前后夹带说明文字、字符串中的原始换行等）
+    恢复最长的有效前缀并补全未闭合的结构
+    
     Args:
         text: 包含JSON的文本
         
     Returns:
         解析后的JSON对象
-    """
-    # 移除markdown代码块
-    text = text.strip()
-    if text.startswith('```json'):
-        text = text[7:]
-    elif text.startswith('```'):
-        text = text[3:]
-    
-    if text.endswith('```'):
-        text = text[:-3]
     
-    text = text.strip()
-    
-    # 解析JSON
-    return json.loads(text)
+    Raises:
+        ValueError: 无法恢复出 JSON，或顶层不是 JSON 对象（数组、字符串、数字等）
+    """
+    data = parse_model_json(text)
+    if not isinstance(data, dict):
+        raise ValueError(f"JSON 顶层应为对象，实际为 {type(data).__name__}")
+    return data
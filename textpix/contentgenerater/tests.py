@@ -1,14 +1,59 @@
 """内容生成器测试"""
 from django.test import TestCase, Client
 from django.urls import reverse
+from unittest import mock
+import asyncio
 import json
+import logging
+import os
+import re
+import time
+
+from .ai_service import AIContentGenerator
+
+
+class FakeAIGenerator(AIContentGenerator):
+    """测试用生成器：不访问网络，记录调用次数"""
+    
+    ARTICLE = '{"title": "测试文章", "intro": "简介", "sections": [{"title": "版块", "items": ["要点"]}], "footer": "结语"}'
+    
+    def __init__(self):
+        super().__init__()
+        self.optimize_calls = []
+    
+    async def generate_content_stream(self, theme, content, images=None, template_type='normal'):
+        for i in range(0, len(self.ARTICLE), 8):
+            yield self.ARTICLE[i:i + 8]
+    
+    async def optimize_text_stream(self, text, optimization_type='grammar'):
+        self.optimize_calls.append(text)
+        # 让后面的分块先完成，验证输出仍按原始顺序
+        await asyncio.sleep(0.001 * (10 - min(len(self.optimize_calls), 10)))
+        yield "[优化]"
+        yield text
+
+
+UPSTREAM_FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'testdata', 'upstream')
 
 
 class ContentGeneratorTestCase(TestCase):
-    """内容生成器测试用例"""
+    """内容生成器测试用例（上游响应来自录制回放）"""
     
     def setUp(self):
         """测试初始化"""
+        from .semantic_cache import generation_cache
+        
+        generation_cache.clear()
+        patchers = [
+            mock.patch('contentgenerater.config.AI_REPLAY_DIR', UPSTREAM_FIXTURES),
+            mock.patch('contentgenerater.config.AI_REPLAY_SPEED', 0),
+            mock.patch('contentgenerater.config.AI_REPLAY_STRICT', True),
+            mock.patch('contentgenerater.config.CUSTOM_AI_MODEL', 'test-model'),
+            mock.patch('contentgenerater.ai_service._generator', None),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
         self.client = Client()
         self.test_data = {
             'title': '测试标题',
@@ -17,34 +62,43 @@ class ContentGeneratorTestCase(TestCase):
             'images': []
         }
     
+    def events(self, response):
+        content = b''.join(response.streaming_content).decode('utf-8')
+        return content, [json.loads(line[6:]) for line in content.split('\n\n') if line.startswith('data: {')]
+    
     def test_generate_content_success(self):
-        """测试标准内容生成 - 成功"""
+        """测试流式内容生成 - 回放录制的上游响应并保存文章"""
         response = self.client.post(
-            '/api/generate',
+            '/api/generate-stream',
             data=json.dumps(self.test_data),
             content_type='application/json'
         )
         
-        self.assertEqual(response.status_code, 200)
-        data = response.json()
-        self.assertTrue(data['success'])
-        self.assertIn('markdown', data)
-        self.assertIn('title', data)
-        self.assertIn('测试标题', data['markdown'])
+        content, events = self.events(response)
+        article = json.loads(''.join(e['content'] for e in events if 'content' in e))
+        self.assertEqual(article['title'], '测试主题：一份实用指南')
+        self.assertEqual(len(article['sections']), 3)
+        self.assertIn('articleId', events[-1])
+        
+        detail = self.client.get(events[-1]['url'] + '?format=json')
+        self.assertEqual(detail.status_code, 200)
+        self.assertEqual(detail.json()['data']['title'], article['title'])
     
     def test_generate_content_missing_fields(self):
-        """测试标准内容生成 - 缺少必填字段"""
+        """测试流式内容生成 - 缺少必填字段"""
         invalid_data = {'title': '测试标题'}  # 缺少 theme 和 content
         
         response = self.client.post(
-            '/api/generate',
+            '/api/generate-stream',
             data=json.dumps(invalid_data),
             content_type='application/json'
         )
         
-        self.assertEqual(response.status_code, 400)
-        data = response.json()
-        self.assertFalse(data['success'])
+        self.assertEqual(response.status_code, 200)
+        _, events = self.events(response)
+        self.assertEqual(events[0]['error'], '请求参数错误')
+        self.assertIn('theme', events[0]['details'])
+        self.assertIn('content', events[0]['details'])
     
     def test_generate_stream_success(self):
         """测试流式内容生成 - 成功"""
@@ -62,6 +116,7 @@ class ContentGeneratorTestCase(TestCase):
         self.assertIn('data:', content)
         self.assertIn('[DONE]', content)
     
+    @mock.patch('contentgenerater.views.get_ai_generator', FakeAIGenerator)
     def test_optimize_content_success(self):
         """测试内容优化 - 成功"""
         optimize_data = {
@@ -80,6 +135,28 @@ class ContentGeneratorTestCase(TestCase):
         self.assertTrue(data['success'])
         self.assertIn('markdown', data)
     
+    @mock.patch('contentgenerater.views.get_ai_generator', FakeAIGenerator)
+    def test_optimize_content_stream_flag(self):
+        """测试内容优化 - stream 参数按布尔值解析，"false"、"0" 不开启流式"""
+        def post(stream):
+            return self.client.post(
+                '/api/optimize',
+                data=json.dumps({'markdown': '测试内容', 'stream': stream}),
+                content_type='application/json'
+            )
+        
+        for value in ('false', '0', 0, False):
+            response = post(value)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'application/json')
+        
+        for value in ('true', '1', True):
+            response = post(value)
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            self.assertIn('[DONE]', b''.join(response.streaming_content).decode('utf-8'))
+        
+        self.assertEqual(post('maybe').status_code, 400)
+    
     def test_optimize_content_empty_markdown(self):
         """测试内容优化 - 空内容"""
         optimize_data = {
@@ -98,31 +175,2253 @@ class ContentGeneratorTestCase(TestCase):
         self.assertFalse(data['success'])
 
 
-class AIServiceTestCase(TestCase):
-    """AI 服务测试用例"""
+class OptimizerTestCase(TestCase):
+    """分块并行内容优化测试用例"""
+    
+    def setUp(self):
+        from .optimizer import chunk_cache
+        chunk_cache.clear()
+        self.markdown = "# 标题一\n\n第一段内容。\n\n## 标题二\n\n第二段内容。\n\n```python\nprint('a')\n\nprint('b')\n```"
+    
+    def test_split_markdown_boundaries(self):
+        """测试按标题/段落切分，代码块不被拆开"""
+        from .optimizer import split_markdown, CHUNK_SEPARATOR
+        
+        chunks = split_markdown(self.markdown, max_chars=20)
+        self.assertTrue(chunks[0].startswith('# 标题一'))
+        self.assertTrue(any(c.startswith('## 标题二') for c in chunks))
+        self.assertIn("```python\nprint('a')\n\nprint('b')\n```", chunks)
+        self.assertEqual(CHUNK_SEPARATOR.join(chunks), self.markdown)
     
-    def test_mock_generator(self):
-        """测试模拟生成器"""
-        from .ai_service import MockAIGenerator
-        import asyncio
+    def test_optimize_in_order_and_cached(self):
+        """测试乱序完成仍按顺序返回，未修改的分块命中缓存"""
+        from .optimizer import optimize_markdown_stream
+        
+        generator = FakeAIGenerator()
         
-        generator = MockAIGenerator()
+        async def collect(markdown):
+            return [item async for item in optimize_markdown_stream(generator, markdown, max_chars=20)]
         
-        # 测试标准生成
         loop = asyncio.new_event_loop()
-        result = loop.run_until_complete(
-            generator.generate_content('测试标题', '测试主题', '测试内容')
+        try:
+            first = loop.run_until_complete(collect(self.markdown))
+            self.assertEqual([index for index, _, _ in first], list(range(len(first))))
+            self.assertTrue(all(chunk.startswith('[优化]') for _, _, chunk in first))
+            calls = len(generator.optimize_calls)
+            
+            # 只修改最后一段，重新优化时只发送被修改的分块
+            edited = self.markdown.replace("print('b')", "print('c')")
+            loop.run_until_complete(collect(edited))
+            self.assertEqual(len(generator.optimize_calls), calls + 1)
+        finally:
+            loop.close()
+    
+    def test_edit_near_start_keeps_later_chunks(self):
+        """测试在文档开头插入段落后，后面的分块不变，重新优化时命中缓存"""
+        from .optimizer import split_markdown, CHUNK_SEPARATOR
+        
+        paragraphs = [f"第{i}段：" + "这是一段用于测试分块稳定性的正文内容。" * (2 + i % 4) for i in range(20)]
+        document = CHUNK_SEPARATOR.join(paragraphs[:8] + ["## 小节"] + paragraphs[8:])
+        edited = document.replace(paragraphs[1], paragraphs[1] + CHUNK_SEPARATOR + "新插入的一段内容。", 1)
+        
+        before = split_markdown(document, max_chars=400)
+        after = split_markdown(edited, max_chars=400)
+        self.assertEqual(CHUNK_SEPARATOR.join(after), edited)
+        self.assertGreaterEqual(len(before), 5)
+        self.assertTrue(all(len(chunk) <= 400 for chunk in after))
+        # 只有插入位置所在的分块变化
+        self.assertEqual(len(set(after) - set(before)), 1)
+        self.assertEqual(len(set(before) - set(after)), 1)
+
+
+class LoggingUtilsTestCase(TestCase):
+    """非阻塞日志测试用例"""
+    
+    def make_record(self, level=logging.INFO, lineno=1, **extra):
+        record = logging.LogRecord('contentgenerater.test', level, __file__, lineno, '消息 %s', ('a',), None)
+        record.__dict__.update(extra)
+        return record
+    
+    def test_sampling_filter(self):
+        """测试按类别采样，告警总是保留"""
+        from .logging_utils import SamplingFilter
+        
+        sampling = SamplingFilter(request_rate=1.0, chunk_rate=0.0)
+        self.assertTrue(sampling.filter(self.make_record(sample='request')))
+        self.assertFalse(sampling.filter(self.make_record(sample='chunk')))
+        self.assertTrue(sampling.filter(self.make_record(level=logging.WARNING, sample='chunk')))
+    
+    def test_rate_limit_filter(self):
+        """测试同一位置的重复错误被限流"""
+        from .logging_utils import RateLimitFilter
+        
+        rate_limit = RateLimitFilter(burst=3, period=60)
+        passed = [rate_limit.filter(self.make_record(level=logging.ERROR)) for _ in range(10)]
+        self.assertEqual(passed.count(True), 3)
+        self.assertTrue(rate_limit.filter(self.make_record(level=logging.ERROR, lineno=2)))
+    
+    def test_queued_handler_structured_output(self):
+        """测试队列处理器在后台线程输出结构化字段"""
+        import io
+        from .logging_utils import QueuedStreamHandler, StructuredFormatter
+        
+        stream = io.StringIO()
+        handler = QueuedStreamHandler(stream=stream)
+        handler.setFormatter(StructuredFormatter('%(message)s', as_json=True))
+        handler.handle(self.make_record(request_id='abc'))
+        handler.close()
+        
+        payload = json.loads(stream.getvalue())
+        self.assertEqual(payload['message'], '消息 a')
+        self.assertEqual(payload['request_id'], 'abc')
+    
+    def test_queued_handler_starts_after_fork(self):
+        """测试后台线程在首次写日志时启动，fork 出的子进程（pid 变化）中换用新队列重新启动"""
+        import io
+        from .logging_utils import QueuedStreamHandler
+        
+        stream = io.StringIO()
+        handler = QueuedStreamHandler(stream=stream)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        self.assertIsNone(handler.listener)
+        
+        handler.handle(self.make_record())
+        parent_listener, parent_queue = handler.listener, handler.queue
+        self.assertIsNotNone(parent_listener)
+        
+        with mock.patch('contentgenerater.logging_utils.os.getpid', return_value=os.getpid() + 1):
+            handler.handle(self.make_record())
+            self.assertIsNot(handler.listener, parent_listener)
+            self.assertIsNot(handler.queue, parent_queue)
+            handler.close()
+        parent_listener.stop()
+        
+        self.assertEqual(stream.getvalue(), '消息 a\n消息 a\n')
+
+
+class StreamPumpTestCase(TestCase):
+    """上游读取与客户端写入解耦测试用例"""
+    
+    def setUp(self):
+        from .semantic_cache import generation_cache
+        generation_cache.clear()
+    
+    @staticmethod
+    async def upstream(count=50):
+        for i in range(count):
+            yield f"{i},"
+    
+    def test_coalesce_drains_upstream_for_slow_client(self):
+        """测试客户端不读取时上游也能读完，溢出块被合并且内容不丢失"""
+        import time
+        from .metrics import metrics
+        from .stream_buffer import StreamPump
+        
+        lagging = metrics.get_counter('stream_clients_lagging_total', policy='coalesce')
+        pump = StreamPump(self.upstream(), high_water=4, policy='coalesce').start()
+        deadline = time.monotonic() + 5
+        while not pump._finished and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(pump._finished)
+        
+        self.assertEqual(''.join(pump), ''.join(f"{i}," for i in range(50)))
+        self.assertLessEqual(pump.max_depth, 4)
+        self.assertGreater(pump.overflows, 0)
+        self.assertEqual(metrics.get_counter('stream_clients_lagging_total', policy='coalesce'), lagging + 1)
+    
+    @mock.patch('contentgenerater.views.get_ai_generator', FakeAIGenerator)
+    def test_generate_stream_through_pump(self):
+        """测试生成接口经缓冲区完整转发上游内容"""
+        response = self.client.post(
+            '/api/generate-stream',
+            data=json.dumps({'theme': '测试主题', 'content': '测试内容'}),
+            content_type='application/json'
         )
-        loop.close()
+        events = [
+            json.loads(line[6:]) for line in b''.join(response.streaming_content).decode('utf-8').split('\n')
+            if line.startswith('data: {')
+        ]
+        self.assertEqual(''.join(e.get('content', '') for e in events), FakeAIGenerator.ARTICLE)
+        self.assertTrue(any('articleId' in e for e in events))
+    
+    def test_block_and_abort_policies(self):
+        """测试 block 策略不丢数据，abort 策略中止生成"""
+        import time
+        from .stream_buffer import BufferOverflowError, StreamPump
+        
+        self.assertEqual(len(list(StreamPump(self.upstream(), high_water=2, policy='block'))), 50)
         
-        self.assertIn('markdown', result)
-        self.assertIn('测试标题', result['markdown'])
-        self.assertIn('keywords', result)
-        self.assertIsInstance(result['keywords'], list)
+        pump = StreamPump(self.upstream(), high_water=2, policy='abort').start()
+        time.sleep(0.1)
+        with self.assertRaises(BufferOverflowError):
+            list(pump)
     
-    def test_get_ai_generator(self):
-        """测试获取 AI 生成器"""
-        from .ai_service import get_ai_generator, MockAIGenerator
+    async def test_iterate_in_thread_closes_db_connection(self):
+        """测试迭代线程结束时关闭自己打开的数据库连接"""
+        import threading
+        from django.db import connections
+        from .stream_buffer import iterate_in_thread
+        
+        threads = []
+        closed = []
+        
+        def items():
+            threads.append(threading.current_thread())
+            yield 'data'
+        
+        # 测试使用的内存 SQLite 连接不会真正关闭，这里检查关闭发生在迭代线程中
+        with mock.patch.object(connections, 'close_all', lambda: closed.append(threading.current_thread())):
+            self.assertEqual([item async for item in iterate_in_thread(items())], ['data'])
+        self.assertEqual(closed, threads)
+
+
+
+class TracingTestCase(TestCase):
+    """请求追踪测试用例"""
+    
+    def setUp(self):
+        from . import tracing
+        from .semantic_cache import generation_cache
+        
+        generation_cache.clear()
+        self.exported = []
+        exporter = tracing.SpanExporter()
+        exporter.export = lambda span: self.exported.append(span.to_dict())
+        patchers = [
+            mock.patch.object(tracing, '_exporter', exporter),
+            mock.patch('contentgenerater.config.TRACE_SAMPLE_RATE', 1.0),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+    
+    def test_generate_stream_spans_and_request_id(self):
+        """测试请求 ID 写入响应头，后台事件循环中的 span 归属同一 trace"""
+        from .tracing import span
+        
+        class TracedGenerator(FakeAIGenerator):
+            async def generate_content_stream(self, *args, **kwargs):
+                with span('ai.generate'):
+                    async for chunk in super().generate_content_stream(*args, **kwargs):
+                        yield chunk
+        
+        with mock.patch('contentgenerater.views.get_ai_generator', TracedGenerator):
+            response = self.client.post(
+                '/api/generate-stream',
+                data=json.dumps({'theme': '测试主题', 'content': '测试内容'}),
+                content_type='application/json',
+                HTTP_X_REQUEST_ID='req-123',
+            )
+            b''.join(response.streaming_content)
+        
+        self.assertEqual(response['X-Request-ID'], 'req-123')
+        spans = {item['name']: item for item in self.exported}
+        root = spans['generate_content_stream']
+        self.assertEqual(root['attributes']['request_id'], 'req-123')
+        self.assertIsNone(root['parent_id'])
+        for name in ('request.parse', 'ai.generate', 'article.store'):
+            self.assertEqual(spans[name]['trace_id'], root['trace_id'])
+            self.assertEqual(spans[name]['parent_id'], root['span_id'])
+    
+    def test_traceparent_filter_and_export(self):
+        """测试沿用上游 traceparent、日志附加请求 ID 以及 JSONL / OTLP 导出格式"""
+        import os
+        import tempfile
+        from .tracing import RequestIdFilter, SpanExporter, request_trace, span, to_otlp
+        
+        traceparent = '00-' + 'a' * 32 + '-' + 'b' * 16 + '-01'
+        record = logging.LogRecord('contentgenerater.test', logging.INFO, __file__, 1, '消息', (), None)
+        with request_trace('root', 'req-1', traceparent):
+            with span('child', size=3) as child:
+                RequestIdFilter().filter(record)
+        self.assertEqual(record.request_id, 'req-1')
+        self.assertEqual(record.trace_id, 'a' * 32)
+        self.assertEqual(child.trace_id, 'a' * 32)
+        self.assertEqual(self.exported[-1]['parent_id'], 'b' * 16)
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'traces.jsonl')
+            SpanExporter(kind='file', file_path=path).flush_batch(self.exported)
+            with open(path, encoding='utf-8') as f:
+                self.assertEqual([json.loads(line)['name'] for line in f], ['child', 'root'])
+        
+        otlp_spans = to_otlp(self.exported)['resourceSpans'][0]['scopeSpans'][0]['spans']
+        self.assertEqual(otlp_spans[0]['attributes'], [{'key': 'size', 'value': {'intValue': '3'}}])
+
+
+class ProfilingTestCase(TestCase):
+    """按请求性能剖析测试用例"""
+    
+    def setUp(self):
+        import tempfile
+        
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.directory = tmp.name
+        patchers = [
+            mock.patch('contentgenerater.config.PROFILE_DIR', self.directory),
+            mock.patch('contentgenerater.config.PROFILE_TOKEN', 'secret'),
+            mock.patch('contentgenerater.config.PROFILE_SAMPLE_RATE', 0.0),
+            mock.patch('contentgenerater.config.ENABLE_CACHE', False),
+            mock.patch('contentgenerater.views.get_ai_generator', FakeAIGenerator),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+    
+    def generate(self, **headers):
+        response = self.client.post(
+            '/api/generate-stream',
+            data=json.dumps({'theme': '测试主题', 'content': '测试内容'}),
+            content_type='application/json',
+            **headers
+        )
+        return b''.join(response.streaming_content).decode('utf-8')
+    
+    def test_profile_with_token(self):
+        """测试带正确令牌的请求被剖析（含后台事件循环中的步骤），错误令牌不剖析"""
+        from .profiling import list_profiles
+        
+        self.generate(HTTP_X_PROFILE_TOKEN='wrong')
+        self.assertEqual(list_profiles(), [])
+        
+        content = self.generate(HTTP_X_PROFILE_TOKEN='secret', HTTP_X_REQUEST_ID='prof-1')
+        self.assertIn('[DONE]', content)
+        
+        profiles = list_profiles()
+        self.assertEqual(len(profiles), 1)
+        meta = profiles[0]
+        self.assertEqual((meta['request_id'], meta['reason'], meta['status']), ('prof-1', 'header', 'ok'))
+        self.assertGreater(meta['async_steps'], 0)
+        self.assertIsNotNone(meta['stats_path'])
+    
+    def test_profiles_command(self):
+        """测试管理命令列出并汇总剖析结果"""
+        import io
+        from django.core.management import call_command
+        
+        self.generate(HTTP_X_PROFILE_TOKEN='secret', HTTP_X_REQUEST_ID='prof-2')
+        
+        out = io.StringIO()
+        call_command('profiles', stdout=out)
+        self.assertIn('prof-2', out.getvalue())
+        
+        out = io.StringIO()
+        call_command('profiles', show='prof-2', stdout=out)
+        self.assertIn('event_stream', out.getvalue())
+
+
+class TenantCredentialsTestCase(TestCase):
+    """自带密钥与租户连接池测试用例"""
+    
+    API_KEY = 'sk-tenant-secret-123456'
+    
+    def setUp(self):
+        from .circuit_breaker import tenant_breakers
+        from .semantic_cache import generation_cache
+        generation_cache.clear()
+        tenant_breakers.clear()
+        patchers = [
+            mock.patch('contentgenerater.config.AI_BYOK_ENABLED', True),
+            mock.patch('contentgenerater.config.AI_BYOK_ALLOWED_HOSTS', []),
+            mock.patch('contentgenerater.config.CUSTOM_AI_MODEL', 'default-model'),
+            mock.patch('contentgenerater.ai_service._resolve_host', self.resolve),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+    
+    # 测试中不访问 DNS
+    HOSTS = {
+        'api.example.com': ['93.184.216.34'],
+        'other.example.com': ['93.184.216.35'],
+        'rebind.example.com': ['93.184.216.34', '10.1.2.3'],
+        'metadata.example.com': ['169.254.169.254'],
+        'v6.example.com': ['::1'],
+    }
+    
+    @classmethod
+    def resolve(cls, hostname):
+        if hostname not in cls.HOSTS:
+            raise OSError('unknown host')
+        return cls.HOSTS[hostname]
+    
+    def credentials(self, base_url='https://api.example.com/v1', key=None):
+        from .ai_service import UpstreamCredentials
+        return UpstreamCredentials(base_url, key or self.API_KEY, 'm')
+    
+    def test_parse_credentials(self):
+        """测试凭据校验，错误信息和 repr 中不出现密钥"""
+        from .ai_service import parse_credentials
+        
+        self.assertIsNone(parse_credentials({}))
+        credentials = parse_credentials({'X-AI-API-Key': self.API_KEY, 'X-AI-Base-URL': 'https://api.example.com/v1/'})
+        self.assertEqual((credentials.base_url, credentials.model), ('https://api.example.com/v1', 'default-model'))
+        self.assertNotIn(self.API_KEY, repr(credentials))
+        
+        invalid = [
+            {'X-AI-API-Key': 'short'},
+            {'X-AI-API-Key': self.API_KEY, 'X-AI-Base-URL': 'http://10.0.0.1/v1'},
+            {'X-AI-API-Key': self.API_KEY, 'X-AI-Base-URL': 'https://user:pw@api.example.com'},
+            {'X-AI-API-Key': self.API_KEY, 'X-AI-Base-URL': 'https://api.example.com', 'X-AI-Model': 'bad model'},
+        ]
+        for headers in invalid:
+            with self.assertRaises(ValueError) as ctx:
+                parse_credentials(headers)
+            self.assertNotIn(self.API_KEY, str(ctx.exception))
+        
+        with mock.patch('contentgenerater.config.AI_BYOK_ALLOWED_HOSTS', ['api.example.com']):
+            with self.assertRaises(ValueError):
+                parse_credentials({'X-AI-API-Key': self.API_KEY, 'X-AI-Base-URL': 'https://other.example.com'})
+        with mock.patch('contentgenerater.config.AI_BYOK_ENABLED', False):
+            with self.assertRaises(ValueError):
+                parse_credentials({'X-AI-API-Key': self.API_KEY})
+    
+    def test_reject_internal_hosts(self):
+        """测试未配置允许列表时拒绝 IP 地址、localhost 和解析到内网的域名"""
+        from .ai_service import parse_credentials
+        
+        internal = [
+            'https://127.0.0.1:8000/v1',
+            'https://localhost/v1',
+            'https://api.localhost/v1',
+            'https://169.254.169.254',
+            'https://10.0.0.1/v1',
+            'https://[::1]/v1',
+            'https://metadata.example.com/v1',
+            'https://rebind.example.com/v1',
+            'https://v6.example.com/v1',
+            'https://unresolvable.example.com/v1',
+        ]
+        for base_url in internal:
+            with self.subTest(base_url=base_url):
+                with self.assertRaises(ValueError):
+                    parse_credentials({'X-AI-API-Key': self.API_KEY, 'X-AI-Base-URL': base_url})
+        
+        self.assertIsNotNone(parse_credentials({'X-AI-API-Key': self.API_KEY, 'X-AI-Base-URL': 'https://other.example.com/v1'}))
+        # 管理员明确允许的主机不再检查
+        with mock.patch('contentgenerater.config.AI_BYOK_ALLOWED_HOSTS', ['10.0.0.1']):
+            self.assertIsNotNone(parse_credentials({'X-AI-API-Key': self.API_KEY, 'X-AI-Base-URL': 'https://10.0.0.1/v1'}))
+    
+    def test_tenant_client_verifies_tls(self):
+        """测试租户生成器的连接池校验 TLS 证书"""
+        from .ai_service import GeneratorPool
+        from .event_loop import background_loop
+        
+        generator = GeneratorPool(max_size=1, idle_timeout=60).get(self.credentials())
+        self.assertTrue(generator.verify)
+        
+        async def ssl_verify_mode():
+            import ssl
+            client = generator._get_client()
+            return client._transport._pool._ssl_context.verify_mode == ssl.CERT_REQUIRED
+        
+        self.assertTrue(background_loop.run(ssl_verify_mode()))
+    
+    def test_tenant_connection_rechecks_resolved_address(self):
+        """测试租户连接在建立时重新解析并检查地址，只连接公网地址（防止 DNS 重绑定）"""
+        import httpcore
+        from .ai_service import GeneratorPool
+        from .event_loop import background_loop
+        
+        generator = GeneratorPool(max_size=1, idle_timeout=60).get(self.credentials())
+        
+        async def connect(host):
+            backend = generator._get_client()._transport._pool._network_backend
+            with mock.patch.object(backend._backend, 'connect_tcp', mock.AsyncMock(return_value='stream')) as inner:
+                await backend.connect_tcp(host, 443)
+            return inner.call_args
+        
+        self.assertEqual(background_loop.run(connect('api.example.com')).args, ('93.184.216.34', 443))
+        # 校验请求头之后域名改指内网
+        with mock.patch.dict(self.HOSTS, {'api.example.com': ['127.0.0.1']}):
+            with self.assertRaises(httpcore.ConnectError):
+                background_loop.run(connect('api.example.com'))
+    
+    def test_pool_lru_and_idle_eviction(self):
+        """测试同一租户复用生成器，超过容量或空闲时关闭连接池，进行中的请求结束后再关闭"""
+        from .ai_service import GeneratorPool
+        from .event_loop import background_loop
+        
+        pool = GeneratorPool(max_size=2, idle_timeout=60)
+        first = pool.get(self.credentials(key='sk-tenant-aaaaaaaa'))
+        self.assertIs(pool.get(self.credentials(key='sk-tenant-aaaaaaaa')), first)
+        background_loop.run(self._open_client(first))
+        
+        pool.get(self.credentials(key='sk-tenant-bbbbbbbb'))
+        pool.get(self.credentials(key='sk-tenant-cccccccc'))
+        background_loop.run(asyncio.sleep(0.05))
+        self.assertEqual(pool.stats()['pools'], 2)
+        self.assertIsNone(first._client)
+        
+        pool.idle_timeout = 0
+        busy = pool.get(self.credentials(key='sk-tenant-dddddddd'))
+        busy.active_streams = 1
+        pool.sweep()
+        self.assertEqual(pool.stats()['pools'], 1)
+        busy.active_streams = 0
+        self.assertEqual(pool.sweep(), 1)
+    
+    def test_tenant_breaker_survives_eviction(self):
+        """测试租户熔断器按 (地址, 密钥) 区分并在生成器重建后保留，指标与同一地址的服务端熔断器分开"""
+        from .ai_service import CustomAIGenerator, GeneratorPool
+        from .metrics import metrics
+        
+        server = CustomAIGenerator('https://api.example.com/v1', 'sk-server-key', 'm')
+        pool = GeneratorPool(max_size=1, idle_timeout=60)
+        tenant = pool.get(self.credentials(key='sk-tenant-aaaaaaaa'))
+        self.assertIsNot(tenant.breaker, server.breaker)
+        self.assertIsNot(tenant.breaker, pool.get(self.credentials(key='sk-tenant-bbbbbbbb')).breaker)
+        
+        for _ in range(tenant.breaker.failure_threshold):
+            tenant.breaker.record_failure()
+        key_id = self.credentials(key='sk-tenant-aaaaaaaa').key_id
+        self.assertEqual(metrics.get_gauge('circuit_state', upstream='api.example.com', key_id=key_id), 2)
+        self.assertEqual(metrics.get_gauge('circuit_state', upstream='api.example.com'), 0)
+        
+        # 被 LRU 移除后重建的生成器沿用原熔断器
+        recreated = pool.get(self.credentials(key='sk-tenant-aaaaaaaa'))
+        self.assertIsNot(recreated, tenant)
+        self.assertIs(recreated.breaker, tenant.breaker)
+        self.assertEqual(recreated.breaker.state, 'open')
+    
+    def test_idle_pools_swept_without_new_requests(self):
+        """测试没有新的租户请求时，空闲的生成器也会在后台被定期移除并关闭连接池"""
+        from .ai_service import GeneratorPool
+        from .event_loop import background_loop
+        
+        pool = GeneratorPool(max_size=2, idle_timeout=0.1)
+        generator = pool.get(self.credentials(key='sk-tenant-aaaaaaaa'))
+        background_loop.run(self._open_client(generator))
+        for _ in range(100):
+            if generator._client is None:
+                break
+            time.sleep(0.02)
+        self.assertEqual(pool.stats()['pools'], 0)
+        self.assertIsNone(generator._client)
+        self.assertIsNone(pool._sweeper_pid)
+    
+    @staticmethod
+    async def _open_client(generator):
+        generator._get_client()
+    
+    def test_generate_stream_with_tenant_key(self):
+        """测试生成接口使用租户凭据，日志中不出现密钥"""
+        calls = []
+        
+        def fake_tenant_generator(credentials):
+            calls.append(credentials)
+            return FakeAIGenerator()
+        
+        with mock.patch('contentgenerater.views.get_tenant_generator', fake_tenant_generator), \
+                self.assertLogs('contentgenerater', level='DEBUG') as logs:
+            response = self.client.post(
+                '/api/generate-stream',
+                data=json.dumps({'theme': '测试主题', 'content': '测试内容'}),
+                content_type='application/json',
+                HTTP_X_AI_API_KEY=self.API_KEY,
+                HTTP_X_AI_BASE_URL='https://api.example.com/v1',
+            )
+            content = b''.join(response.streaming_content).decode('utf-8')
+        
+        self.assertIn('[DONE]', content)
+        self.assertEqual(calls[0].api_key, self.API_KEY)
+        self.assertFalse(any(self.API_KEY in line for line in logs.output))
+        
+        response = self.client.post(
+            '/api/generate-stream',
+            data=json.dumps({'theme': '测试主题', 'content': '测试内容'}),
+            content_type='application/json',
+            HTTP_X_AI_API_KEY='bad key',
+        )
+        # 第一个事件是 accepted 预告
+        event = json.loads(b''.join(response.streaming_content).decode('utf-8').split('\n\n')[1][6:])
+        self.assertEqual(event['error'], 'API 密钥格式不正确')
+
+
+class JSONRepairTestCase(TestCase):
+    """容错 JSON 修复测试用例（testdata/json_repair 中每个 .txt 为一次真实的失败输出，.json 为期望结果）"""
+    
+    CORPUS_DIR = os.path.join(os.path.dirname(__file__), 'testdata', 'json_repair')
+    
+    def test_corpus(self):
+        """测试语料中的每个用例"""
+        from .json_repair import JSONRepairError, repair_json
+        
+        names = sorted(f[:-4] for f in os.listdir(self.CORPUS_DIR) if f.endswith('.txt'))
+        self.assertGreater(len(names), 0)
+        for name in names:
+            with self.subTest(case=name):
+                with open(os.path.join(self.CORPUS_DIR, name + '.txt'), encoding='utf-8') as f:
+                    text = f.read()
+                with open(os.path.join(self.CORPUS_DIR, name + '.json'), encoding='utf-8') as f:
+                    expected = json.load(f)
+                
+                if expected is None:
+                    with self.assertRaises(JSONRepairError):
+                        repair_json(text)
+                    continue
+                data, repaired = repair_json(text)
+                self.assertEqual(data, expected)
+                self.assertEqual(repaired, not name.startswith('strict_'))
+    
+    def test_repair_rate_metric(self):
+        """测试解析结果计数和修复率"""
+        from .metrics import metrics
+        from .streaming_renderer import extract_json_from_text
+        
+        metrics.reset()
+        extract_json_from_text('{"title": "a"}')
+        extract_json_from_text('{"title": "a",}')
+        with self.assertRaises(ValueError):
+            extract_json_from_text('没有 JSON')
+        
+        self.assertEqual(metrics.get_counter('json_parse_total', result='repaired'), 1)
+        self.assertEqual(metrics.get_gauge('json_repair_rate'), round(1 / 3, 4))
+    
+    def test_render_truncated_output(self):
+        """测试被截断的输出仍渲染已完成的章节"""
+        from .streaming_renderer import stream_render_from_ai
+        
+        async def truncated():
+            yield '{"title": "标题", "sections": [{"title": "第一节", "items": ["要点一"]}, '
+            yield '{"title": "第二节", "items": ["要点'
+        
+        async def render():
+            return ''.join([part async for part in stream_render_from_ai(truncated())])
+        
+        html = asyncio.run(render())
+        self.assertIn('01 第一节', html)
+        self.assertIn('02 第二节', html)
+        self.assertNotIn('格式错误', html)
+    
+    def test_non_object_output_is_format_error(self):
+        """测试顶层不是 JSON 对象的输出按格式错误处理，而不是渲染出错"""
+        from .streaming_renderer import extract_json_from_text, stream_render_from_ai
+        
+        for text in ('[{"title": "标题"}]', '"标题"', '42'):
+            with self.assertRaises(ValueError):
+                extract_json_from_text(text)
+        
+        async def array():
+            yield '[{"title": "标题"}]'
+        
+        async def render():
+            return ''.join([part async for part in stream_render_from_ai(array())])
+        
+        html = asyncio.run(render())
+        self.assertIn('格式错误', html)
+        self.assertNotIn('渲染错误', html)
+
+
+class SchemaGuardTestCase(TestCase):
+    """流式格式校验测试用例"""
+    
+    def test_validator(self):
+        """测试说明文字、多余字段和类型错误被尽早发现，合法开头被确认"""
+        from .schema_guard import SchemaDivergence, StreamSchemaValidator
+        
+        validator = StreamSchemaValidator('normal')
+        validator.feed('```json\n{"ti')
+        self.assertFalse(validator.committed)
+        validator.feed('tle": "标题", "sections": [')
+        self.assertTrue(validator.committed)
+        validator.feed('{"title": "a", "messages": []}], "messages": []}')
+        self.assertEqual(len(validator.violations), 1)
+        
+        diverging = [
+            ('normal', '好的，下面我来为你介绍一下这个主题。首先我们需要了解的是它的历史背景和发展过程，然后再', 'prose'),
+            ('normal', '{"messages": [', 'unexpected_key'),
+            ('wechat', '{"title": "t", "messages": "', 'wrong_type'),
+            ('normal', '[{"title"', 'not_object'),
+        ]
+        for template_type, text, reason in diverging:
+            with self.subTest(reason=reason):
+                validator = StreamSchemaValidator(template_type, commit_keys=2)
+                with self.assertRaises(SchemaDivergence) as ctx:
+                    validator.feed(text)
+                self.assertEqual(ctx.exception.reason, reason)
+    
+    def test_abort_and_retry(self):
+        """测试偏离格式时中止上游并重试，客户端只收到合法的输出"""
+        from .ai_service import CustomAIGenerator
+        from .event_loop import background_loop
+        
+        outputs = [
+            ['{"mess', 'ages": [', '{"nickname": "a"}', '...' * 50],
+            ['{"title": ', '"标题", ', '"sections": []}'],
+        ]
+        consumed = []
+        
+        class ScriptedGenerator(CustomAIGenerator):
+            async def _stream_chat(self, messages, temperature=0.7, max_tokens=2000, deadline=None, template=None):
+                attempt = outputs[len(consumed)]
+                consumed.append(0)
+                for chunk in attempt:
+                    consumed[-1] += 1
+                    yield chunk
+        
+        async def collect(generator):
+            return [chunk async for chunk in generator.generate_content_stream('主题', '内容')]
+        
+        generator = ScriptedGenerator('https://api.example.com', 'sk-test-key', 'm')
+        chunks = background_loop.run(collect(generator))
+        self.assertEqual(''.join(chunks), ''.join(outputs[1]))
+        self.assertEqual(consumed, [2, 3])
+        
+        outputs[1] = outputs[0]
+        consumed.clear()
+        with self.assertRaises(Exception) as ctx:
+            background_loop.run(collect(generator))
+        self.assertIn('格式', str(ctx.exception))
+
+
+class DeadlineTestCase(TestCase):
+    """上游时间预算测试用例"""
+    
+    def setUp(self):
+        from .semantic_cache import generation_cache
+        generation_cache.clear()
+    
+    @staticmethod
+    def make_generator(delays):
+        """模拟上游：delays 为每个 token 之前的等待秒数"""
+        import httpx
+        from .ai_service import CustomAIGenerator
+        
+        async def body():
+            for i, delay in enumerate(delays):
+                await asyncio.sleep(delay)
+                chunk = {"choices": [{"delta": {"content": f"{{\"title\": \"{i}" if i == 0 else str(i)}}]}
+                yield f"data: {json.dumps(chunk)}\n\n".encode('utf-8')
+            yield b"data: [DONE]\n\n"
+        
+        generator = CustomAIGenerator('https://api.example.com', 'sk-test-key', 'm')
+        transport = httpx.MockTransport(lambda request: httpx.Response(200, content=body()))
+        generator._client = httpx.AsyncClient(transport=transport)
+        return generator
+    
+    def collect(self, generator):
+        from .event_loop import background_loop
+        
+        async def run():
+            return [chunk async for chunk in generator._stream_chat([])]
+        return background_loop.run(run())
+    
+    @mock.patch('contentgenerater.config.AI_FIRST_TOKEN_TIMEOUT', 0.2)
+    @mock.patch('contentgenerater.config.AI_STALL_TIMEOUT', 0.2)
+    def test_first_token_and_stall(self):
+        """测试首 token 超时与 token 间停滞分别被识别"""
+        from .deadlines import DeadlineExceeded
+        
+        self.assertEqual(len(self.collect(self.make_generator([0, 0.05, 0.05]))), 3)
+        
+        for delays, phase in (([0.5], 'first_token'), ([0, 0.05, 0.5], 'stall')):
+            with self.subTest(phase=phase):
+                with self.assertRaises(DeadlineExceeded) as ctx:
+                    self.collect(self.make_generator(delays))
+                self.assertEqual(ctx.exception.phase, phase)
+    
+    @mock.patch('contentgenerater.config.GENERATION_TIMEOUT', 0.3)
+    @mock.patch('contentgenerater.config.AI_STALL_TIMEOUT', 0.2)
+    def test_total_deadline_sse_error(self):
+        """测试超过总时长时发送明确的 SSE 错误事件，且不保存不完整的文章"""
+        generator = self.make_generator([0] + [0.1] * 10)
+        with mock.patch('contentgenerater.views.get_ai_generator', lambda: generator):
+            response = self.client.post(
+                '/api/generate-stream',
+                data=json.dumps({'theme': '测试主题', 'content': '测试内容'}),
+                content_type='application/json'
+            )
+            content = b''.join(response.streaming_content).decode('utf-8')
+        
+        events = [json.loads(line[6:]) for line in content.split('\n') if line.startswith('data: {')]
+        errors = [e for e in events if 'error' in e]
+        self.assertEqual(len(errors), 1)
+        self.assertEqual((errors[0]['code'], errors[0]['phase'], errors[0]['retryable']), ('deadline_exceeded', 'total', True))
+        self.assertFalse(any('articleId' in e for e in events))
+        self.assertTrue(content.endswith('data: [DONE]\n\n'))
+
+
+class CircuitBreakerTestCase(TestCase):
+    """上游熔断器测试用例"""
+    
+    def setUp(self):
+        from .semantic_cache import generation_cache
+        generation_cache.clear()
+    
+    @staticmethod
+    def make_generator(responses):
+        """模拟上游：responses 为依次返回的状态码，200 时输出一个 token"""
+        import httpx
+        from .ai_service import CustomAIGenerator
+        
+        statuses = iter(responses)
+        calls = []
+        
+        def handler(request):
+            calls.append(request)
+            code = next(statuses)
+            if code != 200:
+                return httpx.Response(code, content=b'{}')
+            chunk = {"choices": [{"delta": {"content": '{"title": "ok"}'}}]}
+            return httpx.Response(200, content=f"data: {json.dumps(chunk)}\n\ndata: [DONE]\n\n".encode('utf-8'))
+        
+        generator = CustomAIGenerator('https://api.example.com', 'sk-test-key', 'm')
+        generator._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        return generator, calls
+    
+    def collect(self, generator):
+        from .event_loop import background_loop
+        
+        async def run():
+            return [chunk async for chunk in generator._stream_chat([])]
+        return background_loop.run(run())
+    
+    def test_state_transitions(self):
+        """测试连续失败打开、打开期间快速失败、半开探测成功后关闭"""
+        from .circuit_breaker import CircuitBreaker, CircuitOpenError
+        
+        breaker = CircuitBreaker('test', failure_threshold=3, error_rate=0, open_seconds=0.1)
+        for _ in range(3):
+            self.assertFalse(breaker.before_call())
+            breaker.record_failure()
+        self.assertEqual(breaker.state, 'open')
+        with self.assertRaises(CircuitOpenError) as ctx:
+            breaker.before_call()
+        self.assertTrue(ctx.exception.retryable)
+        self.assertGreater(ctx.exception.retry_after, 0)
+        
+        time.sleep(0.15)
+        self.assertTrue(breaker.before_call())
+        self.assertEqual(breaker.state, 'half_open')
+        # 探测期间其他请求仍被拒绝
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+        breaker.record_success()
+        self.assertEqual(breaker.state, 'closed')
+        self.assertFalse(breaker.before_call())
+    
+    def test_error_rate_and_probe_release(self):
+        """测试按窗口错误率打开，以及被取消的探测请求归还名额"""
+        from .circuit_breaker import CircuitBreaker, CircuitOpenError
+        
+        breaker = CircuitBreaker('test', failure_threshold=0, error_rate=0.5, min_requests=4, open_seconds=0.05)
+        breaker.record_success()
+        breaker.record_failure()
+        breaker.record_success()
+        self.assertEqual(breaker.state, 'closed')
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'open')
+        
+        time.sleep(0.08)
+        probe = breaker.before_call()
+        breaker.release(probe)
+        self.assertTrue(breaker.before_call())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'open')
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+    
+    @mock.patch('contentgenerater.config.CIRCUIT_FAILURE_THRESHOLD', 2)
+    @mock.patch('contentgenerater.config.CIRCUIT_OPEN_SECONDS', 30)
+    def test_upstream_errors_open_circuit(self):
+        """测试 5xx 计入失败、4xx 不计入，打开后不再请求上游"""
+        from .ai_service import UpstreamStatusError
+        from .circuit_breaker import CircuitOpenError
+        
+        generator, calls = self.make_generator([400, 503, 503])
+        for expected in (400, 503, 503):
+            with self.assertRaises(UpstreamStatusError) as ctx:
+                self.collect(generator)
+            self.assertEqual(ctx.exception.status_code, expected)
+        self.assertEqual(generator.status()['circuit']['state'], 'open')
+        
+        with self.assertRaises(CircuitOpenError):
+            self.collect(generator)
+        self.assertEqual(len(calls), 3)
+    
+    @mock.patch('contentgenerater.config.CIRCUIT_FAILURE_THRESHOLD', 1)
+    @mock.patch('contentgenerater.config.CIRCUIT_OPEN_SECONDS', 30)
+    def test_sse_error_when_open(self):
+        """测试熔断打开时 SSE 错误事件带错误码、可重试标记和重试等待时间"""
+        generator, calls = self.make_generator([503])
+        with mock.patch('contentgenerater.views.get_ai_generator', lambda: generator):
+            errors = []
+            for _ in range(2):
+                response = self.client.post(
+                    '/api/generate-stream',
+                    data=json.dumps({'theme': '测试主题', 'content': '测试内容'}),
+                    content_type='application/json'
+                )
+                content = b''.join(response.streaming_content).decode('utf-8')
+                events = [json.loads(line[6:]) for line in content.split('\n') if line.startswith('data: {')]
+                errors.extend(e for e in events if 'error' in e)
+        
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(errors), 2)
+        self.assertNotIn('code', errors[0])
+        self.assertEqual((errors[1]['code'], errors[1]['retryable']), ('circuit_open', True))
+        self.assertGreaterEqual(errors[1]['retry_after'], 1)
+
+
+class VariantsTestCase(TestCase):
+    """多版本生成测试用例"""
+    
+    ARTICLES = [
+        {"title": f"版本{i}", "intro": "简介", "sections": [{"title": "版块", "items": ["要点"]}], "footer": "结语"}
+        for i in range(3)
+    ]
+    
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+    
+    def make_generator(self, handler):
+        import httpx
+        from .ai_service import CustomAIGenerator
+        
+        requests = []
+        
+        def record(request):
+            requests.append(json.loads(request.content))
+            return handler(requests[-1], len(requests))
+        
+        generator = CustomAIGenerator('https://api.example.com', 'sk-test-key', 'm')
+        generator._client = httpx.AsyncClient(transport=httpx.MockTransport(record))
+        return generator, requests
+    
+    @staticmethod
+    def sse(choices):
+        """choices: [(choice 序号, 文本)]，按 8 个字符切块交错输出"""
+        import httpx
+        
+        lines = []
+        offset = 0
+        while any(offset < len(text) for _, text in choices):
+            for index, text in choices:
+                if offset < len(text):
+                    chunk = {"choices": [{"index": index, "delta": {"content": text[offset:offset + 8]}}]}
+                    lines.append(f"data: {json.dumps(chunk)}\n\n")
+            offset += 8
+        lines.append("data: [DONE]\n\n")
+        return httpx.Response(200, content=''.join(lines).encode('utf-8'))
+    
+    def collect(self, generator, variants):
+        from .event_loop import background_loop
+        
+        async def run():
+            texts = {}
+            async for index, item in generator.generate_variants_stream('主题', '内容', [], 'normal', variants):
+                self.assertIsInstance(item, str)
+                texts[index] = texts.get(index, '') + item
+            return {index: json.loads(text) for index, text in texts.items()}
+        return background_loop.run(run())
+    
+    def test_single_call_with_n(self):
+        """测试使用 n 参数一次调用返回多个版本，偏离格式的版本单独补生成"""
+        def handler(payload, count):
+            if count == 1:
+                return self.sse([
+                    (0, json.dumps(self.ARTICLES[0], ensure_ascii=False)),
+                    (1, "好的，下面是为您生成的文章内容，希望能够满足您的需求。文章围绕主题展开，分为多个版块，如有需要请随时告诉我。"),
+                    (2, json.dumps(self.ARTICLES[2], ensure_ascii=False)),
+                ])
+            return self.sse([(0, json.dumps(self.ARTICLES[1], ensure_ascii=False))])
+        
+        generator, requests = self.make_generator(handler)
+        results = self.collect(generator, 3)
+        
+        self.assertEqual(results, dict(enumerate(self.ARTICLES)))
+        self.assertEqual(requests[0]['n'], 3)
+        self.assertEqual(len(requests), 2)
+        self.assertNotIn('n', requests[1])
+        self.assertTrue(generator.supports_n)
+    
+    def test_fallback_when_n_rejected(self):
+        """测试上游拒绝 n 参数时改为并发调用"""
+        import httpx
+        
+        def handler(payload, count):
+            if 'n' in payload:
+                return httpx.Response(400, content=b'{}')
+            return self.sse([(0, json.dumps(self.ARTICLES[count % 3], ensure_ascii=False))])
+        
+        generator, requests = self.make_generator(handler)
+        results = self.collect(generator, 2)
+        
+        self.assertEqual(len(results), 2)
+        self.assertFalse(generator.supports_n)
+        self.assertEqual(len(requests), 3)
+        
+        # 之后的请求直接并发调用
+        self.collect(generator, 2)
+        self.assertEqual(len(requests), 5)
+        self.assertFalse(any('n' in payload for payload in requests[3:]))
+    
+    @mock.patch('contentgenerater.views.get_ai_generator', FakeAIGenerator)
+    def test_variants_sse_and_group(self):
+        """测试多版本 SSE 事件带版本序号，并可按组读取"""
+        response = self.client.post(
+            '/api/generate-stream',
+            data=json.dumps({'theme': '测试主题', 'content': '测试内容', 'variants': 3}),
+            content_type='application/json'
+        )
+        content = b''.join(response.streaming_content).decode('utf-8')
+        events = [json.loads(line[6:]) for line in content.split('\n') if line.startswith('data: {')]
+        
+        for index in range(3):
+            text = ''.join(e['content'] for e in events if e.get('index') == index and 'content' in e)
+            self.assertEqual(text, FakeAIGenerator.ARTICLE)
+        self.assertEqual(sorted(e['index'] for e in events if 'articleId' in e), [0, 1, 2])
+        self.assertTrue(content.endswith('data: [DONE]\n\n'))
+        
+        group = [e for e in events if 'groupId' in e][0]
+        response = self.client.get(group['url'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['variants']), 3)
+        self.assertEqual(self.client.get('/api/variants/missing').status_code, 404)
+    
+    def test_variants_limit(self):
+        """测试版本数超过上限时返回参数错误"""
+        response = self.client.post(
+            '/api/generate-stream',
+            data=json.dumps({'theme': '测试主题', 'content': '测试内容', 'variants': 99}),
+            content_type='application/json'
+        )
+        content = b''.join(response.streaming_content).decode('utf-8')
+        self.assertIn('variants', json.loads(content.split('\n\n')[1][6:])['details'])
+
+
+class BudgetTestCase(TestCase):
+    """输入与 token 预算测试用例"""
+    
+    def setUp(self):
+        from .metrics import metrics
+        metrics.reset()
+    
+    def test_estimate_and_condense(self):
+        """测试 token 估算，以及压缩结果确定、去重并保留首尾"""
+        from .budget import TRIM_MARKER, condense, estimate_tokens
+        
+        self.assertEqual(estimate_tokens('你好，世界'), 5)
+        self.assertEqual(estimate_tokens('hello world!'), 3)
+        
+        self.assertEqual(condense('第一行   内容\n\n\n\n第一行 内容\n第二行', 100), '第一行 内容\n\n第二行')
+        
+        text = '开头一句。' + ''.join(f'中间第{i}句话。' for i in range(200)) + '结尾一句。'
+        condensed = condense(text, 300)
+        self.assertLessEqual(len(condensed), 300)
+        self.assertTrue(condensed.startswith('开头一句。'))
+        self.assertTrue(condensed.endswith('结尾一句。'))
+        self.assertIn(TRIM_MARKER, condensed)
+        self.assertEqual(condense(text, 300), condensed)
+    
+    @mock.patch('contentgenerater.config.MAX_CONTENT_LENGTH', 50)
+    def test_content_length_policy(self):
+        """测试内容描述超长时按配置拒绝或压缩"""
+        from .serializers import GenerateRequestSerializer
+        
+        data = {'theme': '主题', 'content': '很长的内容描述。' * 20}
+        with mock.patch('contentgenerater.config.CONTENT_OVERFLOW_POLICY', 'reject'):
+            serializer = GenerateRequestSerializer(data=data)
+            self.assertFalse(serializer.is_valid())
+            self.assertIn('content', serializer.errors)
+        with mock.patch('contentgenerater.config.CONTENT_OVERFLOW_POLICY', 'trim'):
+            serializer = GenerateRequestSerializer(data=data)
+            self.assertTrue(serializer.is_valid())
+            self.assertLessEqual(len(serializer.validated_data['content']), 50)
+    
+    @mock.patch('contentgenerater.config.AI_CONTEXT_WINDOW', 1000)
+    @mock.patch('contentgenerater.config.AI_MAX_OUTPUT_TOKENS', 800)
+    @mock.patch('contentgenerater.config.AI_MIN_OUTPUT_TOKENS', 200)
+    def test_fit_max_tokens(self):
+        """测试按上下文剩余空间调整 max_tokens，空间不足时拒绝，并记录提示词 token 数"""
+        from .budget import InputTooLarge, fit_max_tokens
+        from .metrics import metrics
+        
+        short = [{"role": "user", "content": "你好"}]
+        self.assertEqual(fit_max_tokens(short, template='normal')[1], 800)
+        
+        long = [{"role": "user", "content": "字" * 500}]
+        prompt_tokens, max_tokens = fit_max_tokens(long, template='normal')
+        self.assertLess(max_tokens, 800)
+        self.assertLessEqual(prompt_tokens + max_tokens, 1000)
+        
+        with self.assertRaises(InputTooLarge):
+            fit_max_tokens([{"role": "user", "content": "字" * 900}], template='normal')
+        self.assertEqual(metrics.get_distribution('prompt_tokens', template='normal')['count'], 3)
+    
+    @mock.patch('contentgenerater.config.AI_CONTEXT_WINDOW', 2000)
+    @mock.patch('contentgenerater.config.AI_MIN_OUTPUT_TOKENS', 200)
+    @mock.patch('contentgenerater.config.CONTENT_OVERFLOW_POLICY', 'trim')
+    def test_generator_fits_context(self):
+        """测试生成请求压缩内容描述以放进上下文，并据此设置 max_tokens"""
+        import httpx
+        from .ai_service import CustomAIGenerator
+        from .budget import count_message_tokens
+        from .event_loop import background_loop
+        
+        payloads = []
+        
+        def handler(request):
+            payloads.append(json.loads(request.content))
+            chunk = {"choices": [{"delta": {"content": FakeAIGenerator.ARTICLE}}]}
+            return httpx.Response(200, content=f"data: {json.dumps(chunk)}\n\ndata: [DONE]\n\n".encode('utf-8'))
+        
+        generator = CustomAIGenerator('https://api.example.com', 'sk-test-key', 'm')
+        generator._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        
+        async def run():
+            content = ''.join(f'第{i}段内容描述。' for i in range(400))
+            return ''.join([chunk async for chunk in generator.generate_content_stream('主题', content)])
+        
+        self.assertEqual(background_loop.run(run()), FakeAIGenerator.ARTICLE)
+        payload = payloads[0]
+        self.assertIn('……', payload['messages'][1]['content'])
+        self.assertGreaterEqual(payload['max_tokens'], 200)
+        self.assertLessEqual(count_message_tokens(payload['messages']) + payload['max_tokens'], 2000)
+
+
+class AdaptiveMaxTokensTestCase(TestCase):
+    """按观测到的输出长度自适应 max_tokens 测试用例"""
+    
+    def setUp(self):
+        from .budget import output_usage
+        
+        output_usage.clear()
+        self.addCleanup(output_usage.clear)
+        patcher = mock.patch('contentgenerater.config.ADAPTIVE_MAX_TOKENS_MIN_SAMPLES', 5)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def test_percentile_with_margin(self):
+        """测试样本足够后 max_tokens 取高分位数加余量，指定了 max_tokens 的调用不受影响"""
+        from .budget import fit_max_tokens, output_usage
+        
+        messages = [{"role": "user", "content": "内容"}]
+        for tokens in [600, 700, 800, 900]:
+            output_usage.record('wechat', tokens)
+        self.assertEqual(fit_max_tokens(messages, template='wechat')[1], 2000)
+        
+        output_usage.record('wechat', 1000)
+        self.assertEqual(fit_max_tokens(messages, template='wechat')[1], 1200)
+        self.assertEqual(fit_max_tokens(messages, template='normal')[1], 2000)
+        self.assertEqual(fit_max_tokens(messages, 800, template='wechat')[1], 800)
+        
+        # 不低于 AI_MIN_OUTPUT_TOKENS
+        for _ in range(5):
+            output_usage.record('optimize', 50)
+        self.assertEqual(fit_max_tokens(messages, template='optimize')[1], 512)
+        
+        with mock.patch('contentgenerater.config.ADAPTIVE_MAX_TOKENS', False):
+            self.assertEqual(fit_max_tokens(messages, template='wechat')[1], 2000)
+        
+        snapshot = output_usage.snapshot()['wechat']
+        self.assertEqual(snapshot['samples'], 5)
+        self.assertEqual(snapshot['p95'], 1000)
+        self.assertEqual(snapshot['max_tokens'], 1200)
+    
+    def test_truncation_continues(self):
+        """测试记录上游返回的 usage；在自适应上限处被截断时续写，客户端收到完整输出"""
+        import httpx
+        from .ai_service import CustomAIGenerator
+        from .budget import output_usage
+        from .event_loop import background_loop
+        from .metrics import metrics
+        
+        article = FakeAIGenerator.ARTICLE
+        cut = len(article) // 2
+        payloads = []
+        
+        def sse(text, finish_reason, completion_tokens):
+            chunks = [
+                {"choices": [{"index": 0, "delta": {"content": text}, "finish_reason": None}]},
+                {"choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}]},
+                {"choices": [], "usage": {"completion_tokens": completion_tokens}},
+            ]
+            return ''.join(f"data: {json.dumps(chunk)}\n\n" for chunk in chunks) + "data: [DONE]\n\n"
+        
+        def handler(request):
+            payload = json.loads(request.content)
+            payloads.append(payload)
+            if len(payloads) == 1:
+                return httpx.Response(200, content=sse(article[:cut], 'length', 540).encode('utf-8'))
+            return httpx.Response(200, content=sse(article[cut:], 'stop', 300).encode('utf-8'))
+        
+        generator = CustomAIGenerator('https://api.example.com', 'sk-test-key', 'm')
+        generator._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        
+        async def run():
+            return ''.join([chunk async for chunk in generator.generate_content_stream('主题', '内容')])
+        
+        for _ in range(5):
+            output_usage.record('normal', 400)
+        fallbacks = metrics.get_counter('max_tokens_fallback_total', template='normal')
+        
+        self.assertEqual(background_loop.run(run()), article)
+        self.assertEqual(payloads[0]['max_tokens'], 512)
+        self.assertEqual(payloads[0]['stream_options'], {"include_usage": True})
+        self.assertEqual(payloads[1]['messages'][-2], {"role": "assistant", "content": article[:cut]})
+        self.assertEqual(payloads[1]['max_tokens'], 2000 - 540)
+        self.assertEqual(metrics.get_counter('max_tokens_fallback_total', template='normal'), fallbacks + 1)
+        # 记录的是续写前后合计的输出长度
+        self.assertEqual(output_usage.snapshot()['normal']['max'], 840)
+        
+        response = Client().get('/api/metrics')
+        self.assertEqual(response.json()['output_tokens']['normal']['samples'], 6)
+    
+    def test_stream_options_rejected(self):
+        """测试上游以 400 拒绝 stream_options 时去掉该参数重发，之后不再发送"""
+        import httpx
+        from .ai_service import CustomAIGenerator
+        from .event_loop import background_loop
+        
+        payloads = []
+        
+        def handler(request):
+            payload = json.loads(request.content)
+            payloads.append(payload)
+            if 'stream_options' in payload:
+                return httpx.Response(400, content=b'{"error": "unknown field stream_options"}')
+            chunk = {"choices": [{"delta": {"content": FakeAIGenerator.ARTICLE}}]}
+            return httpx.Response(200, content=f"data: {json.dumps(chunk)}\n\ndata: [DONE]\n\n".encode('utf-8'))
+        
+        generator = CustomAIGenerator('https://api.example.com', 'sk-test-key', 'm')
+        generator._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        
+        async def run():
+            return ''.join([chunk async for chunk in generator.generate_content_stream('主题', '内容')])
+        
+        self.assertEqual(background_loop.run(run()), FakeAIGenerator.ARTICLE)
+        self.assertFalse(generator.supports_stream_usage)
+        self.assertEqual(len(payloads), 2)
+        
+        self.assertEqual(background_loop.run(run()), FakeAIGenerator.ARTICLE)
+        self.assertEqual(len(payloads), 3)
+        self.assertNotIn('stream_options', payloads[2])
+    
+    def test_variants_use_full_max_tokens(self):
+        """测试多 choice 调用不使用自适应的 max_tokens"""
+        import httpx
+        from .ai_service import CustomAIGenerator
+        from .budget import output_usage
+        from .event_loop import background_loop
+        
+        payloads = []
+        
+        def handler(request):
+            payloads.append(json.loads(request.content))
+            chunks = [{"choices": [{"index": i, "delta": {"content": FakeAIGenerator.ARTICLE}}]} for i in range(2)]
+            body = ''.join(f"data: {json.dumps(chunk)}\n\n" for chunk in chunks) + "data: [DONE]\n\n"
+            return httpx.Response(200, content=body.encode('utf-8'))
+        
+        generator = CustomAIGenerator('https://api.example.com', 'sk-test-key', 'm')
+        generator._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        for _ in range(5):
+            output_usage.record('normal', 400)
+        
+        async def run():
+            return [item async for item in generator.generate_variants_stream('主题', '内容', [], 'normal', 2)]
+        
+        background_loop.run(run())
+        self.assertEqual(payloads[0]['n'], 2)
+        self.assertEqual(payloads[0]['max_tokens'], 2000)
+        self.assertNotIn('stream_options', payloads[0])
+
+
+class SemanticCacheTestCase(TestCase):
+    """近似重复请求缓存测试用例"""
+    
+    def setUp(self):
+        from .semantic_cache import generation_cache
+        generation_cache.clear()
+    
+    def test_near_duplicates_hit(self):
+        """测试空白、标点、全角和词序的差异仍然命中，不同主题不命中"""
+        from .semantic_cache import NearDuplicateCache
+        
+        cache = NearDuplicateCache(threshold=0.8)
+        cache.add('normal', '春季养生指南', '介绍春天的饮食、作息和运动建议，适合上班族 ', 'cached')
+        
+        for theme, content in [
+            ('春季养生指南', '介绍春天的饮食，作息和运动建议。适合上班族'),
+            ('春季养生指南！', '介绍春天的饮食、作息和运动建议，适合上班族'),
+            ('春季养生指南', '介绍春天的作息、饮食和运动建议，适合上班族'),
+        ]:
+            hit = cache.lookup('normal', theme, content)
+            self.assertIsNotNone(hit, content)
+            self.assertEqual(hit[0], 'cached')
+            self.assertGreaterEqual(hit[1], 0.8)
+        
+        cache.add('normal', 'Python Tips', 'ten tips for writing faster python code', 'en')
+        self.assertEqual(cache.lookup('normal', 'ＰＹＴＨＯＮ  tips', 'Ten tips for writing faster Python code!')[0], 'en')
+        
+        self.assertIsNone(cache.lookup('normal', '秋季旅行攻略', '推荐国内适合秋天旅行的城市和路线'))
+        # 不同模板 / 分区互不影响
+        self.assertIsNone(cache.lookup('xiaohongshu', '春季养生指南', '介绍春天的饮食、作息和运动建议，适合上班族'))
+    
+    def test_same_content_different_theme_misses(self):
+        """测试内容描述相同、主题不同的请求不命中（短主题不能被相同的描述淹没）"""
+        from .semantic_cache import NearDuplicateCache
+        
+        cache = NearDuplicateCache(threshold=0.8)
+        travel = '推荐三天两夜的行程安排、必去景点、美食和住宿建议'
+        tutorial = '面向零基础读者，讲解环境安装、基本语法、常用数据结构和第一个小项目'
+        cache.add('normal', '北京旅游攻略', travel, 'beijing')
+        cache.add('normal', 'Python 入门教程', tutorial, 'python')
+        
+        self.assertIsNone(cache.lookup('normal', '南京旅游攻略', travel))
+        self.assertIsNone(cache.lookup('normal', '上海旅游攻略', travel))
+        self.assertIsNone(cache.lookup('normal', 'Java 入门教程', tutorial))
+        # 主题只差标点和大小写时仍然命中
+        self.assertEqual(cache.lookup('normal', '北京旅游攻略！', travel.replace('、', '，'))[0], 'beijing')
+        self.assertEqual(cache.lookup('normal', 'python入门教程', tutorial)[0], 'python')
+    
+    def test_long_content_lookup_cost(self):
+        """测试规范化后相同的请求走精确查找不计算签名，长内容的签名只用有限个特征"""
+        from .semantic_cache import NearDuplicateCache, _hash64, request_features
+        
+        content = ''.join(chr(0x4e00 + (i * 7919) % 3000) for i in range(5000))
+        cache = NearDuplicateCache()
+        cache.add('p', '主题', content, 'long')
+        
+        with mock.patch.object(cache.hasher, 'signature', side_effect=AssertionError('不应计算签名')):
+            self.assertEqual(cache.lookup('p', '主题', content + '。'), ('long', 1.0))
+        
+        # 签名只取决于哈希值最小的 max_features 个特征
+        features = request_features('主题', content)
+        sample = sorted(features, key=_hash64)[:cache.hasher.max_features]
+        self.assertGreater(len(features), len(sample))
+        self.assertEqual(cache.hasher.signature(features), cache.hasher.signature(frozenset(sample)))
+        
+        self.assertEqual(cache.lookup('p', '主题', content[:2500] + '改' + content[2500:])[0], 'long')
+    
+    def test_lru_and_ttl(self):
+        """测试超出容量时淘汰最久未使用的条目，过期条目不再命中"""
+        from .semantic_cache import NearDuplicateCache
+        
+        cache = NearDuplicateCache(max_size=2)
+        cache.add('p', '主题一', '第一篇内容描述', 1)
+        cache.add('p', '主题二', '第二篇内容描述', 2)
+        self.assertIsNotNone(cache.lookup('p', '主题一', '第一篇内容描述'))
+        cache.add('p', '主题三', '第三篇内容描述', 3)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.lookup('p', '主题二', '第二篇内容描述'))
+        self.assertEqual(cache.lookup('p', '主题一', '第一篇内容描述')[0], 1)
+        
+        cache = NearDuplicateCache(ttl=10)
+        cache.add('p', '主题', '内容描述', 'old')
+        with mock.patch('contentgenerater.semantic_cache.time.monotonic', return_value=time.monotonic() + 11):
+            self.assertIsNone(cache.lookup('p', '主题', '内容描述'))
+        self.assertEqual(len(cache), 0)
+    
+    @mock.patch('contentgenerater.views.get_ai_generator')
+    def test_generate_stream_reuses_result(self, get_generator):
+        """测试近似重复的请求直接返回缓存结果并标记命中，cache=false 时跳过缓存"""
+        calls = []
+        
+        class CountingGenerator(FakeAIGenerator):
+            async def generate_content_stream(self, *args, **kwargs):
+                calls.append(args)
+                async for chunk in super().generate_content_stream(*args, **kwargs):
+                    yield chunk
+        
+        get_generator.side_effect = CountingGenerator
+        
+        def generate(content, **extra):
+            response = self.client.post(
+                '/api/generate-stream',
+                data=json.dumps({'theme': '测试主题', 'content': content, **extra}),
+                content_type='application/json'
+            )
+            body = b''.join(response.streaming_content).decode('utf-8')
+            return [json.loads(line[6:]) for line in body.split('\n\n')
+                    if line.startswith('data: ') and line != 'data: [DONE]']
+        
+        first = generate('介绍春天的饮食、作息和运动建议')
+        self.assertNotIn('cache', first[0])
+        self.assertEqual(len(calls), 1)
+        
+        second = generate('介绍春天的饮食，作息和运动建议。')
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(second[0]['cache']['hit'])
+        self.assertEqual(''.join(e['content'] for e in second if 'content' in e), FakeAIGenerator.ARTICLE)
+        self.assertEqual(second[-1]['articleId'], first[-1]['articleId'])
+        
+        generate('介绍春天的饮食、作息和运动建议', cache=False)
+        self.assertEqual(len(calls), 2)
+
+
+class WebSocketTestCase(TestCase):
+    """WebSocket 生成接口测试用例"""
+    
+    closed = []
+    
+    class SlowGenerator(FakeAIGenerator):
+        """主题为“慢”时持续输出，用于测试取消；否则同 FakeAIGenerator"""
+        
+        async def generate_content_stream(self, theme, content, images=None, template_type='normal'):
+            if theme != '慢':
+                async for chunk in super().generate_content_stream(theme, content, images, template_type):
+                    yield chunk
+                return
+            try:
+                for i in range(1000):
+                    await asyncio.sleep(0.01)
+                    yield f"{i},"
+            finally:
+                WebSocketTestCase.closed.append(theme)
+    
+    def setUp(self):
+        from .semantic_cache import generation_cache
+        
+        generation_cache.clear()
+        WebSocketTestCase.closed = []
+        patchers = [
+            mock.patch('contentgenerater.config.WEBSOCKET_ENABLED', True),
+            mock.patch('contentgenerater.config.WEBSOCKET_PROGRESS_INTERVAL', 0.02),
+            mock.patch('contentgenerater.views.get_ai_generator', self.SlowGenerator),
+            mock.patch('contentgenerater.ai_service.get_ai_generator', self.SlowGenerator),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+    
+    async def connect(self, path='/api/ws'):
+        from asgiref.testing import ApplicationCommunicator
+        from textpix.asgi import application
+        
+        communicator = ApplicationCommunicator(application, {'type': 'websocket', 'path': path, 'headers': []})
+        await communicator.send_input({'type': 'websocket.connect'})
+        return communicator, await communicator.receive_output(2)
+    
+    @staticmethod
+    async def send(communicator, **message):
+        await communicator.send_input({'type': 'websocket.receive', 'text': json.dumps(message)})
+    
+    @staticmethod
+    async def receive_until(communicator, done, timeout=5):
+        """接收消息直到 done(已收到的消息) 为真"""
+        messages = []
+        while not done(messages):
+            output = await communicator.receive_output(timeout)
+            messages.append(json.loads(output['text']))
+        return messages
+    
+    async def test_concurrent_generations_and_cancel(self):
+        """测试同一连接上并行生成，取消只中止对应的上游流并推送进度"""
+        communicator, accepted = await self.connect()
+        self.assertEqual(accepted['type'], 'websocket.accept')
+        
+        await self.send(communicator, type='generate', id='slow', theme='慢', content='测试内容')
+        await self.send(communicator, type='generate', id='fast', theme='测试主题', content='测试内容')
+        
+        def finished(gen_id, kinds):
+            return lambda messages: any(m.get('id') == gen_id and m['type'] in kinds for m in messages)
+        
+        messages = await self.receive_until(communicator, finished('fast', ('done', 'error')))
+        fast = [m for m in messages if m.get('id') == 'fast']
+        self.assertEqual(fast[0]['type'], 'accepted')
+        self.assertEqual(''.join(m['content'] for m in fast if m['type'] == 'content'), FakeAIGenerator.ARTICLE)
+        self.assertIn('articleId', next(m for m in fast if m['type'] == 'article'))
+        self.assertEqual(fast[-1]['type'], 'done')
+        
+        messages += await self.receive_until(
+            communicator, lambda ms: sum(1 for m in ms if m.get('id') == 'slow' and m['type'] == 'progress') >= 2
+        )
+        progress = [m for m in messages if m.get('id') == 'slow' and m['type'] == 'progress']
+        self.assertEqual(progress[-1]['phase'], 'generating')
+        self.assertGreater(progress[-1]['chunks'], 0)
+        
+        await self.send(communicator, type='cancel', id='slow')
+        messages = await self.receive_until(communicator, finished('slow', ('cancelled',)))
+        # 取消后上游异步生成器在后台事件循环中被关闭
+        for _ in range(100):
+            if self.closed:
+                break
+            await asyncio.sleep(0.01)
+        self.assertEqual(self.closed, ['慢'])
+        
+        await self.send(communicator, type='cancel', id='slow')
+        error = (await self.receive_until(communicator, lambda ms: bool(ms)))[0]
+        self.assertEqual(error['code'], 'not_found')
+        
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait(2)
+    
+    @mock.patch('contentgenerater.config.SSE_MAX_GENERATIONS', 1)
+    async def test_generation_waits_for_shared_slot(self):
+        """测试 WebSocket 生成与 SSE 共用生成名额：名额用尽时推送排队位置，释放后开始生成"""
+        import threading
+        from .admission import generation_queue
+        
+        holder = generation_queue.enter()
+        self.assertTrue(holder.admitted)
+        communicator, _ = await self.connect()
+        await self.send(communicator, type='generate', id='a1', theme='测试主题', content='测试内容', cache=False)
+        messages = await self.receive_until(communicator, lambda ms: any(m['type'] == 'queued' for m in ms))
+        self.assertEqual([m['type'] for m in messages], ['accepted', 'queued'])
+        self.assertEqual(messages[-1]['position'], 1)
+        
+        # 由其他线程释放名额（如 SSE 请求结束）
+        threading.Timer(0.05, generation_queue.leave, args=[holder]).start()
+        messages = await self.receive_until(communicator, lambda ms: any(m['type'] in ('done', 'error') for m in ms))
+        self.assertEqual(messages[-1]['type'], 'done')
+        self.assertEqual(''.join(m['content'] for m in messages if m['type'] == 'content'), FakeAIGenerator.ARTICLE)
+        self.assertEqual(generation_queue.stats(), {'active': 0, 'waiting': 0, 'limit': 1})
+        
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait(2)
+    
+    async def test_protocol_errors(self):
+        """测试参数错误、ping、并发上限，以及未启用路径的连接被拒绝"""
+        communicator, _ = await self.connect()
+        
+        await self.send(communicator, type='ping')
+        self.assertEqual((await self.receive_until(communicator, bool))[0], {'type': 'pong'})
+        
+        await self.send(communicator, type='generate', id='bad', content='测试内容')
+        error = (await self.receive_until(communicator, bool))[0]
+        self.assertEqual(error['id'], 'bad')
+        self.assertIn('theme', error['details'])
+        
+        await communicator.send_input({'type': 'websocket.receive', 'text': 'not json'})
+        self.assertEqual((await self.receive_until(communicator, bool))[0]['type'], 'error')
+        
+        with mock.patch('contentgenerater.config.WEBSOCKET_MAX_GENERATIONS', 1):
+            await self.send(communicator, type='generate', id='one', theme='慢', content='测试内容')
+            await self.send(communicator, type='generate', id='two', theme='慢', content='测试内容')
+            messages = await self.receive_until(communicator, lambda ms: any(m.get('id') == 'two' for m in ms))
+        self.assertEqual([m for m in messages if m.get('id') == 'two'][0]['code'], 'too_many_generations')
+        await self.receive_until(communicator, lambda ms: any(m['type'] == 'content' for m in ms))
+        
+        # 断开连接时中止进行中的生成
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait(2)
+        for _ in range(100):
+            if self.closed:
+                break
+            await asyncio.sleep(0.01)
+        self.assertEqual(self.closed, ['慢'])
+        
+        rejected, output = await self.connect('/api/other')
+        self.assertEqual(output, {'type': 'websocket.close', 'code': 1008})
+        await rejected.wait(2)
+
+
+class OutlineTestCase(TestCase):
+    """大纲模式测试用例"""
+    
+    OUTLINE = {"title": "标题", "intro": "简介", "sections": [{"title": f"版块{i}"} for i in range(4)], "footer": "结语"}
+    
+    def setUp(self):
+        from .semantic_cache import generation_cache
+        generation_cache.clear()
+    
+    def make_generator(self):
+        """模拟上游：先返回大纲，各版块请求返回要点（第一个版块最慢）"""
+        import httpx
+        from .ai_service import CustomAIGenerator
+        
+        self.active = 0
+        self.max_active = 0
+        self.requests = []
+        
+        async def handler(request):
+            prompt = json.loads(request.content)['messages'][-1]['content']
+            self.requests.append(prompt)
+            match = re.search(r'需要撰写的版块：(\d+)', prompt)
+            if match is None:
+                text = json.dumps(self.OUTLINE, ensure_ascii=False)
+            else:
+                index = int(match.group(1)) - 1
+                self.active += 1
+                self.max_active = max(self.max_active, self.active)
+                await asyncio.sleep(0.1 if index == 0 else 0.02)
+                self.active -= 1
+                text = json.dumps([f"要点{index}-a", f"要点{index}-b"], ensure_ascii=False)
+            body = ''.join(
+                f"data: {json.dumps({'choices': [{'delta': {'content': text[i:i + 10]}}]})}\n\n"
+                for i in range(0, len(text), 10)
+            ) + "data: [DONE]\n\n"
+            return httpx.Response(200, content=body.encode('utf-8'))
+        
+        generator = CustomAIGenerator('https://api.example.com', 'sk-test-key', 'm')
+        generator._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        return generator
+    
+    @mock.patch('contentgenerater.config.OUTLINE_CONCURRENCY', 2)
+    def test_sections_generated_in_parallel_and_in_order(self):
+        """测试版块并行生成（不超过并发上限），按大纲顺序输出与普通模式相同的 JSON"""
+        from .event_loop import background_loop
+        
+        generator = self.make_generator()
+        
+        async def run():
+            return [chunk async for chunk in generator.generate_outline_stream('主题', '内容')]
+        chunks = background_loop.run(run(), timeout=10)
+        
+        self.assertEqual(len(self.requests), 5)
+        self.assertEqual(self.max_active, 2)
+        self.assertTrue(chunks[0].endswith('"sections": ['))
+        self.assertEqual(len(chunks), 6)
+        self.assertEqual(json.loads(''.join(chunks)), {
+            "title": "标题", "intro": "简介", "footer": "结语",
+            "sections": [{"title": f"版块{i}", "items": [f"要点{i}-a", f"要点{i}-b"]} for i in range(4)],
+        })
+    
+    def test_render_sections_as_they_complete(self):
+        """测试渲染器在后续版块到达前就输出已完成的版块"""
+        from .streaming_renderer import stream_render_from_ai
+        
+        log = []
+        
+        async def outline_chunks():
+            for chunk in ('{"title": "标题", "intro": "简介", "sections": [',
+                          '{"title": "版块一", "items": ["要点"]}',
+                          ', {"title": "版块二", "items": ["要点"]}',
+                          '], "footer": "结语"}'):
+                log.append('chunk')
+                yield chunk
+        
+        async def render():
+            async for part in stream_render_from_ai(outline_chunks()):
+                log.append(part)
+        asyncio.run(render())
+        
+        html = ''.join(p for p in log if p != 'chunk')
+        self.assertEqual(html.count('01 版块一'), 1)
+        self.assertEqual(html.count('02 版块二'), 1)
+        self.assertIn('结语', html)
+        first_section = next(i for i, p in enumerate(log) if '01 版块一' in p)
+        # 版块一在第三个数据块（版块二）到达后、结语到达前输出
+        self.assertEqual(log[:first_section].count('chunk'), 3)
+    
+    @mock.patch('contentgenerater.views.get_ai_generator', FakeAIGenerator)
+    def test_generate_stream_outline_mode(self):
+        """测试 mode=outline 的请求（生成器不支持大纲模式时按普通模式生成）"""
+        response = self.client.post(
+            '/api/generate-stream',
+            data=json.dumps({'theme': '测试主题', 'content': '测试内容', 'mode': 'outline'}),
+            content_type='application/json'
+        )
+        events = [json.loads(line[6:]) for line in b''.join(response.streaming_content).decode('utf-8').split('\n\n')
+                  if line.startswith('data: {')]
+        self.assertEqual(''.join(e['content'] for e in events if 'content' in e), FakeAIGenerator.ARTICLE)
+        self.assertIn('articleId', events[-1])
+
+
+class ReplayTestCase(TestCase):
+    """上游录制与回放测试用例"""
+    
+    def test_record_then_replay(self):
+        """测试录制写入状态码、逐行内容和到达时间，回放时按请求指纹匹配"""
+        import httpx
+        import tempfile
+        from .ai_service import CustomAIGenerator
+        from .event_loop import background_loop
+        from .replay import ReplayMiss, ReplayTransport, load_fixtures
+        
+        async def body():
+            for i, delay in enumerate([0.05, 0.02, 0.08]):
+                await asyncio.sleep(delay)
+                chunk = {"choices": [{"delta": {"content": f"第{i}块"}}]}
+                yield f"data: {json.dumps(chunk)}\n\n".encode('utf-8')
+            yield b"data: [DONE]\n\n"
+        
+        def collect(generator, messages):
+            async def run():
+                return [chunk async for chunk in generator._stream_chat(messages)]
+            return background_loop.run(run(), timeout=10)
+        
+        messages = [{"role": "user", "content": "录制"}]
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        
+        generator = CustomAIGenerator('https://api.example.com/v1', 'sk-secret-key', 'm')
+        generator._client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(200, content=body())))
+        with mock.patch('contentgenerater.config.AI_RECORD_DIR', tmp.name):
+            self.assertEqual(collect(generator, messages), ['第0块', '第1块', '第2块'])
+        
+        [fixture] = load_fixtures(tmp.name)
+        self.assertEqual(fixture['status'], 200)
+        self.assertTrue(fixture['complete'])
+        self.assertEqual(fixture['request']['messages'], messages)
+        self.assertNotIn('sk-secret-key', json.dumps(fixture))
+        times = [at for at, line in fixture['events'] if line.startswith('data: {')]
+        self.assertEqual(len(times), 3)
+        self.assertGreaterEqual(times[0], 0.05)
+        self.assertGreaterEqual(times[2] - times[1], 0.07)
+        
+        transport = ReplayTransport.from_path(tmp.name, speed=0, strict=True)
+        generator._client = httpx.AsyncClient(transport=transport)
+        self.assertEqual(collect(generator, messages), ['第0块', '第1块', '第2块'])
+        with self.assertRaises(ReplayMiss):
+            collect(generator, [{"role": "user", "content": "没有录制过的请求"}])
+        
+        # 非严格模式下没有匹配时依次使用已有的录制
+        generator._client = httpx.AsyncClient(transport=ReplayTransport.from_path(tmp.name, speed=0))
+        self.assertEqual(collect(generator, [{"role": "user", "content": "其他请求"}]), ['第0块', '第1块', '第2块'])
+
+
+class SSEPreambleTestCase(TestCase):
+    """SSE 预告事件、心跳、阶段和排队测试用例"""
+    
+    class SlowGenerator(FakeAIGenerator):
+        async def generate_content_stream(self, theme, content, images=None, template_type='normal'):
+            # 模拟等待上游首个 token
+            await asyncio.sleep(0.15)
+            yield self.ARTICLE
+    
+    def setUp(self):
+        from .semantic_cache import generation_cache
+        generation_cache.clear()
+        self.client = Client()
+    
+    def post(self):
+        return self.client.post(
+            '/api/generate-stream',
+            data=json.dumps({'theme': '测试主题', 'content': '测试内容'}),
+            content_type='application/json'
+        )
+    
+    @staticmethod
+    def frame(frame):
+        """把一个 SSE 帧解析为 (事件名, 数据)；注释行返回 ('comment', 内容)"""
+        if frame.startswith(':'):
+            return 'comment', frame[1:].strip()
+        name, data = 'message', None
+        for line in frame.strip().split('\n'):
+            if line.startswith('event: '):
+                name = line[7:]
+            elif line.startswith('data: '):
+                data = line[6:] if line[6:] == '[DONE]' else json.loads(line[6:])
+        return name, data
+    
+    @mock.patch('contentgenerater.config.SSE_HEARTBEAT_INTERVAL', 0.03)
+    def test_preamble_heartbeats_and_phases(self):
+        """测试 accepted 在上游返回前立即发送，等待上游时发送心跳，并依次推送各阶段"""
+        with mock.patch('contentgenerater.views.get_ai_generator', self.SlowGenerator):
+            response = self.post()
+            stream = iter(response.streaming_content)
+            started = time.monotonic()
+            first = next(stream).decode('utf-8')
+            self.assertLess(time.monotonic() - started, 0.1)
+            frames = [first] + [chunk.decode('utf-8') for chunk in stream]
+        
+        self.assertEqual(self.frame(first), ('accepted', {'requestId': response['X-Request-ID']}))
+        events = [self.frame(frame) for frame in frames]
+        phases = [data['phase'] for name, data in events if name == 'phase']
+        self.assertEqual(phases, ['connecting', 'generating', 'saving'])
+        
+        names = [name for name, _ in events]
+        heartbeats = [i for i, name in enumerate(names) if name == 'comment']
+        self.assertGreaterEqual(len(heartbeats), 2)
+        self.assertLess(max(heartbeats), names.index('phase', names.index('phase') + 1))
+        self.assertEqual(events[-1], ('message', '[DONE]'))
+        self.assertEqual(''.join(data.get('content', '') for name, data in events if name == 'message' and isinstance(data, dict)),
+                         FakeAIGenerator.ARTICLE)
+    
+    @mock.patch('contentgenerater.config.SSE_HEARTBEAT_INTERVAL', 0.03)
+    async def test_asgi_streams_incrementally(self):
+        """测试以 ASGI 应用运行时事件逐个发送，而不是生成结束后一次性发送"""
+        from asgiref.testing import ApplicationCommunicator
+        from textpix.asgi import application
+        
+        body = json.dumps({'theme': '测试主题', 'content': '测试内容'}).encode('utf-8')
+        scope = {
+            'type': 'http', 'method': 'POST', 'path': '/api/generate-stream', 'query_string': b'',
+            'server': ('testserver', 80),
+            'headers': [(b'host', b'testserver'), (b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())],
+        }
+        with mock.patch('contentgenerater.views.get_ai_generator', self.SlowGenerator):
+            communicator = ApplicationCommunicator(application, scope)
+            await communicator.send_input({'type': 'http.request', 'body': body, 'more_body': False})
+            start = await communicator.receive_output(2)
+            self.assertEqual(start['status'], 200)
+            started = time.monotonic()
+            first = await communicator.receive_output(2)
+            # 上游 0.15 秒后才返回，accepted 必须在此之前到达
+            self.assertLess(time.monotonic() - started, 0.1)
+            self.assertTrue(first['more_body'])
+            frames = [first['body'].decode('utf-8')]
+            while True:
+                message = await communicator.receive_output(5)
+                if message.get('body'):
+                    frames.append(message['body'].decode('utf-8'))
+                if not message.get('more_body'):
+                    break
+            await communicator.wait(2)
+        
+        events = [self.frame(frame) for frame in frames]
+        self.assertEqual(events[0][0], 'accepted')
+        self.assertIn(('comment', 'heartbeat'), events)
+        self.assertEqual(events[-1], ('message', '[DONE]'))
+    
+    @mock.patch('contentgenerater.views.get_ai_generator', FakeAIGenerator)
+    @mock.patch('contentgenerater.config.SSE_MAX_GENERATIONS', 1)
+    def test_queue_position_then_admitted(self):
+        """测试名额用尽时推送排队位置，名额释放后开始生成"""
+        import threading
+        from .admission import generation_queue
+        
+        holder = generation_queue.enter()
+        self.assertTrue(holder.admitted)
+        release = threading.Timer(0.1, generation_queue.leave, args=[holder])
+        release.start()
+        self.addCleanup(release.cancel)
+        
+        events = [self.frame(chunk.decode('utf-8')) for chunk in self.post().streaming_content]
+        self.assertEqual(events[1], ('queued', {'position': 1}))
+        self.assertIn(('phase', {'phase': 'connecting'}), events)
+        self.assertEqual(events[-1], ('message', '[DONE]'))
+        self.assertEqual(generation_queue.stats()['active'], 0)
+    
+    @mock.patch('contentgenerater.views.get_ai_generator', FakeAIGenerator)
+    @mock.patch('contentgenerater.config.SSE_MAX_GENERATIONS', 1)
+    @mock.patch('contentgenerater.config.SSE_QUEUE_TIMEOUT', 0.05)
+    def test_queue_timeout(self):
+        """测试排队超时返回可重试的错误，并退出队列"""
+        from .admission import generation_queue
+        
+        holder = generation_queue.enter()
+        self.addCleanup(generation_queue.leave, holder)
+        
+        events = [self.frame(chunk.decode('utf-8')) for chunk in self.post().streaming_content]
+        name, error = events[-1]
+        self.assertEqual(error['code'], 'queue_timeout')
+        self.assertTrue(error['retryable'])
+        self.assertEqual(generation_queue.stats()['waiting'], 0)
+
+
+class StartupTestCase(TestCase):
+    """冷启动测试用例"""
+    
+    def test_api_profile_defers_heavy_imports(self):
+        """测试 API 启动配置下，启动并处理健康检查时不导入 httpx、PIL、whitenoise 和 cProfile"""
+        import subprocess
+        import sys
+        from django.conf import settings
+        
+        code = (
+            "import io, json, sys\n"
+            "from textpix.wsgi import application\n"
+            "environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/api/health', 'SERVER_NAME': 'localhost',\n"
+            "           'SERVER_PORT': '80', 'HTTP_HOST': 'localhost', 'wsgi.input': io.BytesIO(),\n"
+            "           'wsgi.errors': sys.stderr, 'wsgi.url_scheme': 'http'}\n"
+            "status = []\n"
+            "b''.join(application(environ, lambda s, h, exc_info=None: status.append(s)))\n"
+            "print(json.dumps({'status': status[0], 'loaded': [m for m in ('httpx', 'PIL', 'whitenoise', 'cProfile') if m in sys.modules]}))\n"
+        )
+        env = dict(os.environ, APP_PROFILE='api', DJANGO_SETTINGS_MODULE='textpix.settings', AI_WARMUP_ON_STARTUP='False')
+        proc = subprocess.run(
+            [sys.executable, '-c', code], cwd=str(settings.BASE_DIR), env=env,
+            capture_output=True, text=True, timeout=60
+        )
+        self.assertEqual(proc.returncode, 0, proc.stderr[-2000:])
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        self.assertEqual(result, {'status': '200 OK', 'loaded': []})
+
+
+class ArticleStoreTestCase(TestCase):
+    """文章存储测试用例"""
+    
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.data = {
+            "title": "测试文章",
+            "intro": "简介",
+            "sections": [{"title": "版块", "items": ["要点1", "要点2"]}],
+            "footer": "结语"
+        }
+    
+    def test_save_and_read_with_etag(self):
+        """测试保存后按内容 ID 读取，ETag 命中返回 304"""
+        from .articles import save_article
+        
+        article = save_article(self.data, 'normal', '测试主题')
+        self.assertEqual(save_article(self.data, 'normal').pk, article.pk)
+        self.assertIn('<h1>测试文章</h1>', article.html)
+        
+        url = f'/api/articles/{article.content_id}'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('01 版块', response.content.decode('utf-8'))
+        
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        
+        response = self.client.get(url + '?format=json')
+        self.assertEqual(response.json()['data'], self.data)
+    
+    def test_read_from_cache(self):
+        """测试缓存命中时不查询数据库"""
+        from .articles import save_article
+        
+        article = save_article(self.data, 'normal')
+        with self.assertNumQueries(0):
+            response = self.client.get(f'/api/articles/{article.content_id}')
+        self.assertEqual(response.status_code, 200)
+    
+    def test_wechat_render(self):
+        """测试微信聊天模板渲染"""
+        from .streaming_renderer import render_html
+        
+        html = render_html({
+            "title": "聊天",
+            "chat_header": "群聊",
+            "messages": [
+                {"type": "time", "time": "10:30"},
+                {"nickname": "张三", "text": "<你好>", "align": "left"},
+                {"nickname": "我", "text": "好", "align": "right", "showNickname": False}
+            ]
+        }, 'wechat')
+        self.assertIn('message-time', html)
+        self.assertIn('&lt;你好&gt;', html)
+        self.assertIn('message right', html)
+    
+    def test_missing_article(self):
+        """测试文章不存在"""
+        response = self.client.get('/api/articles/notfound')
+        self.assertEqual(response.status_code, 404)
+
+
+class RasterizerTestCase(TestCase):
+    """服务端 PNG 渲染测试用例"""
+    
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+    
+    def test_render_png_layouts(self):
+        """测试两种模板都能渲染出 PNG，内容越多图片越高"""
+        import struct
+        from .rasterizer import render_png
+        
+        def height(png):
+            self.assertEqual(png[:8], b'\x89PNG\r\n\x1a\n')
+            return struct.unpack('>I', png[20:24])[0]
+        
+        short = height(render_png({"title": "标题", "sections": []}, 'normal', width=375))
+        long = height(render_png({"title": "标题", "sections": [{"title": "版块", "items": ["要点"] * 5}]}, 'normal', width=375))
+        self.assertGreater(long, short)
+        
+        chat = {"chat_header": "群聊", "messages": [{"nickname": "张三", "text": "你好", "align": "left"}]}
+        self.assertGreater(height(render_png(chat, 'wechat', width=375)), 0)
+    
+    def test_render_image_endpoint_cached(self):
+        """测试渲染接口，相同文档第二次命中缓存"""
+        from concurrent.futures import ThreadPoolExecutor
+        
+        executor = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(executor.shutdown)
+        body = json.dumps({"templateType": "normal", "data": {"title": "标题"}})
+        
+        with mock.patch('contentgenerater.rasterizer.get_executor', return_value=executor) as get_executor:
+            for _ in range(2):
+                response = self.client.post('/api/render-image', data=body, content_type='application/json')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response['Content-Type'], 'image/png')
+            self.assertEqual(get_executor.call_count, 1)
+
+    
+    @mock.patch('contentgenerater.config.RASTER_WORKERS', 1)
+    def test_real_process_pool_and_timeout(self):
+        """测试在真实的渲染进程池中渲染；超时后终止渲染进程，下次请求使用新的进程池"""
+        from . import rasterizer
+        
+        def shutdown():
+            if rasterizer._executor is not None:
+                rasterizer._executor.shutdown(cancel_futures=True)
+                rasterizer._executor = None
+        
+        shutdown()
+        self.addCleanup(shutdown)
+        
+        png = rasterizer.get_png({"title": "进程池"}, 'normal', width=375)
+        self.assertEqual(png[:8], b'\x89PNG\r\n\x1a\n')
+        executor = rasterizer._executor
+        processes = list(executor.executor._processes.values())
+        self.assertEqual(len(processes), 1)
+        
+        # 渲染已在执行时超时：停用进程池，没有其他渲染时立即终止渲染进程
+        with mock.patch('contentgenerater.config.RASTER_TIMEOUT', 0.001):
+            with self.assertRaises(TimeoutError):
+                rasterizer.get_png({"title": "超时", "sections": [{"title": "版块", "items": ["要点"] * 200}]}, 'normal')
+        self.assertIsNone(rasterizer._executor)
+        for process in processes:
+            process.join(5)
+            self.assertFalse(process.is_alive())
+        
+        self.assertEqual(rasterizer.get_png({"title": "重建"}, 'normal', width=375)[:4], b'\x89PNG')
+        self.assertIsNot(rasterizer._executor, executor)
+    
+    @mock.patch('contentgenerater.config.RASTER_WORKERS', 2)
+    def test_timeout_does_not_break_other_renders(self):
+        """测试一个请求渲染超时时，同一进程池中其他请求的渲染照常完成，之后才终止渲染进程"""
+        from . import rasterizer
+        
+        def shutdown():
+            if rasterizer._executor is not None:
+                rasterizer._executor.shutdown(cancel_futures=True)
+                rasterizer._executor = None
+        
+        shutdown()
+        self.addCleanup(shutdown)
+        
+        def document(items):
+            return {"title": "渲染", "sections": [{"title": "版块", "items": ["要点"] * items}]}
+        
+        rasterizer.get_png({"title": "预热"}, 'normal', width=375)
+        pool = rasterizer._executor
+        processes = list(pool.executor._processes.values())
+        other = pool.submit(rasterizer.render_png, document(40), 'normal', 750, None, None)
+        
+        with mock.patch('contentgenerater.config.RASTER_TIMEOUT', 0.3):
+            with self.assertRaises(TimeoutError):
+                rasterizer.get_png(document(400), 'normal')
+        self.assertIsNone(rasterizer._executor)
+        
+        # 其他请求的渲染不受影响；完成后停用的进程池被终止（超时的渲染不会跑完）
+        self.assertEqual(other.result(timeout=30)[:4], b'\x89PNG')
+        for process in processes:
+            process.join(5)
+            self.assertFalse(process.is_alive())
+        
+        self.assertEqual(rasterizer.get_png({"title": "重建"}, 'normal', width=375)[:4], b'\x89PNG')
+        self.assertIsNot(rasterizer._executor, pool)
+    
+    def test_missing_cjk_font_warns(self):
+        """测试没有包含中文字形的字体时告警（而不是静默输出方框）"""
+        from concurrent.futures import Future
+        from .rasterizer import _report_fonts, check_fonts, font_supports_cjk
+        
+        latin = '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+        if os.path.exists(latin):
+            self.assertFalse(font_supports_cjk(latin))
+        self.assertFalse(font_supports_cjk(None))
+        with mock.patch('contentgenerater.rasterizer.find_font', return_value=None):
+            self.assertIsNone(check_fonts())
+        
+        future = Future()
+        future.set_result(None)
+        with self.assertLogs('contentgenerater.rasterizer', 'WARNING') as logs:
+            _report_fonts(future)
+        self.assertIn('RASTER_FONT_PATH', logs.output[0])
+    
+    def test_default_workers_split_across_web_workers(self):
+        """测试默认渲染进程数按 CPU 核数平分给同一主机上的 Web worker"""
+        from .rasterizer import default_workers
+        
+        with mock.patch('contentgenerater.rasterizer.os.cpu_count', return_value=8), \
+                mock.patch('contentgenerater.config.RASTER_WORKERS', 0):
+            with mock.patch('contentgenerater.config.WEB_CONCURRENCY', 4):
+                self.assertEqual(default_workers(), 2)
+            with mock.patch('contentgenerater.config.WEB_CONCURRENCY', 16):
+                self.assertEqual(default_workers(), 1)
+
+
+class ReadinessTestCase(TestCase):
+    """预热与就绪检查测试用例"""
+    
+    def test_health_ok(self):
+        """测试存活检查始终返回 200"""
+        response = self.client.get('/api/health')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'ok')
+    
+    @mock.patch('contentgenerater.config.CUSTOM_AI_API_KEY', '')
+    def test_ready_unconfigured(self):
+        """测试未配置上游时就绪检查返回 503"""
+        response = self.client.get('/api/ready')
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(response.json()['ready'])
+    
+    def test_warmup_opens_pooled_connection(self):
+        """测试预热通过共享连接池访问上游"""
+        import httpx
+        from .ai_service import CustomAIGenerator
+        from .event_loop import background_loop
+        
+        requests = []
+        
+        def handler(request):
+            requests.append(request.url.path)
+            return httpx.Response(200, json={"data": []})
+        
+        generator = CustomAIGenerator('https://upstream.test/v1', 'sk-test', 'test-model')
+        generator._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        
+        background_loop.run(generator.warmup())
+        self.assertEqual(requests, ['/v1/models'])
+        self.assertTrue(generator.status()['warmed_up'])
+        background_loop.run(generator.close())
+    
+    @mock.patch('contentgenerater.config.CUSTOM_AI_API_KEY', '')
+    @mock.patch('contentgenerater.config.AI_REPLAY_DIR', UPSTREAM_FIXTURES)
+    def test_ready_with_replay(self):
+        """测试回放录制时不配置上游也视为就绪"""
+        self.assertEqual(self.client.get('/api/ready').status_code, 200)
+    
+    @mock.patch('contentgenerater.config.AI_WARMUP_RETRY_DELAY', 0.01)
+    @mock.patch('contentgenerater.config.AI_WARMUP_ON_STARTUP', True)
+    def test_warmup_retries_until_ready(self):
+        """测试启动预热失败后退避重试，成功后就绪检查返回 200"""
+        import httpx
+        from .ai_service import CustomAIGenerator, warmup_ai_generator
+        
+        attempts = []
+        
+        def handler(request):
+            attempts.append(request.url.path)
+            if len(attempts) < 3:
+                raise httpx.ConnectError("connection refused", request=request)
+            return httpx.Response(200, json={"data": []})
+        
+        generator = CustomAIGenerator('https://upstream.test/v1', 'sk-test', 'test-model')
+        generator._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        with mock.patch('contentgenerater.ai_service._generator', generator), \
+                mock.patch('contentgenerater.config.CUSTOM_AI_API_KEY', 'sk-test'), \
+                mock.patch('contentgenerater.config.CUSTOM_AI_BASE_URL', 'https://upstream.test/v1'):
+            warmup_ai_generator()
+            self.assertEqual(len(attempts), 3)
+            self.assertEqual(self.client.get('/api/ready').status_code, 200)
+    
+    def test_successful_request_marks_warmed_up(self):
+        """测试预热失败后，生成请求成功访问上游即视为已就绪"""
+        import httpx
+        from .ai_service import CustomAIGenerator
+        from .event_loop import background_loop
+        
+        def handler(request):
+            chunk = {"choices": [{"delta": {"content": "你好"}}]}
+            return httpx.Response(200, content=f"data: {json.dumps(chunk)}\n\ndata: [DONE]\n\n".encode('utf-8'))
+        
+        generator = CustomAIGenerator('https://upstream.test/v1', 'sk-test', 'test-model')
+        generator._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        generator.last_warmup_error = 'connection refused'
+        
+        async def run():
+            return [chunk async for chunk in generator._stream_chat([{"role": "user", "content": "hi"}])]
+        
+        background_loop.run(run())
+        self.assertTrue(generator.status()['warmed_up'])
+
+
+class ServeReactTestCase(TestCase):
+    """React index.html 缓存服务测试用例"""
+    
+    def setUp(self):
+        import tempfile
+        from django.test import RequestFactory
+        from textpix.urls import ReactIndexCache
+        
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.index_path = f"{self.tmpdir.name}/index.html"
+        with open(self.index_path, 'w', encoding='utf-8') as f:
+            f.write('<!DOCTYPE html><html><body>TextPix</body></html>' * 20)
+        
+        self.factory = RequestFactory()
+        self.cache = ReactIndexCache(self.index_path)
+        patcher = mock.patch('textpix.urls._react_index', self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.tmpdir.cleanup)
+    
+    def test_gzip_and_not_modified(self):
+        """测试预压缩版本和 ETag 条件请求"""
+        import gzip
+        from textpix.urls import serve_react
+        
+        response = serve_react(self.factory.get('/', HTTP_ACCEPT_ENCODING='gzip'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertIn(b'TextPix', gzip.decompress(response.content))
+        
+        response = serve_react(self.factory.get('/', HTTP_IF_NONE_MATCH=response['ETag']))
+        self.assertEqual(response.status_code, 304)
+    
+    def test_reload_on_mtime_change(self):
+        """测试文件修改后重新加载"""
+        import os
+        from textpix.urls import serve_react
+        
+        etag = serve_react(self.factory.get('/'))['ETag']
+        old = self.cache.load()
+        with open(self.index_path, 'w', encoding='utf-8') as f:
+            f.write('<html>new build</html>')
+        stat = os.stat(self.index_path)
+        os.utime(self.index_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        
+        response = serve_react(self.factory.get('/', HTTP_IF_NONE_MATCH=etag))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'<html>new build</html>')
+        # 重新加载替换整个快照，之前取得的快照保持一致不变
+        self.assertEqual(old.etag, etag)
+        self.assertIn(b'TextPix', old.variants['identity'])
+        self.assertIsNot(self.cache.load(), old)
+
+
+class AIServiceTestCase(TestCase):
+    """AI 服务测试用例"""
+    
+    def test_replay_generator(self):
+        """测试回放录制的上游响应：内容一致，按倍速保留原始的 token 节奏"""
+        import httpx
+        from .ai_service import CustomAIGenerator
+        from .event_loop import background_loop
+        from .replay import ReplayTransport
+        
+        fixture = os.path.join(UPSTREAM_FIXTURES, 'f6901cc3dac9202c.json')
+        
+        def replay(speed):
+            generator = CustomAIGenerator('https://api.example.com/v1', 'sk-test-key', 'test-model')
+            generator._client = httpx.AsyncClient(transport=ReplayTransport.from_path(fixture, speed=speed))
+            
+            async def run():
+                started = time.monotonic()
+                chunks = []
+                async for chunk in generator.generate_content_stream('测试主题', '这是测试内容描述'):
+                    chunks.append((time.monotonic() - started, chunk))
+                return chunks
+            return background_loop.run(run(), timeout=10)
+        
+        with open(fixture, encoding='utf-8') as f:
+            recorded = json.load(f)
+        duration = recorded['events'][-1][0]
+        
+        fast = replay(0)
+        self.assertLess(fast[-1][0], duration / 10)
+        self.assertEqual(json.loads(''.join(c for _, c in fast))['title'], '测试主题：一份实用指南')
+        
+        paced = replay(10)
+        self.assertEqual([c for _, c in paced], [c for _, c in fast])
+        self.assertGreaterEqual(paced[-1][0], duration / 10 * 0.9)
+        # 首 token 时间同样按倍速回放
+        first_token = next(at for at, line in recorded['events'] if '"content": "{' in line)
+        self.assertGreaterEqual(paced[0][0], first_token / 10 * 0.9)
+    
+    def test_get_ai_generator(self):
+        """测试获取 AI 生成器"""
+        from .ai_service import CustomAIGenerator, get_ai_generator
+        
+        with mock.patch('contentgenerater.ai_service._generator', None):
+            with mock.patch('contentgenerater.config.CUSTOM_AI_BASE_URL', ''):
+                with self.assertRaises(ValueError):
+                    get_ai_generator()
+        
+        with mock.patch('contentgenerater.ai_service._generator', None), \
+                mock.patch('contentgenerater.config.CUSTOM_AI_BASE_URL', 'https://api.example.com/v1'), \
+                mock.patch('contentgenerater.config.CUSTOM_AI_API_KEY', 'sk-test-key'):
+            generator = get_ai_generator()
+            self.assertIsInstance(generator, CustomAIGenerator)
+            self.assertIs(get_ai_generator(), generator)
         
-        generator = get_ai_generator()
-        self.assertIsInstance(generator, MockAIGenerator)
+        # 回放录制时不需要上游地址和密钥
+        with mock.patch('contentgenerater.ai_service._generator', None), \
+                mock.patch('contentgenerater.config.CUSTOM_AI_BASE_URL', ''), \
+                mock.patch('contentgenerater.config.AI_REPLAY_DIR', UPSTREAM_FIXTURES):
+            self.assertIsInstance(get_ai_generator(), CustomAIGenerator)
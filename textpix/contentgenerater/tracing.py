@@ -0,0 +1,338 @@
+"""
+轻量级请求追踪
+- span(): 记录一段耗时（嵌套关系通过 contextvars 传递，跨后台事件循环同样有效）
+- 请求 ID 通过 contextvars 传递到日志（RequestIdFilter）和 SSE 响应头
+- 采样在根 span 决定，子 span 继承；导出到本地 JSONL 文件或 OTLP/HTTP JSON 接口
+
+注意：本模块在 settings.LOGGING 加载时导入（RequestIdFilter），配置在首次导出时才读取
+"""
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+import urllib.request
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_current_span = contextvars.ContextVar('textpix_current_span', default=None)
+_request_id = contextvars.ContextVar('textpix_request_id', default=None)
+
+_TRACEPARENT_RE = re.compile(r'^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+_REQUEST_ID_RE = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+
+def _new_id(length: int) -> str:
+    return uuid.uuid4().hex[:length]
+
+
+def get_request_id() -> Optional[str]:
+    return _request_id.get()
+
+
+def get_current_span():
+    return _current_span.get()
+
+
+def new_request_id(incoming: str = None) -> str:
+    """复用客户端传入的合法请求 ID，否则生成新的"""
+    if incoming and _REQUEST_ID_RE.match(incoming):
+        return incoming
+    return uuid.uuid4().hex
+
+
+class Span:
+    """一段被追踪的操作"""
+
+    def __init__(self, name: str, parent: 'Span' = None, attributes: Dict = None,
+                 trace_id: str = None, parent_id: str = None, sampled: bool = None):
+        self.name = name
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent else (trace_id or _new_id(32))
+        self.span_id = _new_id(16)
+        self.parent_id = parent.span_id if parent else parent_id
+        self.sampled = parent.sampled if parent else (sampled if sampled is not None else _should_sample())
+        self.attributes = dict(attributes or {})
+        self.events = []
+        self.status = 'ok'
+        self.start_ns = time.time_ns()
+        self._start_perf = time.perf_counter()
+        self.end_ns = None
+        request_id = _request_id.get()
+        if request_id and parent is None:
+            self.attributes.setdefault('request_id', request_id)
+
+    @property
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self._start_perf) * 1000
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def add_event(self, name: str, **attributes):
+        self.events.append({'name': name, 'time_ns': time.time_ns(), 'attributes': attributes})
+
+    def set_error(self, error: BaseException):
+        self.status = 'error'
+        self.attributes['error'] = f"{type(error).__name__}: {error}"
+
+    def end(self):
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if self.sampled:
+            get_exporter().export(self)
+
+    def to_dict(self) -> Dict:
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start_ns': self.start_ns,
+            'end_ns': self.end_ns,
+            'duration_ms': round((self.end_ns - self.start_ns) / 1e6, 3) if self.end_ns else None,
+            'status': self.status,
+            'attributes': self.attributes,
+            'events': self.events,
+        }
+
+
+def _should_sample() -> bool:
+    from . import config
+
+    rate = config.TRACE_SAMPLE_RATE
+    return rate >= 1.0 or random.random() < rate
+
+
+def parse_traceparent(header: str):
+    """解析 W3C traceparent 头，返回 (trace_id, parent_span_id, sampled)"""
+    match = _TRACEPARENT_RE.match((header or '').strip().lower())
+    if not match:
+        return None
+    trace_id, parent_id, flags = match.groups()
+    return trace_id, parent_id, bool(int(flags, 16) & 1)
+
+
+def start_span(name: str, **attributes) -> Span:
+    """创建当前 span 的子 span，但不设为当前 span；用于不能用 with 包住的阶段，需手动 end()"""
+    return Span(name, parent=_current_span.get(), attributes=attributes)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    追踪一段操作
+
+    用法:
+        with span('upstream.connect', url=url) as s:
+            ...
+            s.add_event('first_token')
+    """
+    current = Span(name, parent=_current_span.get(), attributes=attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except (GeneratorExit, KeyboardInterrupt):
+        current.set_attribute('cancelled', True)
+        raise
+    except BaseException as e:
+        if type(e).__name__ == 'CancelledError':
+            current.set_attribute('cancelled', True)
+        else:
+            current.set_error(e)
+        raise
+    finally:
+        current.end()
+        try:
+            _current_span.reset(token)
+        except ValueError:
+            # 异步生成器在其他上下文中被关闭时无法还原，忽略即可
+            pass
+
+
+@contextmanager
+def request_trace(name: str, request_id: str, traceparent: str = None, **attributes):
+    """开启一个请求级别的根 span，并把请求 ID 放入上下文"""
+    id_token = _request_id.set(request_id)
+    parent = parse_traceparent(traceparent)
+    root = Span(
+        name,
+        attributes={'request_id': request_id, **attributes},
+        trace_id=parent[0] if parent else None,
+        parent_id=parent[1] if parent else None,
+        sampled=(parent[2] or _should_sample()) if parent else None,
+    )
+    token = _current_span.set(root)
+    try:
+        yield root
+    except BaseException as e:
+        if not isinstance(e, GeneratorExit):
+            root.set_error(e)
+        raise
+    finally:
+        root.end()
+        for var, tok in ((_current_span, token), (_request_id, id_token)):
+            try:
+                var.reset(tok)
+            except ValueError:
+                pass
+
+
+class RequestIdFilter(logging.Filter):
+    """把当前请求 ID 和 trace ID 写入日志记录"""
+
+    def filter(self, record):
+        request_id = _request_id.get()
+        if request_id and not hasattr(record, 'request_id'):
+            record.request_id = request_id
+            current = _current_span.get()
+            if current is not None and current.sampled:
+                record.trace_id = current.trace_id
+        return True
+
+
+# ==================== 导出 ====================
+
+class SpanExporter:
+    """后台线程批量导出 span：none | file（JSONL）| otlp（OTLP/HTTP JSON）"""
+
+    def __init__(self, kind: str = 'none', file_path: str = '', endpoint: str = '',
+                 service_name: str = 'textpix', batch_size: int = 100, interval: float = 1.0):
+        self.kind = kind
+        self.file_path = file_path
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.batch_size = batch_size
+        self.interval = interval
+        self._queue = queue.Queue(maxsize=10000)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def export(self, span_obj: Span):
+        if self.kind == 'none':
+            return
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(span_obj.to_dict())
+        except queue.Full:
+            metrics.inc('trace_spans_dropped_total')
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name='span-exporter', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self.flush_batch(batch)
+
+    def flush_batch(self, batch):
+        try:
+            if self.kind == 'file':
+                self._write_file(batch)
+            elif self.kind == 'otlp':
+                self._post_otlp(batch)
+            metrics.inc('trace_spans_exported_total', len(batch), exporter=self.kind)
+        except Exception as e:
+            metrics.inc('trace_spans_dropped_total', len(batch))
+            logger.warning(f"span 导出失败: {e}")
+
+    def _write_file(self, batch):
+        directory = os.path.dirname(self.file_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.file_path, 'a', encoding='utf-8') as f:
+            for item in batch:
+                f.write(json.dumps(item, ensure_ascii=False, default=str) + '\n')
+
+    def _post_otlp(self, batch):
+        body = json.dumps(to_otlp(batch, self.service_name), default=str).encode('utf-8')
+        request = urllib.request.Request(
+            self.endpoint, data=body, headers={'Content-Type': 'application/json'}, method='POST'
+        )
+        with urllib.request.urlopen(request, timeout=5) as response:
+            response.read()
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def _otlp_attributes(attributes: Dict):
+    return [{'key': key, 'value': _otlp_value(value)} for key, value in attributes.items()]
+
+
+def to_otlp(batch, service_name: str = 'textpix') -> Dict:
+    """转换为 OTLP/HTTP JSON 格式（ExportTraceServiceRequest）"""
+    spans = []
+    for item in batch:
+        spans.append({
+            'traceId': item['trace_id'],
+            'spanId': item['span_id'],
+            'parentSpanId': item['parent_id'] or '',
+            'name': item['name'],
+            'kind': 1,
+            'startTimeUnixNano': str(item['start_ns']),
+            'endTimeUnixNano': str(item['end_ns']),
+            'attributes': _otlp_attributes(item['attributes']),
+            'events': [
+                {'timeUnixNano': str(e['time_ns']), 'name': e['name'], 'attributes': _otlp_attributes(e['attributes'])}
+                for e in item['events']
+            ],
+            'status': {'code': 2 if item['status'] == 'error' else 1},
+        })
+    return {
+        'resourceSpans': [{
+            'resource': {'attributes': _otlp_attributes({'service.name': service_name})},
+            'scopeSpans': [{'scope': {'name': 'contentgenerater'}, 'spans': spans}],
+        }]
+    }
+
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def get_exporter() -> SpanExporter:
+    global _exporter
+
+    if _exporter is None:
+        with _exporter_lock:
+            if _exporter is None:
+                from . import config
+
+                _exporter = SpanExporter(
+                    kind=config.TRACE_EXPORTER,
+                    file_path=config.TRACE_FILE,
+                    endpoint=config.TRACE_OTLP_ENDPOINT,
+                    service_name=config.TRACE_SERVICE_NAME,
+                )
+    return _exporter
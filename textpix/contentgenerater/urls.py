@@ -10,6 +10,23 @@ urlpatterns = [
     # 流式内容生成
     path('generate-stream', views.generate_content_stream, name='generate-stream'),
     
+    # 已保存的文章（分享链接）
+    path('articles/<str:content_id>.png', views.article_image, name='article-image'),
+    path('articles/<str:content_id>', views.article_detail, name='article-detail'),
+    
+    # 同一次请求生成的多个版本
+    path('variants/<str:group_id>', views.variant_group, name='variant-group'),
+    
+    # JSON 渲染为 PNG
+    path('render-image', views.render_image, name='render-image'),
+    
     # 内容优化
     path('optimize', views.optimize_content, name='optimize'),
+    
+    # 进程内指标
+    path('metrics', views.metrics_view, name='metrics'),
+    
+    # 存活 / 就绪检查
+    path('health', views.health, name='health'),
+    path('ready', views.ready, name='ready'),
 ]
@@ -0,0 +1,57 @@
+"""
+多版本生成
+一次请求生成多个版本供编辑比较：上游支持 n 时一次调用返回多个 choice，否则并发多次调用；
+各版本的输出按到达顺序交错返回，用版本序号区分
+"""
+import asyncio
+from typing import AsyncGenerator, Sequence, Tuple, Union
+
+_DONE = object()
+
+
+async def merge_streams(
+    streams: Sequence[AsyncGenerator[str, None]],
+    indices: Sequence[int] = None,
+) -> AsyncGenerator[Tuple[int, Union[str, Exception]], None]:
+    """
+    并发读取多个流，按到达顺序交错返回
+
+    Args:
+        streams: 各版本的内容流
+        indices: 各流对应的版本序号（默认 0, 1, 2...）
+
+    Yields:
+        (版本序号, 内容片段)；某个版本出错时返回 (版本序号, 异常)，其余版本继续
+    """
+    if indices is None:
+        indices = range(len(streams))
+    queue = asyncio.Queue()
+
+    async def drain(index: int, stream: AsyncGenerator[str, None]):
+        try:
+            async for chunk in stream:
+                queue.put_nowait((index, chunk))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            queue.put_nowait((index, e))
+        finally:
+            await stream.aclose()
+        queue.put_nowait((index, _DONE))
+
+    tasks = [asyncio.ensure_future(drain(index, stream)) for index, stream in zip(indices, streams)]
+    remaining = len(tasks)
+    try:
+        while remaining:
+            index, item = await queue.get()
+            if item is _DONE:
+                remaining -= 1
+                continue
+            yield index, item
+    finally:
+        # 客户端断开或出错时取消尚未完成的版本
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
@@ -1,19 +1,36 @@
 """内容生成 API 视图"""
 import json
-import asyncio
 import logging
-from django.http import StreamingHttpResponse
+import time
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
-from rest_framework import status
+from rest_framework import serializers, status
 
 from .serializers import GenerateRequestSerializer
-from .ai_service import get_ai_generator
+from .admission import QueueTimeout, generation_queue
+from .ai_service import get_ai_generator, get_initialized_generator, get_tenant_generator, get_tenant_pool, parse_credentials
+from .articles import get_article, get_variant_group, make_etag, save_article, save_variant_group
+from .circuit_breaker import CircuitOpenError
+from .streaming_renderer import extract_json_from_text
+from .event_loop import background_loop
+from .metrics import metrics
+from .stream_buffer import IDLE, StreamPump, iterate_in_thread
+from .tracing import new_request_id, request_trace, span
+from . import profiling
+from . import config
+from .semantic_cache import generation_cache
+from .optimizer import CHUNK_SEPARATOR, optimize_markdown, optimize_markdown_stream
 
 logger = logging.getLogger(__name__)
 
+# SSE 注释行：客户端忽略，只用于保持连接活跃
+HEARTBEAT = ": heartbeat\n\n"
+
 
 @csrf_exempt
 @require_http_methods(["POST"])
@@ -28,87 +45,58 @@ def generate_content_stream(request):
         "theme": "主题/关键词",
         "content": "内容描述",
         "images": ["image_url_1"],
-        "templateType": "normal"  // normal | wechat
+        "templateType": "normal",  // normal | wechat
+        "mode": "single",          // single | outline（先生成大纲再并行生成各版块）
+        "variants": 1,             // 版本数，大于 1 时各版本交错返回
+        "cache": true              // 是否允许复用近似重复请求的结果
     }
     
     响应: Server-Sent Events (SSE)
+    event: accepted
+    data: {"requestId": "..."}
+    event: phase
+    data: {"phase": "connecting"}         // connecting | generating | saving
     data: {"content": "{\"title\": ...}"}
+    data: {"articleId": "...", "url": "/api/articles/..."}
+    data: [DONE]
+    
+    多版本（variants > 1）时每个事件带版本序号，最后返回整组的 ID:
+    data: {"index": 1, "content": "..."}
+    data: {"index": 0, "articleId": "...", "url": "/api/articles/..."}
+    data: {"groupId": "...", "url": "/api/variants/..."}
     data: [DONE]
     
+    命中近似重复缓存时先发送 data: {"cache": {"hit": true, "similarity": 0.93}}，再一次性发送内容
+    
+    accepted 在解析请求前立即发送，客户端据此确认连接已建立；排队时发送 event: queued（data: {"position": 2}），
+    排队或等待上游期间每 SSE_HEARTBEAT_INTERVAL 秒发送一行注释 ": heartbeat"
+    
     注意: 返回的是JSON格式数据，前端负责渲染成HTML
     """
     
+    # 请求 ID：沿用客户端传入的 X-Request-ID，否则生成；写入日志、追踪和响应头
+    request_id = new_request_id(request.headers.get('X-Request-ID'))
+    traceparent = request.headers.get('traceparent')
+    
     def event_stream():
         """SSE 事件流生成器 - 实时流式传输"""
-        try:
-            # 解析请求数据
-            data = json.loads(request.body)
-            
-            # 验证数据
-            serializer = GenerateRequestSerializer(data=data)
-            if not serializer.is_valid():
-                error_msg = json.dumps({"error": "请求参数错误", "details": serializer.errors})
-                yield f"data: {error_msg}\n\n"
-                return
-            
-                                                                        # 获取参数
-            validated_data = serializer.validated_data
-            theme = validated_data['theme']
-            content = validated_data['content']
-            images = validated_data.get('images', [])
-            template_type = validated_data.get('templateType', 'normal')
-            
-            logger.info(f"开始流式生成内容 - 主题: {theme}, 模板: {template_type}")
-            
-            # 调用 AI 生成服务
-            generator = get_ai_generator()
-            
-            # 创建新的事件循环
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            
-            try:
-                                                                # 创建异步生成器（传入模板类型）
-                async_gen = generator.generate_content_stream(theme, content, images, template_type)
-                
-                chunk_count = 0
-                # 关键：逐个处理并立即 yield，不要等待全部完成
-                while True:
-                    try:
-                        # 获取下一个块
-                        chunk = loop.run_until_complete(async_gen.__anext__())
-                        
-                        if chunk:
-                            chunk_count += 1
-                            # 立即发送 SSE 格式的数据
-                            data_json = json.dumps({"content": chunk})
-                            yield f"data: {data_json}\n\n"
-                    
-                    except StopAsyncIteration:
-                        # 异步迭代结束
-                        break
-                    except Exception as e:
-                        logger.error(f"处理数据块失败: {e}")
-                        break
-                
-                                # 发送完成信号
-                yield "data: [DONE]\n\n"
-                logger.info(f"流式生成完成 - 主题: {theme}, 共发送 {chunk_count} 个数据块")
-                
-            finally:
-                loop.close()
-                
-        except json.JSONDecodeError:
-            error_msg = json.dumps({"error": "无效的 JSON 数据"})
-            yield f"data: {error_msg}\n\n"
-        except Exception as e:
-            logger.error(f"流式生成失败: {str(e)}", exc_info=True)
-            error_msg = json.dumps({"error": str(e)})
-            yield f"data: {error_msg}\n\n"
+        with request_trace('generate_content_stream', request_id, traceparent) as root_span:
+            # 立即发送响应头和 accepted 事件，不等待请求解析和上游连接
+            yield _sse_event('accepted', {'requestId': request_id})
+            yield from _generate_events(request, root_span)
+    
+    stream = event_stream()
+    # 按配置剖析本次请求（包括后台事件循环中的生成步骤）
+    profile = profiling.start_profile(request, request_id)
+    if profile is not None:
+        stream = profile.wrap_iterator(stream)
+    if isinstance(request, ASGIRequest):
+        # ASGI 下同步迭代器会被整个读完后才发送，改为在线程中迭代并逐个事件发送
+        stream = iterate_in_thread(stream)
     
     # 返回 SSE 响应
     response = StreamingHttpResponse(
-        event_stream(),
+        stream,
         content_type='text/event-stream'
     )
     response['Cache-Control'] = 'no-cache'
@@ -116,23 +104,422 @@ def generate_content_stream(request):
     # CORS 头（如果需要）
     response['Access-Control-Allow-Origin'] = '*'
     response['Access-Control-Allow-Methods'] = 'POST, OPTIONS'
-    response['Access-Control-Allow-Headers'] = 'Content-Type'
+    response['Access-Control-Allow-Headers'] = 'Content-Type, X-Request-ID, traceparent, X-AI-API-Key, X-AI-Base-URL, X-AI-Model'
+    response['Access-Control-Expose-Headers'] = 'X-Request-ID'
+    response['X-Request-ID'] = request_id
+    
+    return response
+
+
+def _generate_events(request, root_span):
+    """解析请求、调用生成器并逐块产出 SSE 事件"""
+    try:
+        # 解析并验证请求数据
+        with span('request.parse'):
+            data = json.loads(request.body)
+            serializer = GenerateRequestSerializer(data=data)
+            valid = serializer.is_valid()
+        if not valid:
+            error_msg = json.dumps({"error": "请求参数错误", "details": serializer.errors})
+            yield f"data: {error_msg}\n\n"
+            return
+        
+        # 获取参数
+        validated_data = serializer.validated_data
+        theme = validated_data['theme']
+        content = validated_data['content']
+        images = validated_data.get('images', [])
+        template_type = validated_data.get('templateType', 'normal')
+        variants = validated_data.get('variants', 1)
+        root_span.set_attribute('template_type', template_type)
+        
+        logger.info(f"开始流式生成内容 - 主题: {theme[:config.LOG_PAYLOAD_CHARS]}, 模板: {template_type}", extra={'sample': 'request'})
+        
+        # 调用 AI 生成服务（请求携带租户凭据时使用该租户的连接池）
+        try:
+            credentials = parse_credentials(request.headers)
+        except ValueError as e:
+            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+            return
+        if credentials is not None:
+            root_span.set_attribute('key_id', credentials.key_id)
+            generator = get_tenant_generator(credentials)
+        else:
+            generator = get_ai_generator()
+        
+        if variants > 1:
+            root_span.set_attribute('variants', variants)
+            yield from _admitted(_variant_events(generator, theme, content, images, template_type, variants, root_span), root_span)
+            return
+        
+        # 近似重复的请求直接复用已生成的结果（按模板、模型、租户和图片隔离）
+        cache_partition = None
+        if config.ENABLE_CACHE and validated_data.get('cache', True):
+            cache_partition = (template_type, generator.model_name,
+                               credentials.key_id if credentials is not None else '', tuple(images))
+            with span('cache.lookup') as lookup_span:
+                hit = generation_cache.lookup(cache_partition, theme, content)
+                lookup_span.set_attribute('hit', hit is not None)
+            if hit is not None:
+                yield from _cached_events(*hit, root_span)
+                return
+        
+        yield from _admitted(_single_events(generator, validated_data, cache_partition, root_span), root_span)
+            
+    except json.JSONDecodeError:
+        error_msg = json.dumps({"error": "无效的 JSON 数据"})
+        yield f"data: {error_msg}\n\n"
+    except Exception as e:
+        root_span.set_error(e)
+        logger.error(f"流式生成失败: {str(e)}", exc_info=True)
+        error_msg = json.dumps(_error_payload(e))
+        yield f"data: {error_msg}\n\n"
+
+
+def _sse_event(name, data):
+    """具名 SSE 事件（accepted / queued / phase）；只处理 data 行的客户端会忽略它们"""
+    return f"event: {name}\ndata: {json.dumps(data)}\n\n"
+
+
+def _heartbeat():
+    metrics.inc('sse_heartbeats_total')
+    return HEARTBEAT
+
+
+def _admitted(events, root_span):
+    """
+    取得生成名额后再产出 events 的事件（此前不会调用上游）
+
+    排队时推送排队位置（变化时）和心跳；超过 SSE_QUEUE_TIMEOUT 时返回可重试的错误
+    """
+    ticket = generation_queue.enter()
+    try:
+        if not ticket.admitted:
+            interval = config.SSE_HEARTBEAT_INTERVAL
+            position = None
+            last_sent = ticket.entered
+            while not ticket.admitted:
+                now = time.monotonic()
+                current = generation_queue.position(ticket)
+                if current and current != position:
+                    position = current
+                    last_sent = now
+                    yield _sse_event('queued', {'position': position})
+                elif interval and now - last_sent >= interval:
+                    last_sent = now
+                    yield _heartbeat()
+                waited = now - ticket.entered
+                if waited >= config.SSE_QUEUE_TIMEOUT:
+                    metrics.inc('sse_queue_timeouts_total')
+                    logger.warning(f"排队超时 - 已等待 {waited:.1f} 秒")
+                    yield f"data: {json.dumps(_error_payload(QueueTimeout(waited)))}\n\n"
+                    return
+                generation_queue.wait(ticket, min(1.0, interval or 1.0, config.SSE_QUEUE_TIMEOUT - waited))
+            root_span.set_attribute('queue_wait_ms', round((time.monotonic() - ticket.entered) * 1000, 1))
+        yield from events
+    finally:
+        generation_queue.leave(ticket)
+
+
+def _single_events(generator, validated_data, cache_partition, root_span):
+    """单版本生成：逐块转发上游输出，完成后保存文章并写入缓存"""
+    theme = validated_data['theme']
+    content = validated_data['content']
+    images = validated_data.get('images', [])
+    template_type = validated_data.get('templateType', 'normal')
+    
+    # 创建异步生成器（传入模板类型），在后台事件循环中执行以复用上游连接池
+    if validated_data.get('mode') == 'outline':
+        root_span.set_attribute('mode', 'outline')
+        async_gen = generator.generate_outline_stream(theme, content, images, template_type)
+    else:
+        async_gen = generator.generate_content_stream(theme, content, images, template_type)
+    
+    # 上游读取作为独立任务写入有界缓冲区，慢客户端不会拖慢上游读取
+    pump = StreamPump(profiling.wrap_async(async_gen)).start()
+    yield _sse_event('phase', {'phase': 'connecting'})
+    
+    chunk_count = 0
+    chunks = []
+    failed = False
+    # 关键：逐个处理并立即 yield，不要等待全部完成
+    try:
+        for chunk in pump.iter_idle(config.SSE_HEARTBEAT_INTERVAL or None):
+            if chunk is IDLE:
+                yield _heartbeat()
+            elif chunk:
+                if not chunk_count:
+                    yield _sse_event('phase', {'phase': 'generating'})
+                chunk_count += 1
+                chunks.append(chunk)
+                # 立即发送 SSE 格式的数据
+                data_json = json.dumps({"content": chunk})
+                yield f"data: {data_json}\n\n"
+    except Exception as e:
+        # 上游超时/停滞等错误：明确告知客户端，不保存不完整的文章
+        failed = True
+        root_span.set_error(e)
+        logger.error(f"处理数据块失败: {e}")
+        yield f"data: {json.dumps(_error_payload(e))}\n\n"
+    
+    # 保存文章，返回分享用的内容 ID
+    article_event = None
+    if not failed:
+        yield _sse_event('phase', {'phase': 'saving'})
+        article_event = _store_article(''.join(chunks), template_type, theme)
+    if article_event:
+        yield f"data: {json.dumps(article_event)}\n\n"
+        # 只缓存能解析、已保存的结果
+        if cache_partition is not None:
+            generation_cache.add(cache_partition, theme, content, {"text": ''.join(chunks), "article": article_event})
     
+    # 发送完成信号
+    yield "data: [DONE]\n\n"
+    root_span.set_attribute('chunks', chunk_count)
+    logger.info(f"流式生成完成 - 共发送 {chunk_count} 个数据块", extra={'sample': 'request'})
+
+
+def _cached_events(cached, similarity, root_span):
+    """命中近似重复缓存：先告知客户端，再一次性发送缓存的内容"""
+    root_span.set_attribute('cache_similarity', round(similarity, 3))
+    logger.info(f"命中近似重复缓存 - 相似度 {similarity:.2f}", extra={'sample': 'request'})
+    yield f"data: {json.dumps({'cache': {'hit': True, 'similarity': round(similarity, 3)}})}\n\n"
+    yield f"data: {json.dumps({'content': cached['text']})}\n\n"
+    yield f"data: {json.dumps(cached['article'])}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+def _variant_events(generator, theme, content, images, template_type, variants, root_span):
+    """多版本生成：各版本的数据块按到达顺序交错发送，完成后分别保存并缓存为一组"""
+    async_gen = generator.generate_variants_stream(theme, content, images, template_type, variants)
+    pump = StreamPump(profiling.wrap_async(async_gen)).start()
+    yield _sse_event('phase', {'phase': 'connecting'})
+    
+    texts = [[] for _ in range(variants)]
+    failed = set()
+    chunk_count = 0
+    try:
+        for entry in pump.iter_idle(config.SSE_HEARTBEAT_INTERVAL or None):
+            if entry is IDLE:
+                yield _heartbeat()
+                continue
+            index, item = entry
+            if isinstance(item, Exception):
+                # 单个版本失败不影响其他版本
+                failed.add(index)
+                logger.error(f"版本 {index} 生成失败: {item}")
+                yield f"data: {json.dumps({'index': index, **_error_payload(item)})}\n\n"
+            elif item:
+                if not chunk_count:
+                    yield _sse_event('phase', {'phase': 'generating'})
+                chunk_count += 1
+                texts[index].append(item)
+                yield f"data: {json.dumps({'index': index, 'content': item})}\n\n"
+    except Exception as e:
+        failed.update(range(variants))
+        root_span.set_error(e)
+        logger.error(f"处理数据块失败: {e}")
+        yield f"data: {json.dumps(_error_payload(e))}\n\n"
+    
+    if len(failed) < variants:
+        yield _sse_event('phase', {'phase': 'saving'})
+    article_ids = []
+    for index in range(variants):
+        article_event = None if index in failed else _store_article(''.join(texts[index]), template_type, theme)
+        if article_event:
+            article_ids.append(article_event['articleId'])
+            yield f"data: {json.dumps({'index': index, **article_event})}\n\n"
+    if article_ids:
+        group_id = save_variant_group(article_ids)
+        yield f"data: {json.dumps({'groupId': group_id, 'url': f'/api/variants/{group_id}'})}\n\n"
+    
+    yield "data: [DONE]\n\n"
+    root_span.set_attribute('chunks', chunk_count)
+    logger.info(f"多版本生成完成 - {variants} 个版本，共发送 {chunk_count} 个数据块", extra={'sample': 'request'})
+
+
+def _error_payload(error):
+    """SSE 错误事件；带 code 的错误（超时、熔断等）附带错误码和是否可重试"""
+    payload = {"error": str(error)}
+    code = getattr(error, 'code', None)
+    if code:
+        payload["code"] = code
+        payload["retryable"] = getattr(error, 'retryable', False)
+        if getattr(error, 'phase', None):
+            payload["phase"] = error.phase
+        if getattr(error, 'retry_after', None) is not None:
+            payload["retry_after"] = max(1, round(error.retry_after))
+    return payload
+
+
+def _store_article(text, template_type, theme):
+    """解析最终 JSON 并保存文章，返回 SSE 事件数据（失败时返回 None）"""
+    if not config.ARTICLE_STORE_ENABLED or not text:
+        return None
+    
+    try:
+        with span('article.store', length=len(text)):
+            data = extract_json_from_text(text)
+            article = save_article(data, template_type, theme)
+    except Exception as e:
+        logger.warning(f"文章保存失败: {e}")
+        return None
+    
+    return {
+        "articleId": article.content_id,
+        "url": f"/api/articles/{article.content_id}",
+    }
+
+
+@require_http_methods(["GET", "HEAD"])
+def article_detail(request, content_id):
+    """
+    读取已保存的文章
+    
+    GET /api/articles/<content_id>            渲染好的 HTML
+    GET /api/articles/<content_id>?format=json 原始 JSON
+    
+    内容 ID 即 ETag，客户端带 If-None-Match 时直接返回 304，不查缓存和数据库
+    """
+    etag = make_etag(content_id)
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
+    
+    entry = get_article(content_id)
+    if entry is None:
+        return JsonResponse({"success": False, "message": "文章不存在"}, status=404)
+    
+    if request.GET.get('format') == 'json':
+        response = JsonResponse({
+            "success": True,
+            "articleId": entry['content_id'],
+            "templateType": entry['template_type'],
+            "data": entry['data'],
+        }, json_dumps_params={'ensure_ascii': False})
+    else:
+        response = HttpResponse(entry['html'], content_type='text/html; charset=utf-8')
+    
+    response['ETag'] = etag
+    response['Cache-Control'] = 'public, max-age=3600'
+    return response
+
+
+@require_http_methods(["GET"])
+def variant_group(request, group_id):
+    """
+    读取同一次请求生成的一组版本
+    
+    GET /api/variants/<group_id>
+    
+    响应:
+    {
+        "success": true,
+        "groupId": "...",
+        "variants": [{"articleId": "...", "url": "/api/articles/...", "templateType": "normal", "data": {...}}]
+    }
+    """
+    entries = get_variant_group(group_id)
+    if entries is None:
+        return JsonResponse({"success": False, "message": "版本组不存在或已过期"}, status=404)
+    
+    return JsonResponse({
+        "success": True,
+        "groupId": group_id,
+        "variants": [
+            {
+                "articleId": entry['content_id'],
+                "url": f"/api/articles/{entry['content_id']}",
+                "templateType": entry['template_type'],
+                "data": entry['data'],
+            }
+            for entry in entries
+        ],
+    }, json_dumps_params={'ensure_ascii': False})
+
+
+@require_http_methods(["GET", "HEAD"])
+def article_image(request, content_id):
+    """
+    已保存文章的 PNG 图片
+    
+    GET /api/articles/<content_id>.png
+    """
+    etag = f'"{content_id}-png"'
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
+    
+    entry = get_article(content_id)
+    if entry is None:
+        return JsonResponse({"success": False, "message": "文章不存在"}, status=404)
+    
+    # PIL 和进程池只在需要渲染图片时才导入
+    from .rasterizer import get_png
+    
+    try:
+        png = get_png(entry['data'], entry['template_type'])
+    except Exception as e:
+        logger.error(f"图片渲染失败: {str(e)}", exc_info=True)
+        return JsonResponse({"success": False, "message": f"图片渲染失败: {str(e)}"}, status=500)
+    
+    response = HttpResponse(png, content_type='image/png')
+    response['ETag'] = etag
+    response['Cache-Control'] = 'public, max-age=86400'
     return response
 
 
+@csrf_exempt
+@require_http_methods(["POST"])
+def render_image(request):
+    """
+    将 JSON 内容渲染为 PNG 图片
+    
+    POST /api/render-image
+    
+    请求体:
+    {
+        "templateType": "normal",  // normal | wechat
+        "data": {"title": "...", ...}
+    }
+    
+    响应: image/png
+    """
+    try:
+        body = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({"success": False, "message": "无效的 JSON 数据"}, status=400)
+    
+    data = body.get('data') if isinstance(body, dict) else None
+    template_type = body.get('templateType', 'normal') if isinstance(body, dict) else 'normal'
+    if not isinstance(data, dict) or template_type not in ('normal', 'wechat'):
+        return JsonResponse({"success": False, "message": "请求参数错误"}, status=400)
+    
+    # PIL 和进程池只在需要渲染图片时才导入
+    from .rasterizer import get_png
+    
+    try:
+        png = get_png(data, template_type)
+    except Exception as e:
+        logger.error(f"图片渲染失败: {str(e)}", exc_info=True)
+        return JsonResponse({"success": False, "message": f"图片渲染失败: {str(e)}"}, status=500)
+    
+    return HttpResponse(png, content_type='image/png')
+
+
 @csrf_exempt
 @api_view(['POST'])
 def optimize_content(request):
     """
-    内容优化接口
+    内容优化接口 - 按段落/标题分块，并行调用模型优化
     
     POST /api/optimize
     
     请求体:
     {
         "markdown": "要优化的内容",
-        "type": "grammar"  // grammar | seo | readability | engagement
+        "type": "grammar",  // grammar | seo | readability | engagement
+        "stream": false     // true 时以 SSE 按顺序逐块返回
     }
     
     响应:
@@ -140,10 +527,25 @@ def optimize_content(request):
         "success": true,
         "markdown": "优化后的内容"
     }
+    
+    流式响应: Server-Sent Events (SSE)
+    data: {"index": 0, "total": 3, "content": "优化后的第一块\n\n"}
+    data: [DONE]
     """
     try:
         markdown = request.data.get('markdown', '')
         optimization_type = request.data.get('type', 'grammar')
+        # 与其他布尔参数一致：接受 true/false、1/0、"true"/"false" 等写法，"false" 不会被当作真值
+        try:
+            stream = serializers.BooleanField().to_internal_value(request.data.get('stream', False))
+        except serializers.ValidationError:
+            return Response(
+                {
+                    "success": False,
+                    "message": "stream 必须是布尔值"
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
         if not markdown:
             return Response(
@@ -154,11 +556,26 @@ def optimize_content(request):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        logger.info(f"开始优化内容 - 类型: {optimization_type}")
+        logger.info(f"开始优化内容 - 类型: {optimization_type}, 长度: {len(markdown)}", extra={'sample': 'request'})
+        
+        try:
+            credentials = parse_credentials(request.headers)
+        except ValueError as e:
+            return Response({"success": False, "message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        generator = get_tenant_generator(credentials) if credentials is not None else get_ai_generator()
+        
+        if stream:
+            response = StreamingHttpResponse(
+                _optimize_event_stream(generator, markdown, optimization_type),
+                content_type='text/event-stream'
+            )
+            response['Cache-Control'] = 'no-cache'
+            response['X-Accel-Buffering'] = 'no'  # 禁用 Nginx 缓冲
+            return response
         
-        # TODO: 实现内容优化逻辑
-        # 这里可以调用 AI 模型进行内容优化
-        optimized_markdown = markdown  # 暂时返回原内容
+        optimized_markdown = background_loop.run(
+            optimize_markdown(generator, markdown, optimization_type)
+        )
         
         return Response(
             {
@@ -168,6 +585,14 @@ def optimize_content(request):
             status=status.HTTP_200_OK
         )
         
+    except CircuitOpenError as e:
+        logger.warning(f"内容优化失败: {str(e)}")
+        response = Response(
+            {"success": False, "message": str(e), **_error_payload(e)},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+        response['Retry-After'] = str(max(1, round(e.retry_after)))
+        return response
     except Exception as e:
         logger.error(f"内容优化失败: {str(e)}", exc_info=True)
         return Response(
@@ -177,3 +602,101 @@ def optimize_content(request):
             },
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
+
+
+def _optimize_event_stream(generator, markdown, optimization_type):
+    """内容优化 SSE 事件流 - 分块完成一块发送一块（保持原始顺序）"""
+    async_gen = optimize_markdown_stream(generator, markdown, optimization_type)
+    
+    try:
+        # iterate 结束时会关闭生成器，取消未完成的分块
+        for index, total, chunk in background_loop.iterate(async_gen):
+            # 除最后一块外附带分隔符，前端直接拼接 content 即可还原文档
+            content = chunk if index == total - 1 else chunk + CHUNK_SEPARATOR
+            data_json = json.dumps({"index": index, "total": total, "content": content})
+            yield f"data: {data_json}\n\n"
+        
+        yield "data: [DONE]\n\n"
+        logger.info("内容优化完成", extra={'sample': 'request'})
+    
+    except Exception as e:
+        logger.error(f"内容优化失败: {str(e)}", exc_info=True)
+        error_msg = json.dumps(_error_payload(e))
+        yield f"data: {error_msg}\n\n"
+
+
+@api_view(['GET'])
+def metrics_view(request):
+    """
+    进程内指标
+    
+    GET /api/metrics
+    """
+    from .budget import output_usage
+    
+    data = metrics.snapshot()
+    # 各模板实际输出 token 数的分布和当前使用的 max_tokens
+    data['output_tokens'] = output_usage.snapshot()
+    return Response(data, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+def health(request):
+    """
+    存活检查接口
+    
+    GET /api/health
+    
+    响应:
+    {
+        "status": "ok",
+        "generator": {"model": "...", "warmed_up": true, "pool": {...}, "upstream": {...}},
+        "tenant_pools": {"pools": 3, "max_pools": 32, "active_streams": 1},  // 开启自带密钥时
+        "queue": {"active": 2, "waiting": 0, "limit": 4}
+    }
+    """
+    generator = get_initialized_generator()
+    return Response(
+        {
+            "status": "ok",
+            "generator": generator.status() if generator is not None else None,
+            "tenant_pools": get_tenant_pool().stats() if config.AI_BYOK_ENABLED else None,
+            "queue": generation_queue.stats(),
+        },
+        status=status.HTTP_200_OK
+    )
+
+
+@api_view(['GET'])
+def ready(request):
+    """
+    就绪检查接口 - 配置完整且（启用预热时）预热完成才返回 200
+    
+    GET /api/ready
+    
+    响应:
+    {
+        "ready": true,
+        "checks": {"configured": true, "warmed_up": true},
+        "generator": {...}
+    }
+    """
+    # 回放录制时不需要上游地址和密钥
+    configured = bool(config.AI_REPLAY_DIR or (config.CUSTOM_AI_API_KEY and config.CUSTOM_AI_BASE_URL))
+    generator = get_initialized_generator()
+    warmed_up = generator is not None and generator.status().get('warmed_up', False)
+    
+    is_ready = configured and (warmed_up or not config.AI_WARMUP_ON_STARTUP)
+    
+    return Response(
+        {
+            "ready": is_ready,
+            "checks": {
+                "configured": configured,
+                "warmup_enabled": config.AI_WARMUP_ON_STARTUP,
+                "warmed_up": warmed_up,
+            },
+            "generator": generator.status() if generator is not None else None,
+        },
+        status=status.HTTP_200_OK if is_ready else status.HTTP_503_SERVICE_UNAVAILABLE
+    )
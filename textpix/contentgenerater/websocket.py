@@ -0,0 +1,356 @@
+"""
+WebSocket 生成接口（ASGI）
+一个连接上可以同时进行多个生成，客户端随时发送取消消息即可中止对应的上游请求，
+服务端定时推送进度。不依赖 channels：在 textpix/asgi.py 中把 /api/ws 的 WebSocket 连接交给这里处理，
+其余请求仍由 Django 处理
+
+客户端消息（JSON 文本帧，id 由客户端指定，用于区分同一连接上的多个生成）:
+    {"type": "generate", "id": "a1", "theme": "...", "content": "...", "templateType": "normal", "cache": true}
+    {"type": "cancel", "id": "a1"}
+    {"type": "ping"}
+
+服务端消息:
+    {"type": "accepted", "id": "a1", "requestId": "..."}
+    {"type": "queued", "id": "a1", "position": 2}
+    {"type": "progress", "id": "a1", "phase": "waiting" | "generating", "chunks": 3, "chars": 120, "elapsedMs": 800}
+    {"type": "cache", "id": "a1", "hit": true, "similarity": 0.93}
+    {"type": "content", "id": "a1", "content": "..."}
+    {"type": "article", "id": "a1", "articleId": "...", "url": "/api/articles/..."}
+    {"type": "done", "id": "a1", "chunks": 12}
+    {"type": "cancelled", "id": "a1"}
+    {"type": "error", "id": "a1", "error": "...", "code": "...", "retryable": false}
+    {"type": "pong"}
+"""
+import asyncio
+import json
+import logging
+import time
+from contextlib import aclosing
+from typing import Dict
+
+from asgiref.sync import sync_to_async
+from django.utils.datastructures import CaseInsensitiveMapping
+
+from . import config
+from .admission import QueueTimeout, generation_queue
+from .event_loop import background_loop
+from .metrics import metrics
+from .tracing import new_request_id, request_trace, span
+
+logger = logging.getLogger(__name__)
+
+WEBSOCKET_PATH = '/api/ws'
+
+_END = object()
+
+
+class _Connection:
+    """一个 WebSocket 连接：读取客户端消息，每个生成在独立的任务中执行"""
+
+    def __init__(self, scope, send):
+        self.headers = CaseInsensitiveMapping({
+            name.decode('latin-1'): value.decode('latin-1') for name, value in scope.get('headers', [])
+        })
+        self._send = send
+        self._send_lock = asyncio.Lock()
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.closed = False
+
+    async def send(self, message: Dict):
+        """发送 JSON 消息（连接已关闭时丢弃）"""
+        if self.closed:
+            return
+        async with self._send_lock:
+            await self._send({'type': 'websocket.send', 'text': json.dumps(message, ensure_ascii=False)})
+
+    async def serve(self, receive):
+        message = await receive()
+        if message['type'] != 'websocket.connect':
+            return
+        await self._send({'type': 'websocket.accept'})
+        metrics.inc('websocket_connections_total')
+        metrics.add_gauge('websocket_connections_active', 1)
+        try:
+            while True:
+                message = await receive()
+                if message['type'] == 'websocket.disconnect':
+                    break
+                if message['type'] == 'websocket.receive':
+                    await self.handle(message.get('text') or (message.get('bytes') or b'').decode('utf-8', 'replace'))
+        finally:
+            # 客户端断开：中止这个连接上所有进行中的生成
+            self.closed = True
+            tasks = list(self.tasks.values())
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            metrics.add_gauge('websocket_connections_active', -1)
+
+    async def handle(self, text: str):
+        if len(text.encode('utf-8')) > config.WEBSOCKET_MAX_MESSAGE_BYTES:
+            await self.send({'type': 'error', 'error': '消息过大', 'code': 'message_too_large', 'retryable': False})
+            return
+        try:
+            message = json.loads(text)
+            kind = message.get('type')
+        except (ValueError, AttributeError):
+            await self.send({'type': 'error', 'error': '无效的 JSON 数据'})
+            return
+
+        if kind == 'ping':
+            await self.send({'type': 'pong'})
+            return
+
+        gen_id = message.get('id')
+        if not isinstance(gen_id, str) or not 0 < len(gen_id) <= 64:
+            await self.send({'type': 'error', 'error': '缺少 id（1-64 个字符的字符串）'})
+            return
+
+        if kind == 'cancel':
+            task = self.tasks.get(gen_id)
+            if task is not None:
+                task.cancel()
+            else:
+                await self.send({'type': 'error', 'id': gen_id, 'error': '没有进行中的生成', 'code': 'not_found', 'retryable': False})
+        elif kind == 'generate':
+            if gen_id in self.tasks:
+                await self.send({'type': 'error', 'id': gen_id, 'error': '该 id 的生成仍在进行', 'code': 'duplicate_id', 'retryable': False})
+            elif len(self.tasks) >= config.WEBSOCKET_MAX_GENERATIONS:
+                await self.send({'type': 'error', 'id': gen_id, 'error': f'每个连接最多同时进行 {config.WEBSOCKET_MAX_GENERATIONS} 个生成',
+                                 'code': 'too_many_generations', 'retryable': True})
+            else:
+                task = asyncio.ensure_future(self.generate(gen_id, message))
+                self.tasks[gen_id] = task
+                task.add_done_callback(lambda _, gen_id=gen_id: self.tasks.pop(gen_id, None))
+        else:
+            await self.send({'type': 'error', 'id': gen_id, 'error': f'未知的消息类型: {kind}'})
+
+    async def generate(self, gen_id: str, message: Dict):
+        """执行一个生成：上游在后台事件循环中读取，数据块经队列转发到本连接"""
+        from .views import _error_payload
+
+        request_id = new_request_id(message.get('requestId'))
+        started = time.monotonic()
+        progress = {'phase': 'waiting', 'chunks': 0, 'chars': 0}
+        result = 'error'
+
+        with request_trace('websocket.generate', request_id, transport='websocket') as root_span:
+            try:
+                job = await sync_to_async(_prepare, thread_sensitive=False)(message, self.headers, root_span)
+                if 'error' in job:
+                    await self.send({'type': 'error', 'id': gen_id, **job['error']})
+                    return
+                await self.send({'type': 'accepted', 'id': gen_id, 'requestId': request_id})
+
+                if job['cached'] is not None:
+                    (cached, similarity) = job['cached']
+                    root_span.set_attribute('cache_similarity', round(similarity, 3))
+                    await self.send({'type': 'cache', 'id': gen_id, 'hit': True, 'similarity': round(similarity, 3)})
+                    await self.send({'type': 'content', 'id': gen_id, 'content': cached['text']})
+                    await self.send({'type': 'article', 'id': gen_id, **cached['article']})
+                    await self.send({'type': 'done', 'id': gen_id, 'chunks': 1})
+                    result = 'cached'
+                    return
+
+                # 与 SSE 共用生成名额：排队期间不调用上游
+                ticket = generation_queue.enter()
+                try:
+                    if not await self._wait_for_slot(gen_id, ticket, root_span):
+                        return
+                    result = await self._stream(gen_id, job, progress, started, root_span)
+                finally:
+                    generation_queue.leave(ticket)
+            except asyncio.CancelledError:
+                # 客户端取消或断开：上游请求已随 _relay 一起中止
+                result = 'cancelled'
+                root_span.set_attribute('cancelled', True)
+                logger.info(f"WebSocket 生成已取消 - 已发送 {progress['chunks']} 个数据块", extra={'sample': 'request'})
+                await self.send({'type': 'cancelled', 'id': gen_id})
+            except Exception as e:
+                root_span.set_error(e)
+                logger.error(f"WebSocket 生成失败: {e}", exc_info=True)
+                await self.send({'type': 'error', 'id': gen_id, **_error_payload(e)})
+            finally:
+                metrics.inc('websocket_generations_total', result=result)
+
+    async def _wait_for_slot(self, gen_id: str, ticket, root_span) -> bool:
+        """排队直到取得生成名额，位置变化时推送 queued；超过 SSE_QUEUE_TIMEOUT 时推送可重试的错误并返回 False"""
+        from .views import _error_payload
+
+        if ticket.admitted:
+            return True
+        position = None
+        while not ticket.admitted:
+            waited = time.monotonic() - ticket.entered
+            if waited >= config.SSE_QUEUE_TIMEOUT:
+                metrics.inc('sse_queue_timeouts_total')
+                logger.warning(f"排队超时 - 已等待 {waited:.1f} 秒")
+                await self.send({'type': 'error', 'id': gen_id, **_error_payload(QueueTimeout(waited))})
+                return False
+            current = generation_queue.position(ticket)
+            if current and current != position:
+                position = current
+                await self.send({'type': 'queued', 'id': gen_id, 'position': position})
+            await generation_queue.wait_async(ticket, min(1.0, config.SSE_QUEUE_TIMEOUT - waited))
+        root_span.set_attribute('queue_wait_ms', round((time.monotonic() - ticket.entered) * 1000, 1))
+        return True
+
+    async def _stream(self, gen_id: str, job: Dict, progress: Dict, started: float, root_span) -> str:
+        """转发上游输出，完成后保存文章；返回结果（done / error）"""
+        from .views import _error_payload
+
+        ticker = None
+        if config.WEBSOCKET_PROGRESS_INTERVAL > 0:
+            ticker = asyncio.ensure_future(self._report_progress(gen_id, progress, started))
+
+        chunks = []
+        try:
+            async with aclosing(_relay(job['stream'])) as stream:
+                async for chunk in stream:
+                    if not chunk:
+                        continue
+                    progress['phase'] = 'generating'
+                    progress['chunks'] += 1
+                    progress['chars'] += len(chunk)
+                    chunks.append(chunk)
+                    await self.send({'type': 'content', 'id': gen_id, 'content': chunk})
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            root_span.set_error(e)
+            logger.error(f"WebSocket 生成失败: {e}")
+            await self.send({'type': 'error', 'id': gen_id, **_error_payload(e)})
+            return 'error'
+        finally:
+            if ticker is not None:
+                ticker.cancel()
+
+        text = ''.join(chunks)
+        article_event = await sync_to_async(_finish)(job, text)
+        if article_event:
+            await self.send({'type': 'article', 'id': gen_id, **article_event})
+        await self.send({'type': 'done', 'id': gen_id, 'chunks': progress['chunks']})
+        root_span.set_attribute('chunks', progress['chunks'])
+        return 'done'
+
+    async def _report_progress(self, gen_id: str, progress: Dict, started: float):
+        while True:
+            await asyncio.sleep(config.WEBSOCKET_PROGRESS_INTERVAL)
+            await self.send({'type': 'progress', 'id': gen_id, **progress,
+                             'elapsedMs': round((time.monotonic() - started) * 1000)})
+
+
+def _prepare(message: Dict, headers, root_span) -> Dict:
+    """校验请求、选择生成器并查找近似重复缓存（同步代码，在线程中执行）"""
+    from .ai_service import get_ai_generator, get_tenant_generator, parse_credentials
+    from .semantic_cache import generation_cache
+    from .serializers import GenerateRequestSerializer
+
+    with span('request.parse'):
+        serializer = GenerateRequestSerializer(data=message)
+        valid = serializer.is_valid()
+    if not valid:
+        return {'error': {'error': '请求参数错误', 'details': serializer.errors}}
+
+    data = serializer.validated_data
+    if data.get('variants', 1) > 1:
+        return {'error': {'error': 'WebSocket 暂不支持多版本生成，请使用 /api/generate-stream',
+                          'code': 'unsupported', 'retryable': False}}
+    theme, content = data['theme'], data['content']
+    images = data.get('images', [])
+    template_type = data.get('templateType', 'normal')
+    root_span.set_attribute('template_type', template_type)
+    logger.info(f"开始 WebSocket 生成 - 主题: {theme[:config.LOG_PAYLOAD_CHARS]}, 模板: {template_type}", extra={'sample': 'request'})
+
+    try:
+        credentials = parse_credentials(headers)
+    except ValueError as e:
+        return {'error': {'error': str(e)}}
+    if credentials is not None:
+        root_span.set_attribute('key_id', credentials.key_id)
+        generator = get_tenant_generator(credentials)
+    else:
+        generator = get_ai_generator()
+
+    job = {'theme': theme, 'content': content, 'template_type': template_type, 'partition': None, 'cached': None}
+    if config.ENABLE_CACHE and data.get('cache', True):
+        job['partition'] = (template_type, generator.model_name,
+                            credentials.key_id if credentials is not None else '', tuple(images))
+        with span('cache.lookup') as lookup_span:
+            job['cached'] = generation_cache.lookup(job['partition'], theme, content)
+            lookup_span.set_attribute('hit', job['cached'] is not None)
+    if job['cached'] is None:
+        if data.get('mode') == 'outline':
+            root_span.set_attribute('mode', 'outline')
+            job['stream'] = generator.generate_outline_stream(theme, content, images, template_type)
+        else:
+            job['stream'] = generator.generate_content_stream(theme, content, images, template_type)
+    return job
+
+
+def _finish(job: Dict, text: str):
+    """保存文章并写入近似重复缓存，返回文章事件数据"""
+    from .semantic_cache import generation_cache
+    from .views import _store_article
+
+    article_event = _store_article(text, job['template_type'], job['theme'])
+    if article_event and job['partition'] is not None:
+        generation_cache.add(job['partition'], job['theme'], job['content'], {'text': text, 'article': article_event})
+    return article_event
+
+
+async def _relay(async_gen):
+    """
+    在后台事件循环中读取上游（复用上游连接池），数据块经队列转发到当前事件循环
+
+    调用方取消时同时取消后台循环中的读取任务，关闭上游连接
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+
+    def put(item):
+        loop.call_soon_threadsafe(queue.put_nowait, item)
+
+    async def pump():
+        try:
+            async for chunk in async_gen:
+                put(chunk)
+            put(_END)
+        except Exception as e:
+            put(e)
+        finally:
+            await async_gen.aclose()
+
+    future = background_loop.submit(pump())
+    try:
+        while True:
+            item = await queue.get()
+            if item is _END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        future.cancel()
+
+
+async def _reject(receive, send):
+    """未启用或路径不匹配的 WebSocket 连接：直接拒绝"""
+    message = await receive()
+    if message['type'] == 'websocket.connect':
+        await send({'type': 'websocket.close', 'code': 1008})
+
+
+def route_websockets(django_application):
+    """包装 Django 的 ASGI 应用：/api/ws 的 WebSocket 连接由生成接口处理，其余交给 Django"""
+
+    async def application(scope, receive, send):
+        if scope['type'] == 'websocket':
+            if config.WEBSOCKET_ENABLED and scope['path'].rstrip('/') == WEBSOCKET_PATH:
+                await _Connection(scope, send).serve(receive)
+            else:
+                await _reject(receive, send)
+            return
+        await django_application(scope, receive, send)
+
+    return application
@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "textpix.settings")
 
 application = get_asgi_application()
+
+# /api/ws 的 WebSocket 连接交给生成接口（需在 Django 初始化之后导入）
+from contentgenerater.websocket import route_websockets  # noqa: E402
+
+application = route_websockets(application)
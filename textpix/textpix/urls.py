@@ -18,23 +18,126 @@ Including another URLconf
 from django.urls import include, path, re_path
 from django.http import HttpResponse
 from django.conf import settings
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+import gzip
+import hashlib
 import os
+import threading
+from typing import NamedTuple
+
+try:
+    import brotli
+except ImportError:  # brotli 为可选依赖，未安装时只提供 gzip
+    brotli = None
+
+
+class ReactIndex(NamedTuple):
+    """某一版本 index.html 的不可变快照：压缩版本、ETag 和修改时间总是来自同一次读取"""
+    
+    stat_key: tuple
+    variants: dict
+    etag: str
+    last_modified: int
+    
+    def choose_encoding(self, accept_encoding):
+        """根据 Accept-Encoding 选择压缩版本（优先 brotli）"""
+        accepted = set()
+        for part in accept_encoding.split(','):
+            coding, *params = part.strip().split(';')
+            quality = 1.0
+            for param in params:
+                name, _, value = param.strip().partition('=')
+                if name == 'q':
+                    try:
+                        quality = float(value)
+                    except ValueError:
+                        quality = 0.0
+            if quality > 0:
+                accepted.add(coding.strip().lower())
+        
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and (encoding in accepted or '*' in accepted):
+                return encoding
+        return 'identity'
+
+
+class ReactIndexCache:
+    """
+    React index.html 内存缓存
+    
+    文件只在 mtime/大小变化时重新读取，同时预先计算 gzip 和 brotli 压缩版本；
+    重新加载时整体替换快照，并发请求读到的要么是旧版本、要么是新版本，不会混用
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._snapshot = None
+    
+    def load(self) -> ReactIndex:
+        """返回最新的快照（文件变化时重新加载），文件不存在时抛出 FileNotFoundError"""
+        stat = os.stat(self.path)
+        stat_key = (stat.st_mtime_ns, stat.st_size)
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.stat_key == stat_key:
+            return snapshot
+        
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None or snapshot.stat_key != stat_key:
+                with open(self.path, 'rb') as f:
+                    body = f.read()
+                
+                variants = {'identity': body, 'gzip': gzip.compress(body, compresslevel=9, mtime=0)}
+                if brotli is not None:
+                    variants['br'] = brotli.compress(body, quality=11)
+                
+                # 不同压缩版本共用一个弱 ETag
+                snapshot = ReactIndex(
+                    stat_key=stat_key,
+                    variants=variants,
+                    etag='W/"%s"' % hashlib.sha256(body).hexdigest()[:32],
+                    last_modified=int(stat.st_mtime),
+                )
+                self._snapshot = snapshot
+        return snapshot
+
+
+_react_index = ReactIndexCache(os.path.join(settings.REACT_BUILD_DIR, 'index.html'))
+
 
 def serve_react(request):
-    """服务 React 前端的 index.html"""
-    index_path = os.path.join(settings.BASE_DIR.parent, 'my-react-app', 'build', 'index.html')
+    """服务 React 前端的 index.html（内存缓存 + 预压缩 + 条件请求）"""
     try:
-        with open(index_path, 'r', encoding='utf-8') as f:
-            return HttpResponse(f.read(), content_type='text/html')
+        # 整个请求只使用这一个快照
+        index = _react_index.load()
     except FileNotFoundError:
         return HttpResponse('React build not found. Run npm run build first.', status=404)
+    
+    encoding = index.choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    response = HttpResponse(index.variants[encoding], content_type='text/html; charset=utf-8')
+    if encoding != 'identity':
+        response['Content-Encoding'] = encoding
+    response['ETag'] = index.etag
+    response['Last-Modified'] = http_date(index.last_modified)
+    # SPA 外壳需要每次校验，命中时返回 304
+    response['Cache-Control'] = 'no-cache'
+    patch_vary_headers(response, ('Accept-Encoding',))
+    
+    return get_conditional_response(
+        request,
+        etag=index.etag,
+        last_modified=index.last_modified,
+        response=response,
+    )
 
 urlpatterns = [
     path('api/', include('contentgenerater.urls')),  
 ]
 
-# 生产环境：让 Django 服务 React 前端
-if os.path.exists(os.path.join(settings.BASE_DIR.parent, 'my-react-app', 'build', 'index.html')):
+# 生产环境：让 Django 服务 React 前端（APP_PROFILE=api 时只提供 API）
+if not settings.API_ONLY and os.path.exists(_react_index.path):
     urlpatterns += [
         # 所有非 API 路由都返回 React 的 index.html（支持前端路由）
         re_path(r'^(?!api/).*$', serve_react),